@@ -0,0 +1,262 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Flask, g, jsonify, request
+
+from config.config import Config
+from app.api import valid_api_key
+from app.metrics import ADMISSION_REJECTIONS_TOTAL, ADMISSION_CONCURRENCY_LIMIT
+
+# Classes de prioridade
+CRITICAL = 'critical'  # Nunca rejeitadas (health check e scrape de métricas)
+HIGH = 'high'  # Escritas (criação e alteração de pedidos)
+LOW = 'low'  # Leituras, listagens e analytics
+STREAMING = 'streaming'  # Conexões longas: só rate limit (limitadas por CHANGE_FEED_MAX_SUBSCRIBERS)
+
+CRITICAL_ENDPOINTS = frozenset(('/health', '/metrics'))
+# Ficam abertas por minutos ou horas: no limite de concorrência, ocupariam vagas e
+# distorceriam a latência usada para ajustá-lo
+STREAMING_ENDPOINTS = frozenset(('/orders/changes',))
+
+# Motivos de rejeição
+RATE_LIMITED = 'rate_limited'  # 429: API key acima da taxa permitida
+CONCURRENCY_LIMIT = 'concurrency_limit'  # 503: processo no limite de requisições simultâneas
+
+
+def classify(method: str, endpoint: str) -> str:
+    if endpoint in CRITICAL_ENDPOINTS:
+        return CRITICAL
+    if endpoint in STREAMING_ENDPOINTS:
+        return STREAMING
+    return HIGH if method in ('POST', 'PUT', 'PATCH', 'DELETE') else LOW
+
+
+def holds_slot(priority: str) -> bool:
+    """
+    Se uma requisição admitida com essa prioridade ocupa uma vaga do limite de
+    concorrência (e portanto deve chamar release() ao final).
+    """
+    return priority in (HIGH, LOW)
+
+
+class RateLimiter:
+    """
+    Token bucket por chave (API key ou endereço do cliente): 'rate' tokens por
+    segundo, acumulando no máximo 'burst'. Guarda no máximo 'max_keys' buckets;
+    os usados há mais tempo são descartados (e recomeçam cheios).
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self._rate = rate
+        self._burst = burst
+        self._max_keys = max_keys
+        self._buckets = OrderedDict()  # chave -> [tokens, instante da última recarga]
+        self._lock = threading.Lock()
+
+    def acquire(self, key) -> float:
+        """
+        Consome um token da chave. Retorna 0 se permitido, senão os segundos até
+        haver um token disponível.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self._burst, now]
+                if len(self._buckets) > self._max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self._rate
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Limite de requisições simultâneas ajustado pela latência observada
+    (algoritmo de gradiente, no estilo do concurrency-limits da Netflix).
+
+    Compara a média móvel curta da latência com a latência "sem carga": quando
+    a média passa de 'tolerance' x essa referência, há fila se formando e o
+    limite cai proporcionalmente (no máximo pela metade por amostra); caso
+    contrário cresce aos poucos (folga de sqrt(limite)).
+
+    A referência sem carga é o menor valor da média curta visto sob carga e só
+    volta a subir (média lenta) com amostras de quando menos da metade do
+    limite estava em uso; essas amostras não alteram o limite, pois não dizem
+    nada sobre a capacidade.
+
+    Requisições de prioridade baixa só entram enquanto o uso estiver abaixo de
+    'low_priority_share' do limite, reservando o restante para as de prioridade alta.
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, tolerance: float,
+                 low_priority_share: float, smoothing: float = 0.2, short_window: int = 10,
+                 baseline_window: int = 600):
+        self.limit = float(initial)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._tolerance = tolerance
+        self._low_priority_share = low_priority_share
+        self._smoothing = smoothing
+        self._short_alpha = 1.0 / short_window
+        self._baseline_alpha = 1.0 / baseline_window
+        self._short = None
+        self._baseline = None
+        self._inflight = 0
+        self._lock = threading.Lock()
+        ADMISSION_CONCURRENCY_LIMIT.set(int(self.limit))
+
+    def try_acquire(self, priority: str) -> bool:
+        share = 1.0 if priority == HIGH else self._low_priority_share
+        with self._lock:
+            if self._inflight >= max(1, int(self.limit * share)):
+                return False
+            self._inflight += 1
+            return True
+
+    def release(self, latency: float):
+        with self._lock:
+            inflight = self._inflight
+            self._inflight -= 1
+            self._update(latency, inflight)
+
+    def _update(self, latency: float, inflight: int):
+        if self._short is None:
+            self._short = self._baseline = latency
+            return
+        self._short += (latency - self._short) * self._short_alpha
+        if inflight < self.limit / 2:
+            self._baseline += (self._short - self._baseline) * self._baseline_alpha
+            return
+        self._baseline = min(self._baseline, self._short)
+        if self._short <= 0:
+            return
+
+        gradient = max(0.5, min(1.0, self._tolerance * self._baseline / self._short))
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        new_limit = self.limit * (1 - self._smoothing) + new_limit * self._smoothing
+        self.limit = max(self._min_limit, min(self._max_limit, new_limit))
+        ADMISSION_CONCURRENCY_LIMIT.set(int(self.limit))
+
+
+class AdmissionController:
+    """
+    Decide se uma requisição é atendida: prioridade crítica sempre entra; as
+    demais passam pelo rate limit da API key e, exceto streams, pelo limite
+    adaptativo de concorrência. admit() retorna None quando a requisição entra
+    (e então, se holds_slot(prioridade), release() deve ser chamado ao final)
+    ou (status, motivo, retry_after).
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, concurrency_limit: AdaptiveConcurrencyLimit,
+                 retry_after_seconds: float):
+        self._rate_limiter = rate_limiter
+        self._concurrency = concurrency_limit
+        self._retry_after = retry_after_seconds
+
+    def admit(self, priority: str, client_key):
+        if priority == CRITICAL:
+            return None
+        if self._rate_limiter is not None:
+            wait = self._rate_limiter.acquire(client_key)
+            if wait:
+                ADMISSION_REJECTIONS_TOTAL.labels(reason=RATE_LIMITED, priority=priority).inc()
+                return 429, RATE_LIMITED, wait
+        if not holds_slot(priority):
+            return None
+        if not self._concurrency.try_acquire(priority):
+            ADMISSION_REJECTIONS_TOTAL.labels(reason=CONCURRENCY_LIMIT, priority=priority).inc()
+            return 503, CONCURRENCY_LIMIT, self._retry_after
+        return None
+
+    def release(self, latency: float):
+        self._concurrency.release(latency)
+
+
+REJECTION_MESSAGES = {
+    RATE_LIMITED: "Limite de requisições excedido para esta chave de API. Tente novamente mais tarde.",
+    CONCURRENCY_LIMIT: "Serviço sobrecarregado. Tente novamente em instantes."
+}
+
+
+def rate_limit_key(api_key, client_address: str) -> str:
+    """
+    Chave do rate limit: a API key só depois de validada; sem ela (ou com uma
+    inválida) vale o endereço do cliente, para que variar o cabeçalho não crie
+    buckets novos a cada requisição.
+    """
+    return api_key if valid_api_key(api_key) else client_address
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """
+    Controlador compartilhado pela aplicação Flask e pela ASGI; None se o
+    controle de admissão estiver desativado.
+    """
+    global _controller
+    if not Config.ADMISSION_CONTROL_ENABLED:
+        return None
+    with _controller_lock:
+        if _controller is None:
+            rate_limiter = None
+            if Config.ADMISSION_RATE_PER_KEY > 0:
+                rate_limiter = RateLimiter(Config.ADMISSION_RATE_PER_KEY, Config.ADMISSION_BURST_PER_KEY,
+                                           Config.ADMISSION_MAX_TRACKED_KEYS)
+            _controller = AdmissionController(
+                rate_limiter,
+                AdaptiveConcurrencyLimit(
+                    initial=Config.ADMISSION_INITIAL_CONCURRENCY,
+                    min_limit=Config.ADMISSION_MIN_CONCURRENCY,
+                    max_limit=Config.ADMISSION_MAX_CONCURRENCY,
+                    tolerance=Config.ADMISSION_LATENCY_TOLERANCE,
+                    low_priority_share=Config.ADMISSION_LOW_PRIORITY_SHARE
+                ),
+                Config.ADMISSION_RETRY_AFTER_SECONDS
+            )
+        return _controller
+
+
+def init_admission_control(app: Flask):
+    """
+    Registra o controle de admissão na aplicação Flask. Deve ser chamado depois
+    de init_metrics_and_middleware, para que as rejeições também apareçam nas
+    métricas de requisição (status 429/503).
+    """
+    controller = get_admission_controller()
+    if controller is None:
+        return
+
+    @app.before_request
+    def admission_hook():
+        endpoint = request.url_rule.rule if request.url_rule is not None else None
+        priority = classify(request.method, endpoint)
+        rejection = controller.admit(priority, rate_limit_key(request.headers.get('X-API-Key'), request.remote_addr))
+        if rejection is not None:
+            status_code, reason, retry_after = rejection
+            response = jsonify({"error": REJECTION_MESSAGES[reason]})
+            response.status_code = status_code
+            response.headers['Retry-After'] = retry_after_header(retry_after)
+            return response
+        if holds_slot(priority):
+            g.admission_start = time.perf_counter()
+
+    @app.teardown_request
+    def admission_release(_exc):
+        start = g.pop('admission_start', None)
+        if start is not None:
+            controller.release(time.perf_counter() - start)
@@ -0,0 +1,195 @@
+import threading
+import time
+from array import array
+
+# Pedidos nesses status não contam como receita
+NON_REVENUE_STATUSES = frozenset(("cancelled", "returned"))
+
+
+class SalesRollups:
+    """
+    Agregados de vendas mantidos incrementalmente a cada escrita.
+
+    - receita e unidades por produto, receita e pedidos por cliente;
+    - pedidos por status e contagem de transições de status (de -> para);
+    - janela recente em buffers circulares de 'bucket_seconds' (um slot por
+      intervalo, reaproveitado quando o intervalo sai da janela).
+
+    Cada criação ou atualização ajusta os agregados com deltas (contribuição
+    do registro anterior subtraída, a do novo somada). O OrderStore aplica os
+    deltas sob o seu lock (ver OrderStore.rollups), na ordem das alterações.
+    Pedidos cancelados ou devolvidos deixam de contar como receita.
+
+    export_state()/load_state() permitem gravar os agregados junto do snapshot
+    da persistência, para que sobrevivam a reinícios (inclusive as transições
+    de status e os pedidos já arquivados, que não estão mais no store).
+    """
+
+    def __init__(self, bucket_seconds: int, window_buckets: int):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self._lock = threading.Lock()
+        self._orders = 0
+        self._revenue = 0.0
+        self._by_product = {}  # product_id -> [receita, unidades]
+        self._by_customer = {}  # customer_id -> [receita, pedidos]
+        self._by_status = {}
+        self._transitions = {}  # (status_anterior, status_novo) -> quantidade
+        self._bucket_ids = array('q', [-1] * window_buckets)
+        self._bucket_orders = array('q', [0] * window_buckets)
+        self._bucket_revenue = array('d', [0.0] * window_buckets)
+
+    def rebuild(self, records):
+        """
+        Recalcula os agregados a partir dos pedidos existentes (inicialização).
+        """
+        for record in records:
+            self.record_created(record)
+
+    def export_state(self) -> tuple:
+        """
+        Cópia dos agregados em tipos serializáveis com marshal.
+        """
+        with self._lock:
+            return (
+                self._orders,
+                self._revenue,
+                {product_id: tuple(totals) for product_id, totals in self._by_product.items()},
+                {customer_id: tuple(totals) for customer_id, totals in self._by_customer.items()},
+                dict(self._by_status),
+                dict(self._transitions),
+                self.bucket_seconds,
+                self._bucket_ids.tolist(),
+                self._bucket_orders.tolist(),
+                self._bucket_revenue.tolist()
+            )
+
+    def load_state(self, state: tuple):
+        """
+        Restaura os agregados de export_state(). A janela recente é descartada se
+        o tamanho do intervalo ou da janela mudou na configuração.
+        """
+        (orders, revenue, by_product, by_customer, by_status, transitions,
+         bucket_seconds, bucket_ids, bucket_orders, bucket_revenue) = state
+        with self._lock:
+            self._orders = orders
+            self._revenue = revenue
+            self._by_product = {product_id: list(totals) for product_id, totals in by_product.items()}
+            self._by_customer = {customer_id: list(totals) for customer_id, totals in by_customer.items()}
+            self._by_status = dict(by_status)
+            self._transitions = dict(transitions)
+            if bucket_seconds == self.bucket_seconds and len(bucket_ids) == self.window_buckets:
+                self._bucket_ids = array('q', bucket_ids)
+                self._bucket_orders = array('q', bucket_orders)
+                self._bucket_revenue = array('d', bucket_revenue)
+
+    def record_created(self, record):
+        with self._lock:
+            self._orders += 1
+            self._by_status[record.status] = self._by_status.get(record.status, 0) + 1
+            customer = self._by_customer.setdefault(record.customer_id, [0.0, 0])
+            customer[1] += 1
+            slot = self._slot(record.created_at, create=True)
+            if slot is not None:
+                self._bucket_orders[slot] += 1
+            self._apply_revenue(record, 1, slot)
+
+    def record_updated(self, previous, record):
+        with self._lock:
+            if previous.status != record.status:
+                self._by_status[previous.status] = self._by_status.get(previous.status, 0) - 1
+                self._by_status[record.status] = self._by_status.get(record.status, 0) + 1
+                transition = (previous.status, record.status)
+                self._transitions[transition] = self._transitions.get(transition, 0) + 1
+            if previous.customer_id != record.customer_id:
+                self._by_customer.setdefault(previous.customer_id, [0.0, 0])[1] -= 1
+                self._by_customer.setdefault(record.customer_id, [0.0, 0])[1] += 1
+            slot = self._slot(record.created_at)
+            self._apply_revenue(previous, -1, slot)
+            self._apply_revenue(record, 1, slot)
+
+    def record_deleted(self, record):
+        """
+        Retira a contribuição atual de um pedido desfeito (criação não persistida).
+        """
+        with self._lock:
+            self._orders -= 1
+            self._by_status[record.status] = self._by_status.get(record.status, 0) - 1
+            self._by_customer.setdefault(record.customer_id, [0.0, 0])[1] -= 1
+            slot = self._slot(record.created_at)
+            if slot is not None:
+                self._bucket_orders[slot] -= 1
+            self._apply_revenue(record, -1, slot)
+
+    def _apply_revenue(self, record, sign: int, slot):
+        if record.status in NON_REVENUE_STATUSES:
+            return
+        amount = sign * record.total_amount
+        self._revenue += amount
+        self._by_customer.setdefault(record.customer_id, [0.0, 0])[0] += amount
+        for item in record.items:
+            product = self._by_product.setdefault(item.product_id, [0.0, 0])
+            product[0] += sign * item.price_unit * item.quantity
+            product[1] += sign * item.quantity
+        if slot is not None:
+            self._bucket_revenue[slot] += amount
+
+    def _slot(self, timestamp: float, create: bool = False):
+        """
+        Posição do buffer circular para o intervalo de 'timestamp', ou None se
+        o intervalo já saiu da janela. Com create=True, um slot ocupado por um
+        intervalo mais antigo é zerado e reaproveitado.
+        """
+        bucket_id = int(timestamp // self.bucket_seconds)
+        slot = bucket_id % self.window_buckets
+        current = self._bucket_ids[slot]
+        if current == bucket_id:
+            return slot
+        if create and current < bucket_id:
+            self._bucket_ids[slot] = bucket_id
+            self._bucket_orders[slot] = 0
+            self._bucket_revenue[slot] = 0.0
+            return slot
+        return None
+
+    # --- Consultas (custo independente da quantidade de pedidos) ---
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "orders": self._orders,
+                "revenue": round(self._revenue, 2),
+                "orders_by_status": {status: count for status, count in self._by_status.items() if count},
+                "status_transitions": [{"from": old, "to": new, "count": count}
+                                       for (old, new), count in sorted(self._transitions.items())]
+            }
+
+    def products(self) -> dict:
+        with self._lock:
+            return {product_id: {"revenue": round(revenue, 2), "units": units}
+                    for product_id, (revenue, units) in sorted(self._by_product.items())}
+
+    def customer(self, customer_id: str):
+        with self._lock:
+            totals = self._by_customer.get(customer_id)
+            if totals is None:
+                return None
+            return {"customer_id": customer_id, "revenue": round(totals[0], 2), "orders": totals[1]}
+
+    def timeseries(self, buckets: int, now: float = None) -> list:
+        """
+        Pedidos e receita dos últimos 'buckets' intervalos (o mais antigo primeiro).
+        """
+        now = time.time() if now is None else now
+        last_bucket = int(now // self.bucket_seconds)
+        series = []
+        with self._lock:
+            for bucket_id in range(last_bucket - buckets + 1, last_bucket + 1):
+                slot = bucket_id % self.window_buckets
+                present = self._bucket_ids[slot] == bucket_id
+                series.append({
+                    "start": bucket_id * self.bucket_seconds,
+                    "orders": self._bucket_orders[slot] if present else 0,
+                    "revenue": round(self._bucket_revenue[slot], 2) if present else 0.0
+                })
+        return series
@@ -0,0 +1,112 @@
+import json
+import math
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, parse_options_header
+
+from config.config import Config
+from app.changes import NDJSON_MIMETYPE
+from app.metrics import APP_ERRORS_TOTAL
+from app.services import open_change_stream
+
+# Regras HTTP compartilhadas pelas rotas Flask (app/routes.py) e pela aplicação
+# ASGI (app/asgi.py): autenticação, leitura de parâmetros e corpo e o mapeamento
+# de erros para (corpo, status). Cada lado só converte o resultado na sua resposta.
+
+UNAUTHORIZED_MESSAGE = "Acesso não autorizado. Chave de API inválida ou ausente."
+
+
+def valid_api_key(api_key) -> bool:
+    return bool(api_key) and api_key == Config.API_KEY_REQUIRED
+
+
+def unauthorized(endpoint: str, error_type: str = 'unauthorized_access') -> tuple:
+    APP_ERRORS_TOTAL.labels(endpoint=endpoint, error_type=error_type).inc()
+    return {"error": UNAUTHORIZED_MESSAGE}, 401
+
+
+def service_response(result: dict) -> tuple:
+    """(corpo, status) de um resultado dos serviços."""
+    return result, result.get("status_code", 500)
+
+
+def json_body(content_type: str, body: bytes):
+    """
+    Corpo JSON da requisição, ou None se o Content-Type não for JSON ou o corpo
+    for inválido (mesma regra de request.get_json(silent=True) do Flask).
+    """
+    mimetype, _ = parse_options_header(content_type)
+    if mimetype != 'application/json' and not (mimetype.startswith('application/') and mimetype.endswith('+json')):
+        return None
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+def create_order_error(api_key, order_data):
+    """
+    Erro (corpo, status) de POST /orders antes de chamar o serviço, ou None.
+    """
+    if not valid_api_key(api_key):
+        return unauthorized('/orders')
+    if not order_data:
+        APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='empty_payload').inc()
+        return {"error": "Requisição inválida. O corpo deve ser um JSON."}, 400
+    return None
+
+
+def int_arg(args, name: str):
+    # Valor não numérico vira inválido (-1) para o serviço responder 400
+    if name not in args:
+        return None
+    try:
+        return int(args.get(name))
+    except ValueError:
+        return -1
+
+
+def float_arg(args, name: str):
+    # Valor não numérico vira inválido (NaN) para o serviço responder 400
+    if name not in args:
+        return None
+    try:
+        return float(args.get(name))
+    except ValueError:
+        return math.nan
+
+
+def page_args(args) -> dict:
+    """
+    Parâmetros de paginação e de intervalo de tempo da query string.
+    """
+    return {
+        "limit": int_arg(args, 'limit'),
+        "cursor": args.get('cursor'),
+        "since": float_arg(args, 'since'),
+        "until": float_arg(args, 'until')
+    }
+
+
+def list_orders_args(args) -> dict:
+    """Parâmetros de GET /orders (filtros mais paginação)."""
+    return {"status": args.get('status'), "customer_id": args.get('customer_id'), **page_args(args)}
+
+
+def wants_ndjson(args, accept: str) -> bool:
+    return args.get('format') == 'ndjson' or parse_accept_header(accept, MIMEAccept).best == NDJSON_MIMETYPE
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    return parse_etags(if_none_match).contains_weak(etag)
+
+
+def order_change_stream(args, accept: str, last_event_id: str, blocking: bool) -> tuple:
+    """
+    Abre o stream de GET /orders/changes: retorna (stream, None) ou (None, (corpo, status)).
+    """
+    stream, error_result = open_change_stream(args.get('after') or last_event_id, wants_ndjson(args, accept),
+                                              blocking)
+    if stream is None:
+        return None, service_response(error_result)
+    return stream, None
@@ -0,0 +1,325 @@
+import glob
+import hashlib
+import marshal
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from app.ids import format_order_id, lock_file, parse_order_id
+from app.metrics import ARCHIVE_READS_TOTAL, ARCHIVED_ORDERS_TOTAL, ARCHIVE_RUN_DURATION_SECONDS
+from app.store import order_from_tuple, order_to_tuple
+
+# Cabeçalho de cada bloco: identificador, quantidade de pedidos, tamanho comprimido e CRC32
+# (do restante do bloco). Depois vêm o maior ID do bloco (inteiro do gerador, 0 se nenhum),
+# os hashes dos IDs (8 bytes cada; ambos sem compressão, para reconstruir o índice sem
+# descomprimir) e o payload zlib(marshal(lista de pedidos)).
+# Blocos 'ARCB' (formato anterior) não têm o maior ID: ele é lido do payload na abertura.
+_BLOCK_MAGIC = b'ARC2'
+_LEGACY_BLOCK_MAGIC = b'ARCB'
+_BLOCK_HEADER = struct.Struct('<4sIII')
+_BLOCK_HIGHEST = struct.Struct('<Q')
+_HASH_SIZE = 8
+
+
+def _hashes_offset(magic: bytes) -> int:
+    # Início dos hashes no corpo do bloco (depois do cabeçalho)
+    return _BLOCK_HIGHEST.size if magic == _BLOCK_MAGIC else 0
+
+
+def _highest_id_value(order_ids) -> int:
+    return max((parse_order_id(order_id) or 0 for order_id in order_ids), default=0)
+
+
+def _id_hash(order_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(order_id.encode(), digest_size=_HASH_SIZE).digest(), 'little')
+
+
+class _Segment:
+    """
+    Um arquivo de segmento e seu índice compacto: hashes dos IDs ordenados
+    (array 'Q') e, na mesma posição, o offset do bloco que contém o pedido.
+    São 16 bytes por pedido arquivado, em vez de um objeto por pedido.
+    """
+    __slots__ = ("number", "path", "fd", "size", "hashes", "offsets", "count")
+
+    def __init__(self, number: int, path: str):
+        self.number = number
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        self.size = 0
+        self.hashes = array('Q')
+        self.offsets = array('Q')
+        self.count = 0
+
+    def add_to_index(self, entries: list):
+        """
+        Inclui pares (hash, offset do bloco) no índice, mantendo-o ordenado: as
+        entradas novas são ordenadas entre si e intercaladas nos arrays
+        existentes, copiados em fatias entre os pontos de inserção.
+        """
+        hashes = array('Q')
+        offsets = array('Q')
+        previous = 0
+        for key, offset in sorted(entries):
+            position = bisect_right(self.hashes, key, previous)
+            hashes.extend(self.hashes[previous:position])
+            offsets.extend(self.offsets[previous:position])
+            hashes.append(key)
+            offsets.append(offset)
+            previous = position
+        hashes.extend(self.hashes[previous:])
+        offsets.extend(self.offsets[previous:])
+        self.hashes = hashes
+        self.offsets = offsets
+        self.count = len(hashes)
+
+    def block_offsets(self, key: int) -> list:
+        position = bisect_left(self.hashes, key)
+        offsets = []
+        while position < len(self.hashes) and self.hashes[position] == key:
+            offsets.append(self.offsets[position])
+            position += 1
+        return offsets
+
+
+class OrderArchive:
+    """
+    Arquivo append-only de pedidos finalizados, em segmentos de até
+    'segment_max_bytes' com blocos comprimidos de até 'block_records' pedidos.
+
+    Leituras procuram o ID nos índices dos segmentos (do mais novo para o mais
+    antigo, de forma que uma cópia mais recente prevalece), leem apenas o bloco
+    correspondente com pread e mantêm os pedidos lidos num cache LRU.
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int, block_records: int, cache_size: int,
+                 compress_level: int = 6):
+        self._directory = directory
+        self._segment_max_bytes = segment_max_bytes
+        self._block_records = block_records
+        self._cache_size = cache_size
+        self._compress_level = compress_level
+        self._segments = []
+        self._highest = 0  # Maior ID arquivado (inteiro do gerador)
+        self._cache = OrderedDict()  # order_id -> OrderRecord
+        self._lock = threading.Lock()  # Índices e cache
+        self._write_lock = threading.Lock()  # Um escritor por vez
+        self._lock_fd = None
+        os.makedirs(directory, exist_ok=True)
+
+    # --- Abertura ---
+
+    def open(self):
+        """
+        Reconstrói os índices a partir dos cabeçalhos dos blocos (sem descomprimir,
+        exceto blocos do formato anterior, para achar o maior ID) e descarta um
+        bloco final incompleto, gravado parcialmente numa queda.
+        O diretório é travado: só um processo grava nos segmentos.
+        """
+        self._lock_fd = lock_file(os.path.join(self._directory, 'LOCK'))
+        if self._lock_fd is None:
+            raise RuntimeError(f"O diretório de arquivo {self._directory} já está em uso por outro processo.")
+        for path in sorted(glob.glob(os.path.join(self._directory, 'archive-*.seg'))):
+            segment = _Segment(int(os.path.basename(path)[8:-4]), path)
+            entries = []
+            for offset, hashes, highest in self._scan(segment):
+                entries.extend((key, offset) for key in hashes)
+                self._highest = max(self._highest, highest)
+            segment.add_to_index(entries)
+            self._segments.append(segment)
+        if not self._segments:
+            self._segments.append(self._new_segment(1))
+
+    def _scan(self, segment: _Segment):
+        file_size = os.fstat(segment.fd).st_size
+        offset = 0
+        while offset + _BLOCK_HEADER.size <= file_size:
+            magic, count, length, crc = _BLOCK_HEADER.unpack(os.pread(segment.fd, _BLOCK_HEADER.size, offset))
+            if magic != _BLOCK_MAGIC and magic != _LEGACY_BLOCK_MAGIC:
+                break
+            hashes_start = _hashes_offset(magic)
+            payload_start = hashes_start + count * _HASH_SIZE
+            body_size = payload_start + length
+            body = os.pread(segment.fd, body_size, offset + _BLOCK_HEADER.size)
+            if len(body) < body_size or zlib.crc32(body) != crc:
+                break
+            hashes = array('Q')
+            hashes.frombytes(body[hashes_start:payload_start])
+            if magic == _BLOCK_MAGIC:
+                highest = _BLOCK_HIGHEST.unpack_from(body)[0]
+            else:
+                highest = _highest_id_value(data[0] for data in marshal.loads(zlib.decompress(body[payload_start:])))
+            yield offset, hashes, highest
+            offset += _BLOCK_HEADER.size + body_size
+        if offset < file_size:
+            os.ftruncate(segment.fd, offset)
+        segment.size = offset
+
+    def _new_segment(self, number: int) -> _Segment:
+        return _Segment(number, os.path.join(self._directory, f'archive-{number:08d}.seg'))
+
+    # --- Escrita ---
+
+    def append(self, records: list):
+        """
+        Grava os pedidos em blocos comprimidos no segmento atual e faz fsync antes
+        de torná-los visíveis no índice; só então podem sair da memória.
+        """
+        if not records:
+            return
+        with self._write_lock:
+            segment = self._segments[-1]
+            if segment.size >= self._segment_max_bytes:
+                segment = self._new_segment(segment.number + 1)
+                with self._lock:
+                    self._segments.append(segment)
+
+            entries = []
+            chunks = []
+            offset = segment.size
+            highest = self._highest
+            for start in range(0, len(records), self._block_records):
+                block = records[start:start + self._block_records]
+                hashes = array('Q', (_id_hash(record.order_id) for record in block))
+                payload = zlib.compress(marshal.dumps([order_to_tuple(record) for record in block]),
+                                        self._compress_level)
+                block_highest = _highest_id_value(record.order_id for record in block)
+                highest = max(highest, block_highest)
+                body = _BLOCK_HIGHEST.pack(block_highest) + hashes.tobytes() + payload
+                chunks.append(_BLOCK_HEADER.pack(_BLOCK_MAGIC, len(block), len(payload), zlib.crc32(body)) + body)
+                entries.extend((key, offset) for key in hashes)
+                offset += len(chunks[-1])
+
+            os.pwrite(segment.fd, b''.join(chunks), segment.size)
+            os.fsync(segment.fd)
+            with self._lock:
+                segment.size = offset
+                segment.add_to_index(entries)
+                self._highest = highest
+        ARCHIVED_ORDERS_TOTAL.inc(len(records))
+
+    # --- Leitura ---
+
+    def get(self, order_id: str):
+        """
+        Retorna o pedido arquivado (OrderRecord) ou None.
+        """
+        with self._lock:
+            record = self._cache.get(order_id)
+            if record is not None:
+                self._cache.move_to_end(order_id)
+                ARCHIVE_READS_TOTAL.labels(result='cache_hit').inc()
+                return record
+            key = _id_hash(order_id)
+            locations = [(segment, offset) for segment in reversed(self._segments)
+                         for offset in reversed(segment.block_offsets(key))]
+
+        for segment, offset in locations:
+            record = self._read(segment, offset, order_id)
+            if record is not None:
+                with self._lock:
+                    self._cache[order_id] = record
+                    if len(self._cache) > self._cache_size:
+                        self._cache.popitem(last=False)
+                ARCHIVE_READS_TOTAL.labels(result='disk_hit').inc()
+                return record
+        ARCHIVE_READS_TOTAL.labels(result='miss').inc()
+        return None
+
+    def __contains__(self, order_id: str) -> bool:
+        key = _id_hash(order_id)
+        with self._lock:
+            return order_id in self._cache or any(segment.block_offsets(key) for segment in self._segments)
+
+    @staticmethod
+    def _read(segment: _Segment, offset: int, order_id: str):
+        magic, count, length, _ = _BLOCK_HEADER.unpack(os.pread(segment.fd, _BLOCK_HEADER.size, offset))
+        payload = os.pread(segment.fd, length,
+                           offset + _BLOCK_HEADER.size + _hashes_offset(magic) + count * _HASH_SIZE)
+        for data in marshal.loads(zlib.decompress(payload)):
+            if data[0] == order_id:
+                return order_from_tuple(data)
+        return None
+
+    def highest_order_id(self):
+        """
+        Maior ID no formato do gerador já arquivado, ou None. Com ele o gerador
+        de IDs não volta abaixo de pedidos que já saíram da memória.
+        """
+        with self._lock:
+            return format_order_id(self._highest) if self._highest else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "orders": sum(segment.count for segment in self._segments),
+                "bytes": sum(segment.size for segment in self._segments),
+                "segments": len(self._segments),
+                "cached": len(self._cache)
+            }
+
+    def close(self):
+        with self._write_lock, self._lock:
+            for segment in self._segments:
+                os.close(segment.fd)
+            self._segments = []
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+
+class RetentionManager:
+    """
+    Move periodicamente para o arquivo os pedidos em status finais cuja última
+    atualização é mais antiga que 'max_age_seconds', limitando a memória usada
+    pelo store independente do tempo de execução do serviço.
+    """
+
+    def __init__(self, store, archive: OrderArchive, statuses: tuple, max_age_seconds: float,
+                 interval_seconds: float, batch_size: int):
+        self._store = store
+        self._archive = archive
+        self._statuses = statuses
+        self._max_age = max_age_seconds
+        self._interval = interval_seconds
+        self._batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='order-retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.run_once()
+
+    def run_once(self, now: float = None) -> int:
+        """
+        Arquiva os pedidos elegíveis, em lotes de 'batch_size'; retorna quantos saíram da memória.
+        """
+        start = time.perf_counter()
+        cutoff = (time.time() if now is None else now) - self._max_age
+        archived = 0
+        while not self._stop.is_set():
+            candidates = self._store.retention_candidates(self._statuses, cutoff, self._batch_size)
+            if not candidates:
+                break
+            self._archive.append(candidates)
+            # Pedidos alterados entre a seleção e a remoção continuam no store; a cópia
+            # arquivada fica obsoleta e será substituída quando forem arquivados de novo.
+            archived += len(self._store.remove(candidates))
+            if len(candidates) < self._batch_size:
+                break
+        ARCHIVE_RUN_DURATION_SECONDS.observe(time.perf_counter() - start)
+        return archived
@@ -0,0 +1,376 @@
+import asyncio
+import json
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs, unquote
+
+from app.admission import (
+    REJECTION_MESSAGES,
+    classify,
+    get_admission_controller,
+    holds_slot,
+    rate_limit_key,
+    retry_after_header
+)
+from app.api import (
+    create_order_error,
+    etag_matches,
+    json_body,
+    list_orders_args,
+    order_change_stream,
+    service_response,
+    wants_ndjson
+)
+from app.changes import ChangeStream
+from app.metrics import (
+    get_exposition_cache,
+    get_request_metrics,
+    incoming_trace_id,
+    metrics_headers
+)
+from app.services import (
+    process_order_creation_async,
+    get_order_record_async,
+    get_orders_page_async,
+    get_orders_etag,
+    order_not_found
+)
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class _Request:
+    """
+    Visão mínima de uma requisição HTTP ASGI (cabeçalhos com nomes em minúsculas).
+    """
+    __slots__ = ("method", "path", "query_string", "args", "headers", "body")
+
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query_string = scope.get("query_string", b"")
+        self.args = {key: values[-1] for key, values in parse_qs(self.query_string.decode('latin-1')).items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope["headers"]}
+        self.body = body
+
+
+def _json_response(data, status_code: int, headers: dict = None):
+    return status_code, {**JSON_HEADERS, **(headers or {})}, json.dumps(data).encode()
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip() == 'gzip':
+            params = params.replace(' ', '')
+            try:
+                return not params.startswith('q=') or float(params[2:]) > 0
+            except ValueError:
+                return True
+    return False
+
+
+def _not_modified(etag: str):
+    return 304, {'ETag': f'"{etag}"'}, b''
+
+
+class AsgiApp:
+    """
+    Aplicação ASGI com os endpoints quentes servidos pelas variantes assíncronas
+    dos serviços (POST /orders, GET /orders/<id>, GET /orders, /health, /metrics)
+    e com o feed de alterações GET /orders/changes, que aqui não ocupa uma thread
+    por conexão.
+
+    Esperas simuladas de I/O não ocupam threads, então um único processo mantém
+    milhares de pedidos em andamento. As demais rotas (e os casos que dependem de
+    código síncrono: Idempotency-Key e streaming NDJSON) são repassadas à aplicação
+    Flask/WSGI num pool de threads, que continua medindo suas próprias requisições.
+
+    As rotas nativas registram as mesmas métricas do middleware Flask, com o
+    template de rota do Flask no label 'endpoint', e passam pelo mesmo
+    controle de admissão (app/admission.py).
+    """
+
+    def __init__(self, wsgi_app, wsgi_threads: int):
+        self._wsgi = WsgiBridge(wsgi_app, wsgi_threads)
+        self._metrics = get_request_metrics()
+        self._exposition_cache = get_exposition_cache()
+        self._admission = get_admission_controller()
+        # (método, regex do path, template da rota, handler)
+        self._routes = [
+            ('GET', re.compile(r'/health'), '/health', self._health),
+            ('GET', re.compile(r'/metrics'), '/metrics', self._prometheus_metrics),
+            ('POST', re.compile(r'/orders'), '/orders', self._create_order),
+            ('GET', re.compile(r'/orders'), '/orders', self._list_orders),
+            ('GET', re.compile(r'/orders/changes'), '/orders/changes', self._order_changes),
+            ('GET', re.compile(r'/orders/(?P<order_id>[^/]+)'), '/orders/<string:order_id>', self._get_order),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        body = await _read_body(receive)
+        request = _Request(scope, body)
+        route = self._match(request)
+        if route is None:
+            await self._wsgi(scope, body, send)
+            return
+
+        template, handler, path_args = route
+        if self._delegated(request, template):
+            await self._wsgi(scope, body, send)
+            return
+
+        start = time.perf_counter()
+        trace_id = incoming_trace_id(request.headers)
+        self._metrics.started(trace_id)
+        priority = classify(request.method, template)
+        rejection = None
+        if self._admission is not None:
+            client = scope.get("client") or ('', 0)
+            rejection = self._admission.admit(priority, rate_limit_key(request.headers.get('x-api-key'), client[0]))
+        if rejection is not None:
+            status_code, reason, retry_after = rejection
+            response = _json_response({"error": REJECTION_MESSAGES[reason]}, status_code,
+                                      {'Retry-After': retry_after_header(retry_after)})
+        else:
+            try:
+                response = await handler(request, **path_args)
+            except Exception:
+                self._metrics.internal_error(template)
+                response = _json_response({"error": "Ocorreu um erro interno no servidor."}, 500)
+            finally:
+                if self._admission is not None and holds_slot(priority):
+                    self._admission.release(time.perf_counter() - start)
+
+        status_code, headers, payload = response
+        headers['X-Trace-Id'] = trace_id
+        self._metrics.finished(request.method, template, status_code, time.perf_counter() - start, trace_id)
+        if isinstance(payload, ChangeStream):
+            await _send_stream(send, receive, status_code, headers, payload)
+            return
+        headers['Content-Length'] = str(len(payload))
+        await _send_response(send, status_code, headers, payload)
+
+    def _match(self, request: _Request):
+        for method, pattern, template, handler in self._routes:
+            if method != request.method:
+                continue
+            match = pattern.fullmatch(request.path)
+            if match:
+                return template, handler, {key: unquote(value) for key, value in match.groupdict().items()}
+        return None
+
+    @staticmethod
+    def _delegated(request: _Request, template: str) -> bool:
+        """
+        Casos atendidos pela aplicação Flask: o cache de idempotência é síncrono
+        e o streaming NDJSON usa gerador síncrono.
+        """
+        if template != '/orders':
+            return False
+        if request.method == 'POST':
+            return bool(request.headers.get('idempotency-key'))
+        return wants_ndjson(request.args, request.headers.get('accept'))
+
+    @staticmethod
+    async def _lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # --- Handlers ---
+
+    async def _health(self, request: _Request):
+        return _json_response({"status": "healthy", "message": "API de Pedidos está operacional."}, 200)
+
+    async def _prometheus_metrics(self, request: _Request):
+        use_gzip = _accepts_gzip(request.headers.get('accept-encoding', ''))
+        payload, content_type = self._exposition_cache.get(request.headers.get('accept'), use_gzip)
+        return 200, metrics_headers(content_type, use_gzip), payload
+
+    # Autenticação, parâmetros e erros seguem as regras compartilhadas com as rotas Flask (app/api.py)
+
+    async def _create_order(self, request: _Request):
+        order_data = json_body(request.headers.get('content-type'), request.body)
+        error = create_order_error(request.headers.get('x-api-key'), order_data)
+        if error is not None:
+            return _json_response(*error)
+        return _json_response(*service_response(await process_order_creation_async(order_data)))
+
+    async def _get_order(self, request: _Request, order_id: str):
+        record = await get_order_record_async(order_id)
+        if record is None:
+            return _json_response(*service_response(order_not_found()))
+
+        etag = record.etag
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return _not_modified(etag)
+        return 200, {**JSON_HEADERS, 'ETag': f'"{etag}"'}, record.response_payload()
+
+    async def _list_orders(self, request: _Request):
+        etag = get_orders_etag(request.query_string)
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return _not_modified(etag)
+        result, status_code = service_response(await get_orders_page_async(**list_orders_args(request.args)))
+        return _json_response(result, status_code, {'ETag': f'"{etag}"'} if status_code == 200 else None)
+
+    async def _order_changes(self, request: _Request):
+        stream, error = order_change_stream(request.args, request.headers.get('accept'),
+                                            request.headers.get('last-event-id'), blocking=False)
+        if stream is None:
+            return _json_response(*error)
+        # Respondido (e medido) ao iniciar o stream; os eventos seguem até o cliente desconectar
+        return 200, {'Content-Type': stream.mimetype, 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}, stream
+
+
+class WsgiBridge:
+    """
+    Executa a aplicação WSGI (Flask) num pool de threads para uma requisição ASGI.
+
+    O corpo é enviado em partes (more_body) à medida que a aplicação o gera:
+    cada leitura do iterável WSGI roda no pool e junta até STREAM_CHUNK_BYTES,
+    de forma que respostas em streaming (NDJSON) não são montadas inteiras em
+    memória e a thread só fica ocupada enquanto produz dados.
+    """
+
+    STREAM_CHUNK_BYTES = 64 * 1024
+
+    def __init__(self, wsgi_app, threads: int):
+        self._app = wsgi_app
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, body: bytes, send):
+        loop = asyncio.get_running_loop()
+        status_code, headers, result = await loop.run_in_executor(self._executor, self._start, scope, body)
+        chunks = iter(result)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            })
+            while True:
+                chunk, more_body = await loop.run_in_executor(self._executor, self._read, chunks)
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                if not more_body:
+                    break
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self._executor, result.close)
+
+    def _start(self, scope, body: bytes):
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response["status"] = int(status.split(' ', 1)[0])
+            response["headers"] = response_headers
+
+        # O Flask chama start_response antes de devolver o iterável do corpo
+        result = self._app(_wsgi_environ(scope, body), start_response)
+        return response["status"], response["headers"], result
+
+    def _read(self, chunks) -> tuple:
+        """Retorna (bytes, há mais partes) com até STREAM_CHUNK_BYTES do corpo."""
+        parts = []
+        size = 0
+        for chunk in chunks:
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= self.STREAM_CHUNK_BYTES:
+                return b''.join(parts), True
+        return b''.join(parts), False
+
+
+def _wsgi_environ(scope, body: bytes) -> dict:
+    server_name, server_port = scope.get("server") or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope["method"],
+        'SCRIPT_NAME': scope.get("root_path", ""),
+        'PATH_INFO': scope["path"],
+        'QUERY_STRING': scope.get("query_string", b"").decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': (scope.get("client") or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get("scheme", "http"),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b''.join(chunks)
+
+
+async def _send_stream(send, receive, status_code: int, headers: dict, stream: ChangeStream):
+    """
+    Envia um stream até ele terminar ou o cliente desconectar (http.disconnect).
+    """
+    async def pump():
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()]
+        })
+        async for chunk in stream:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    pump_task = asyncio.ensure_future(pump())
+    disconnect_task = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait((pump_task, disconnect_task), return_when=asyncio.FIRST_COMPLETED)
+        if pump_task.done():
+            pump_task.result()
+    finally:
+        pump_task.cancel()
+        disconnect_task.cancel()
+        stream.close()
+
+
+async def _send_response(send, status_code: int, headers, payload: bytes):
+    items = headers.items() if isinstance(headers, dict) else headers
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in items]
+    })
+    await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from app.metrics import CHANGE_FEED_DROPPED_TOTAL, CHANGE_FEED_EVENTS_TOTAL, CHANGE_FEED_SUBSCRIBERS
+
+SSE_MIMETYPE = 'text/event-stream'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Além de order_created e order_updated (publicados pelo OrderStore)
+RESET = 'reset'  # Eventos perdidos: o cliente deve ressincronizar via GET /orders
+
+# Motivos de um evento reset
+LAGGED = 'lagged'  # O consumidor ficou atrás do buffer; a conexão é encerrada
+UNKNOWN_POSITION = 'unknown_position'  # Posição de retomada inválida, expirada ou de outro processo
+
+
+class ChangeEvent:
+    """
+    Alteração de um pedido. O JSON é gerado na primeira leitura (fora do lock
+    do store) e compartilhado por todos os consumidores.
+    """
+    __slots__ = ("seq", "type", "record", "fields", "_data")
+
+    def __init__(self, seq: int, event_type: str, record, fields):
+        self.seq = seq
+        self.type = event_type
+        self.record = record
+        self.fields = fields
+        self._data = None
+
+    def data(self, epoch: str) -> str:
+        data = self._data
+        if data is None:
+            event = {"id": f"{epoch}-{self.seq}", "seq": self.seq, "type": self.type}
+            if self.fields is not None:
+                event["changed"] = sorted(self.fields)
+            event["order"] = self.record.to_dict()
+            data = self._data = json.dumps(event)
+        return data
+
+
+class ChangeFeed:
+    """
+    Fan-out em processo das alterações de pedidos, num buffer circular de
+    'capacity' eventos com números de sequência crescentes.
+
+    publish() só grava o evento no buffer e acorda quem espera: cada consumidor
+    mantém a própria posição e lê do buffer, então um consumidor lento nunca
+    bloqueia as escritas. Se ele ficar mais de 'capacity' eventos atrás, os
+    eventos que faltam já foram sobrescritos e ele é desconectado.
+
+    É chamado pelo OrderStore ainda sob o lock do store, portanto a ordem dos
+    eventos é a ordem em que as alterações foram aplicadas.
+
+    Assinaturas "blocking" (servidor WSGI síncrono) prendem uma thread do
+    worker durante toda a conexão; são limitadas também a
+    'max_blocking_subscribers', abaixo da quantidade de threads, para que o
+    worker continue atendendo as demais requisições.
+    """
+
+    def __init__(self, capacity: int, max_subscribers: int, max_blocking_subscribers: int):
+        self.capacity = capacity
+        self._max_subscribers = max_subscribers
+        self._max_blocking = max_blocking_subscribers
+        self._events = [None] * capacity
+        self._last_seq = 0
+        self._started_ms = int(time.time() * 1000)
+        self._subscribers = 0
+        self._blocking = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._async_waiters = []  # (loop, future) de consumidores asyncio aguardando eventos
+
+    @property
+    def epoch(self) -> str:
+        # Identifica o processo (e a inicialização) que numerou os eventos; calculado
+        # no uso para diferir entre workers criados por fork depois do import.
+        return f"{os.getpid():x}{self._started_ms:x}"
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def publish(self, event_type: str, record, fields=None):
+        with self._cond:
+            self._last_seq += 1
+            self._events[self._last_seq % self.capacity] = ChangeEvent(self._last_seq, event_type, record, fields)
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        CHANGE_FEED_EVENTS_TOTAL.labels(type=event_type).inc()
+
+    def position(self, token):
+        """
+        Converte o ID de um evento ("<epoch>-<seq>", ou apenas "<seq>") na
+        posição de retomada. Retorna None se o ID não puder ser retomado aqui.
+        """
+        epoch, _, seq = token.strip().rpartition('-')
+        if epoch and epoch != self.epoch:
+            return None
+        try:
+            seq = int(seq)
+        except ValueError:
+            return None
+        if not self._last_seq - self.capacity <= seq <= self._last_seq or seq < 0:
+            return None
+        return seq
+
+    def read(self, after_seq: int, limit: int):
+        """
+        Até 'limit' eventos posteriores a 'after_seq', ou None se algum deles já
+        foi sobrescrito no buffer.
+        """
+        with self._cond:
+            last = self._last_seq
+            if after_seq < last - self.capacity:
+                return None
+            end = min(last, after_seq + limit)
+            return [self._events[seq % self.capacity] for seq in range(after_seq + 1, end + 1)]
+
+    def wait(self, after_seq: int, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._last_seq > after_seq, timeout)
+
+    async def wait_async(self, after_seq: int, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._cond:
+            if self._last_seq > after_seq:
+                return True
+            self._async_waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            with self._cond:
+                if (loop, future) in self._async_waiters:
+                    self._async_waiters.remove((loop, future))
+            return False
+
+    def subscribe(self, blocking: bool = False) -> bool:
+        with self._cond:
+            if self._subscribers >= self._max_subscribers or (blocking and self._blocking >= self._max_blocking):
+                return False
+            self._subscribers += 1
+            self._blocking += blocking
+        CHANGE_FEED_SUBSCRIBERS.inc()
+        return True
+
+    def unsubscribe(self, blocking: bool = False):
+        with self._cond:
+            self._subscribers -= 1
+            self._blocking -= blocking
+        CHANGE_FEED_SUBSCRIBERS.dec()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ChangeStream:
+    """
+    Uma conexão de GET /orders/changes, em SSE (padrão) ou NDJSON. Iterável de
+    forma síncrona (Flask) ou assíncrona (ASGI); gera os pedaços da resposta.
+
+    Começa depois de 'after_seq'; se a posição pedida pelo cliente não pôde ser
+    retomada ('resumable' falso), o primeiro evento é um reset. Sem eventos,
+    envia um keepalive a cada 'heartbeat_seconds'. A assinatura já deve ter
+    sido obtida com ChangeFeed.subscribe('blocking') e é liberada por close(),
+    chamado ao fim da iteração ou pelo servidor ao encerrar a resposta.
+    """
+
+    BATCH = 256  # Eventos lidos do buffer por vez
+
+    def __init__(self, feed: ChangeFeed, after_seq: int, resumable: bool, ndjson: bool, heartbeat_seconds: float,
+                 blocking: bool = False):
+        self._feed = feed
+        self._blocking = blocking
+        self._after = after_seq
+        self._resumable = resumable
+        self._ndjson = ndjson
+        self._heartbeat = heartbeat_seconds
+        self.mimetype = NDJSON_MIMETYPE if ndjson else SSE_MIMETYPE
+        self._closed = False
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._feed.unsubscribe(self._blocking)
+
+    def __iter__(self):
+        try:
+            # Primeiro pedaço imediato: o servidor envia os cabeçalhos sem esperar um evento
+            yield self._keepalive()
+            while True:
+                chunk, done = self._next_chunk()
+                if chunk:
+                    yield chunk
+                if done:
+                    return
+                if not self._feed.wait(self._after, self._heartbeat):
+                    yield self._keepalive()
+        finally:
+            self.close()
+
+    async def __aiter__(self):
+        try:
+            yield self._keepalive()
+            while True:
+                chunk, done = self._next_chunk()
+                if chunk:
+                    yield chunk
+                if done:
+                    return
+                if not await self._feed.wait_async(self._after, self._heartbeat):
+                    yield self._keepalive()
+        finally:
+            self.close()
+
+    def _next_chunk(self):
+        """
+        Retorna (bytes a enviar, encerrar) com os eventos disponíveis.
+        """
+        parts = []
+        if not self._resumable:
+            self._resumable = True
+            parts.append(self._reset(UNKNOWN_POSITION))
+        events = self._feed.read(self._after, self.BATCH)
+        if events is None:
+            CHANGE_FEED_DROPPED_TOTAL.inc()
+            parts.append(self._reset(LAGGED))
+            return ''.join(parts).encode(), True
+        if events:
+            self._after = events[-1].seq
+            epoch = self._feed.epoch
+            parts.extend(self._format(event.type, f"{epoch}-{event.seq}", event.data(epoch)) for event in events)
+        return ''.join(parts).encode(), False
+
+    def _reset(self, reason: str) -> str:
+        # Depois do reset o stream continua a partir do evento atual (exceto para consumidores lentos)
+        self._after = self._feed.last_seq
+        event_id = f"{self._feed.epoch}-{self._after}"
+        data = json.dumps({"id": event_id, "seq": self._after, "type": RESET, "reason": reason})
+        return self._format(RESET, event_id, data)
+
+    def _format(self, event_type: str, event_id: str, data: str) -> str:
+        if self._ndjson:
+            return data + "\n"
+        return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+    def _keepalive(self) -> bytes:
+        return b"\n" if self._ndjson else b": keepalive\n\n"
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.metrics import IDEMPOTENCY_REQUESTS_TOTAL, IDEMPOTENCY_EVICTIONS_TOTAL
+
+# Resultados de execute()
+HIT = 'hit'  # Resposta já concluída, devolvida do cache
+MISS = 'miss'  # Esta chamada executou a operação
+COALESCED = 'coalesced'  # Esperou a execução concorrente com a mesma chave
+CONFLICT = 'conflict'  # Mesma chave reutilizada com outro corpo de requisição
+TIMEOUT = 'timeout'  # A execução concorrente não terminou dentro do prazo
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "expires_at", "result", "done")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.expires_at = None  # Definido quando a operação termina
+        self.result = None
+        self.done = threading.Event()
+
+
+class IdempotencyStore:
+    """
+    Cache limitado das respostas de operações com Idempotency-Key.
+
+    - Entradas concluídas expiram após 'ttl_seconds' e, acima de 'max_entries',
+      as menos usadas recentemente são descartadas (LRU).
+    - Requisições concorrentes com a mesma chave são coalescidas: apenas a
+      primeira executa a operação e as demais esperam pelo seu resultado.
+    - Resultados com status 5xx não são guardados, para que a repetição
+      possa tentar de novo.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, wait_timeout_seconds: float):
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._wait_timeout = wait_timeout_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def execute(self, key, fingerprint: str, operation):
+        """
+        Executa operation() uma única vez por chave e retorna (resultado, desfecho),
+        onde desfecho é HIT, MISS, COALESCED, CONFLICT ou TIMEOUT (nos dois
+        últimos o resultado é None).
+        """
+        while True:
+            with self._lock:
+                entry = self._lookup(key)
+                leader = entry is None
+                if leader:
+                    entry = self._entries[key] = _Entry(fingerprint)
+                    self._evict_overflow()
+
+            if entry.fingerprint != fingerprint:
+                return self._finish(None, CONFLICT)
+            if leader:
+                return self._finish(self._run(key, entry, operation), MISS)
+            if entry.done.is_set():
+                return self._finish(entry.result, HIT)
+            if not entry.done.wait(self._wait_timeout):
+                return self._finish(None, TIMEOUT)
+            if entry.result is not None:
+                return self._finish(entry.result, COALESCED)
+            # A execução líder falhou sem resultado guardável: tenta novamente
+
+    def _run(self, key, entry: _Entry, operation):
+        result = None
+        try:
+            result = operation()
+        finally:
+            with self._lock:
+                if result is not None and result.get("status_code", 500) < 500:
+                    entry.result = result
+                    entry.expires_at = time.monotonic() + self._ttl
+                elif self._entries.get(key) is entry:
+                    del self._entries[key]
+            entry.done.set()
+        return result
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            IDEMPOTENCY_EVICTIONS_TOTAL.labels(reason='ttl').inc()
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _evict_overflow(self):
+        while len(self._entries) > self._max_entries:
+            _, entry = self._entries.popitem(last=False)
+            expired = entry.expires_at is not None and entry.expires_at <= time.monotonic()
+            IDEMPOTENCY_EVICTIONS_TOTAL.labels(reason='ttl' if expired else 'lru').inc()
+
+    @staticmethod
+    def _finish(result, outcome: str):
+        IDEMPOTENCY_REQUESTS_TOTAL.labels(result=outcome).inc()
+        return result, outcome
+
+    def __len__(self) -> int:
+        return len(self._entries)
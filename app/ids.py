@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: trava com msvcrt.locking
+    fcntl = None
+    import msvcrt
+
+ORDER_ID_PREFIX = "ORDER-"
+
+# Layout (estilo snowflake) do inteiro de 63 bits por trás de cada ID:
+# milissegundos desde ORDER_ID_EPOCH_MS | worker ID | sequência no milissegundo
+# O worker ID combina o node ID (configurado por máquina) e o slot do processo na máquina.
+ORDER_ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_ID_BITS = 4
+SLOT_BITS = 6
+WORKER_ID_BITS = NODE_ID_BITS + SLOT_BITS
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_ID_BITS) - 1
+MAX_SLOT = (1 << SLOT_BITS) - 1
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+_SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+_ID_DIGITS = 16  # Hexadecimal de largura fixa: a ordem lexicográfica é a ordem numérica
+
+
+def parse_order_id(order_id: str):
+    """
+    Retorna o inteiro de um ID gerado por OrderIdGenerator, ou None se o ID
+    não estiver nesse formato (por exemplo, IDs do formato anterior).
+    """
+    if len(order_id) != len(ORDER_ID_PREFIX) + _ID_DIGITS or not order_id.startswith(ORDER_ID_PREFIX):
+        return None
+    try:
+        return int(order_id[len(ORDER_ID_PREFIX):], 16)
+    except ValueError:
+        return None
+
+
+def format_order_id(value: int) -> str:
+    """ID de pedido correspondente a um inteiro gerado por OrderIdGenerator."""
+    return f"{ORDER_ID_PREFIX}{value:0{_ID_DIGITS}x}"
+
+
+def order_id_worker(value: int) -> int:
+    """Worker ID (node + slot) contido no inteiro de um ID."""
+    return (value >> SEQUENCE_BITS) & MAX_WORKER_ID
+
+
+def lock_file(path: str):
+    """
+    Abre 'path' e o trava com exclusividade sem esperar. Retorna o descritor
+    (a trava vale enquanto ele estiver aberto, no máximo até o fim do
+    processo) ou None se outro processo já detém a trava.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def claim_slot(directory: str) -> tuple:
+    """
+    Reserva um slot livre entre os processos da máquina que compartilham
+    'directory': cada slot é um arquivo travado enquanto o processo viver (o
+    sistema libera a trava quando ele termina, mesmo numa queda).
+    Retorna (slot, fd).
+    """
+    os.makedirs(directory, exist_ok=True)
+    for slot in range(MAX_SLOT + 1):
+        fd = lock_file(os.path.join(directory, f"slot-{slot:02d}.lock"))
+        if fd is not None:
+            return slot, fd
+    raise RuntimeError(f"Nenhum slot livre em {directory} ({MAX_SLOT + 1} processos em uso).")
+
+
+class OrderIdGenerator:
+    """
+    Gera IDs de pedido únicos e ordenáveis pelo tempo: "ORDER-" + 16 dígitos
+    hexadecimais de (milissegundo, worker ID, sequência).
+
+    - Dentro do processo os IDs são estritamente crescentes: até 4096 por
+      milissegundo; ao esgotar a sequência, ou se o relógio voltar, o gerador
+      segue no milissegundo seguinte ao último usado em vez de esperar.
+    - Entre processos, o worker ID é exclusivo: 'node_id' distingue as
+      máquinas e o slot, reservado com claim_slot('lock_directory') na
+      primeira geração de cada processo (workers criados por fork reservam o
+      seu), distingue os processos da máquina.
+    - 'history', se informado, retorna IDs já gravados (por exemplo, o maior
+      recuperado pela persistência e o maior arquivado; None é ignorado); na
+      primeira geração o gerador continua a partir do maior deles, de forma
+      que um relógio que voltou depois de um reinício não gera IDs abaixo dos
+      já gravados. IDs de outros workers também contam: seguir depois deles
+      não repete IDs, pois o worker ID os distingue.
+    """
+
+    def __init__(self, node_id: int, lock_directory: str, history=None, clock=time.time):
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f"node_id deve estar entre 0 e {MAX_NODE_ID}.")
+        self._node_id = node_id
+        self._lock_directory = lock_directory
+        self._history = history
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # O lock também é recriado: no fork ele pode ter sido copiado travado
+        self._lock = threading.Lock()
+        self._worker_id = None
+        self._slot_fd = None  # A trava herdada continua pertencendo ao processo pai
+        self._seeded = False
+        self._last_ms = 0
+        self._sequence = 0
+
+    @property
+    def slot(self) -> int:
+        """
+        Slot deste processo na máquina (reservado agora, se ainda não foi). Exclusivo
+        enquanto o processo viver; a persistência o usa para escolher o seu diretório.
+        """
+        with self._lock:
+            return self._claimed_worker_id() & MAX_SLOT
+
+    def _claimed_worker_id(self) -> int:
+        if self._worker_id is None:
+            slot, self._slot_fd = claim_slot(self._lock_directory)
+            self._worker_id = (self._node_id << SLOT_BITS) | slot
+        return self._worker_id
+
+    def _seed(self):
+        self._seeded = True
+        if self._history is None:
+            return
+        values = (parse_order_id(order_id) for order_id in self._history() if order_id is not None)
+        highest = max((value for value in values if value is not None), default=None)
+        if highest is not None:
+            self._last_ms = highest >> (WORKER_ID_BITS + SEQUENCE_BITS)
+            self._sequence = highest & _SEQUENCE_MASK
+
+    def next_id(self) -> str:
+        with self._lock:
+            worker_id = self._claimed_worker_id()
+            if not self._seeded:
+                self._seed()
+            now_ms = int(self._clock() * 1000) - ORDER_ID_EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                self._sequence = (self._sequence + 1) & _SEQUENCE_MASK
+                if self._sequence == 0:
+                    self._last_ms += 1
+            value = (self._last_ms << (WORKER_ID_BITS + SEQUENCE_BITS)) | (worker_id << SEQUENCE_BITS) | self._sequence
+        return format_order_id(value)
@@ -1,7 +1,24 @@
-from prometheus_client import generate_latest, Counter, Histogram, Gauge
-from flask import request, jsonify
+import contextvars
+import gzip
+import os
+import re
+import threading
 import time
 
+from config.config import Config
+
+# O modo multiprocesso do prometheus_client é escolhido pela variável de ambiente
+# no momento do import; por isso ela precisa ser definida antes do import abaixo.
+if Config.METRICS_MULTIPROCESS:
+    os.makedirs(Config.METRICS_MULTIPROC_DIR, exist_ok=True)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = Config.METRICS_MULTIPROC_DIR
+
+from prometheus_client import CollectorRegistry, REGISTRY, Counter, Histogram, Gauge  # noqa: E402
+from prometheus_client import multiprocess  # noqa: E402
+from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily  # noqa: E402
+from prometheus_client.exposition import choose_encoder  # noqa: E402
+from flask import request, jsonify  # noqa: E402
+
 # --- Definição das Métricas ---
 
 # Requisições HTTP
@@ -37,17 +54,465 @@ ORDER_PROCESSING_LATENCY = Histogram(
     ['order_type']  # create, update
 )
 
+# Tempo de espera pelos locks de estoque (contenção por produto)
+INVENTORY_LOCK_WAIT_SECONDS = Histogram(
+    'ecommerce_inventory_lock_wait_seconds',
+    'Tempo de espera para adquirir os locks de estoque de uma operação.',
+    ['operation'],  # reserve, release
+    buckets=(.00001, .00005, .0001, .0005, .001, .005, .01, .05, .1, .5, 1.0)
+)
+
+# Idempotency-Key em POST /orders
+IDEMPOTENCY_REQUESTS_TOTAL = Counter(
+    'ecommerce_idempotency_requests_total',
+    'Requisições com Idempotency-Key, por desfecho no cache de respostas.',
+    ['result']  # hit, miss, coalesced, conflict, timeout
+)
+
+IDEMPOTENCY_EVICTIONS_TOTAL = Counter(
+    'ecommerce_idempotency_evictions_total',
+    'Entradas removidas do cache de idempotência.',
+    ['reason']  # ttl, lru
+)
+
+# Persistência (WAL com group commit e snapshots)
+WAL_FSYNC_LATENCY = Histogram(
+    'ecommerce_wal_fsync_seconds',
+    'Latência de cada fsync do write-ahead log.',
+    buckets=(.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1)
+)
+
+WAL_COMMIT_BATCH_SIZE = Histogram(
+    'ecommerce_wal_commit_batch_records',
+    'Quantidade de registros do WAL confirmados por um mesmo fsync (group commit).',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+
+RECOVERY_DURATION_SECONDS = Gauge(
+    'ecommerce_recovery_duration_seconds',
+    'Tempo gasto na última recuperação (snapshot + WAL) na inicialização.',
+    multiprocess_mode='livemax'
+)
+
+# Arquivo de pedidos finalizados (retenção)
+ARCHIVE_READS_TOTAL = Counter(
+    'ecommerce_archive_reads_total',
+    'Consultas a pedidos que não estão em memória, por resultado no arquivo.',
+    ['result']  # cache_hit, disk_hit, miss
+)
+
+ARCHIVED_ORDERS_TOTAL = Counter(
+    'ecommerce_archived_orders_total',
+    'Pedidos finalizados movidos da memória para o arquivo em disco.'
+)
+
+ARCHIVE_RUN_DURATION_SECONDS = Histogram(
+    'ecommerce_archive_run_duration_seconds',
+    'Duração de cada rodada do gerenciador de retenção.',
+    buckets=(.001, .005, .01, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+)
+
+# Latência por etapa da criação de pedidos (com exemplars de trace ID)
+ORDER_STAGE_LATENCY = Histogram(
+    'ecommerce_order_stage_latency_seconds',
+    'Latência de cada etapa da criação de um pedido.',
+    ['stage'],  # validation, stock_reservation, payment, persistence, post_processing
+    buckets=Config.ORDER_STAGE_BUCKETS
+)
+
+# Em modo multiprocesso: sessões ativas são somadas entre os workers vivos
 ACTIVE_SESSIONS_GAUGE = Gauge(
     'ecommerce_active_sessions_gauge',
-    'Número de sessões de usuário ativas na plataforma.'
+    'Número de sessões de usuário ativas na plataforma.',
+    multiprocess_mode='livesum'
+)
+
+# Controle de admissão (rate limit por API key e limite adaptativo de concorrência)
+ADMISSION_REJECTIONS_TOTAL = Counter(
+    'api_admission_rejections_total',
+    'Requisições rejeitadas pelo controle de admissão.',
+    ['reason', 'priority']  # reason: rate_limited, concurrency_limit; priority: high, low, streaming
+)
+
+# Em modo multiprocesso: soma dos limites dos workers vivos (capacidade total)
+ADMISSION_CONCURRENCY_LIMIT = Gauge(
+    'api_admission_concurrency_limit',
+    'Limite atual de requisições simultâneas calculado a partir da latência observada.',
+    multiprocess_mode='livesum'
+)
+
+# Feed de alterações de pedidos (GET /orders/changes)
+CHANGE_FEED_EVENTS_TOTAL = Counter(
+    'ecommerce_change_feed_events_total',
+    'Eventos publicados no feed de alterações de pedidos.',
+    ['type']  # order_created, order_updated
+)
+
+CHANGE_FEED_SUBSCRIBERS = Gauge(
+    'ecommerce_change_feed_subscribers',
+    'Conexões abertas no feed de alterações de pedidos.',
+    multiprocess_mode='livesum'
+)
+
+CHANGE_FEED_DROPPED_TOTAL = Counter(
+    'ecommerce_change_feed_dropped_subscribers_total',
+    'Conexões do feed encerradas por ficarem atrás do buffer de eventos (consumidor lento).'
 )
 
-INVENTORY_LEVEL_GAUGE = Gauge(
-    'ecommerce_inventory_level_gauge',
-    'Nível de estoque atual de um produto específico.',
-    ['product_id']
+
+# --- Coletores avaliados no momento do scrape ---
+# Estoque e estatísticas do store de pedidos são lidos direto da camada de serviço
+# quando o Prometheus coleta, sem custo por requisição.
+
+class InventoryCollector:
+    """
+    Exporta o estoque com um número limitado de séries, independente da
+    quantidade de SKUs: os N produtos com menor estoque, um histograma dos
+    níveis de estoque e as contagens de produtos e de produtos zerados.
+    'stock_stats' retorna o dict de ProductCatalog.stock_stats().
+    """
+
+    def __init__(self, stock_stats):
+        self._stock_stats = stock_stats
+
+    def collect(self):
+        stats = self._stock_stats()
+        low_stock = GaugeMetricFamily(
+            'ecommerce_inventory_low_stock_level',
+            'Estoque atual dos produtos com menor estoque (top N).',
+            labels=['product_id']
+        )
+        for product_id, stock in stats["low_stock"]:
+            low_stock.add_metric([product_id], stock)
+        yield low_stock
+        yield HistogramMetricFamily(
+            'ecommerce_inventory_stock_level',
+            'Distribuição do nível de estoque entre os produtos do catálogo.',
+            buckets=[(str(bound), count) for bound, count in stats["buckets"]] + [('+Inf', stats["products"])],
+            sum_value=stats["sum"]
+        )
+        yield GaugeMetricFamily(
+            'ecommerce_inventory_products',
+            'Quantidade de produtos no catálogo.',
+            value=stats["products"]
+        )
+        yield GaugeMetricFamily(
+            'ecommerce_inventory_out_of_stock_products',
+            'Quantidade de produtos com estoque zerado.',
+            value=stats["out_of_stock"]
+        )
+
+
+class OrderStoreCollector:
+    """
+    Exporta estatísticas do store de pedidos mantidas incrementalmente por ele
+    (sem varredura): total de pedidos, pedidos por status e idade do pedido
+    pendente mais antigo. 'store_stats' retorna um dict com 'size', 'by_status'
+    e 'oldest_pending_created_at'.
+    """
+
+    def __init__(self, store_stats):
+        self._store_stats = store_stats
+
+    def collect(self):
+        stats = self._store_stats()
+        yield GaugeMetricFamily(
+            'ecommerce_order_store_size',
+            'Quantidade de pedidos armazenados.',
+            value=stats["size"]
+        )
+        by_status = GaugeMetricFamily(
+            'ecommerce_orders_by_status',
+            'Quantidade de pedidos em cada status.',
+            labels=['status']
+        )
+        for status, count in sorted(stats["by_status"].items()):
+            by_status.add_metric([status], count)
+        yield by_status
+        oldest = stats["oldest_pending_created_at"]
+        yield GaugeMetricFamily(
+            'ecommerce_oldest_pending_order_age_seconds',
+            'Idade do pedido pendente mais antigo (0 se não houver pendentes).',
+            value=max(0.0, time.time() - oldest) if oldest is not None else 0.0
+        )
+
+
+class ArchiveCollector:
+    """
+    Exporta o tamanho do arquivo de pedidos e do seu cache em memória.
+    'archive_stats' retorna um dict com 'orders', 'bytes', 'segments' e 'cached'.
+    """
+
+    def __init__(self, archive_stats):
+        self._archive_stats = archive_stats
+
+    def collect(self):
+        stats = self._archive_stats()
+        yield GaugeMetricFamily('ecommerce_archive_orders', 'Pedidos no arquivo em disco.', value=stats["orders"])
+        yield GaugeMetricFamily('ecommerce_archive_bytes', 'Tamanho dos segmentos do arquivo em disco.',
+                                value=stats["bytes"])
+        yield GaugeMetricFamily('ecommerce_archive_segments', 'Quantidade de segmentos do arquivo.',
+                                value=stats["segments"])
+        yield GaugeMetricFamily('ecommerce_archive_cache_entries',
+                                'Pedidos arquivados mantidos no cache LRU em memória.', value=stats["cached"])
+
+
+class _ScrapeTimeCollectors:
+    """
+    Agrupa os coletores registrados pelos serviços. Exposto apenas no REGISTRY
+    padrão: no modo multiprocesso eles mostrariam o estado em memória do worker
+    que atendeu o scrape, alternando entre workers a cada coleta.
+    """
+
+    def __init__(self):
+        self._collectors = []
+
+    def register(self, collector):
+        self._collectors.append(collector)
+
+    def collect(self):
+        for collector in list(self._collectors):
+            yield from collector.collect()
+
+
+SCRAPE_TIME_COLLECTORS = _ScrapeTimeCollectors()
+REGISTRY.register(SCRAPE_TIME_COLLECTORS)
+
+# Auto-métrica: séries que caíram no bucket de overflow por excederem o limite de cardinalidade
+METRICS_LABEL_OVERFLOW_TOTAL = Counter(
+    'api_metrics_label_overflow_total',
+    'Total de observações agrupadas no bucket de overflow por excesso de séries.',
+    ['metric']
+)
+
+# Auto-métricas da exposição do /metrics (observadas apenas quando o cache é regenerado)
+METRICS_EXPOSITION_LATENCY = Histogram(
+    'api_metrics_exposition_seconds',
+    'Tempo para serializar o registry no endpoint /metrics.',
+    ['format'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0)
+)
+
+METRICS_EXPOSITION_BYTES = Gauge(
+    'api_metrics_exposition_bytes',
+    'Tamanho em bytes da última exposição gerada pelo /metrics.',
+    ['format', 'encoding'],
+    multiprocess_mode='livemostrecent'
 )
 
+# Valor de label usado quando o limite de séries de uma métrica é atingido
+OVERFLOW_LABEL = '__overflow__'
+# Endpoint usado para requisições que não casaram com nenhuma rota (ex: 404)
+UNMATCHED_ENDPOINT = '__unmatched__'
+
+# Trace ID da requisição atual, anexado como exemplar às observações de latência
+TRACE_ID = contextvars.ContextVar('trace_id', default=None)
+_TRACE_ID_PATTERN = re.compile(r'^[0-9A-Za-z_.-]{1,64}$')
+
+ORDER_STAGES = ('validation', 'stock_reservation', 'payment', 'persistence', 'post_processing')
+_ORDER_STAGE_CHILDREN = {stage: ORDER_STAGE_LATENCY.labels(stage=stage) for stage in ORDER_STAGES}
+
+
+def current_exemplar():
+    """
+    Exemplar com o trace ID da requisição atual, ou None fora de uma requisição.
+    """
+    trace_id = TRACE_ID.get()
+    return {'trace_id': trace_id} if trace_id else None
+
+
+def observe_stage(stage: str, start: float) -> float:
+    """
+    Registra a duração de uma etapa iniciada em 'start' (time.perf_counter) e
+    retorna o instante atual, que serve de início para a próxima etapa.
+    """
+    now = time.perf_counter()
+    _ORDER_STAGE_CHILDREN[stage].observe(now - start, current_exemplar())
+    return now
+
+
+def incoming_trace_id(headers) -> str:
+    """
+    Trace ID da requisição a partir dos cabeçalhos (qualquer mapeamento com .get
+    e nomes em minúsculas): X-Trace-Id ou o trace-id do W3C traceparent; senão gera um novo.
+    """
+    trace_id = headers.get('x-trace-id')
+    if not trace_id:
+        traceparent = headers.get('traceparent', '')
+        parts = traceparent.split('-')
+        trace_id = parts[1] if len(parts) == 4 else None
+    if trace_id and _TRACE_ID_PATTERN.match(trace_id):
+        return trace_id
+    return os.urandom(8).hex()
+
+
+class BoundedLabelCache:
+    """
+    Cache dos filhos de uma métrica já resolvidos por .labels(), com limite de
+    cardinalidade. Ao atingir 'max_series', novas combinações de labels são
+    agrupadas numa única série com todos os labels iguais a OVERFLOW_LABEL.
+    """
+
+    def __init__(self, metric, max_series: int):
+        self._metric = metric
+        self._name = metric._name
+        self._max_series = max_series
+        self._children = {}
+        self._overflow_child = None
+        self._overflow_counter = METRICS_LABEL_OVERFLOW_TOTAL.labels(metric=self._name)
+        self._lock = threading.Lock()
+
+    def get(self, *label_values):
+        child = self._children.get(label_values)
+        if child is None:
+            child = self._resolve(label_values)
+        return child
+
+    def _resolve(self, label_values):
+        with self._lock:
+            child = self._children.get(label_values)
+            if child is not None:
+                return child
+            if len(self._children) < self._max_series:
+                child = self._metric.labels(*label_values)
+                self._children[label_values] = child
+                return child
+            if self._overflow_child is None:
+                self._overflow_child = self._metric.labels(*([OVERFLOW_LABEL] * len(label_values)))
+        self._overflow_counter.inc()
+        return self._overflow_child
+
+
+class ExpositionCache:
+    """
+    Cache de curta duração da saída serializada do /metrics, por formato
+    (texto Prometheus ou OpenMetrics). A versão gzip é gerada sob demanda
+    e reaproveitada enquanto a entrada for válida.
+    """
+
+    def __init__(self, registry, ttl_seconds: float):
+        self._registry = registry
+        self._ttl = ttl_seconds
+        self._entries = {}  # content_type -> [expira_em, payload, payload_gzip]
+        self._lock = threading.Lock()
+
+    def get(self, accept_header: str, use_gzip: bool):
+        """
+        Retorna (payload, content_type) para o cabeçalho Accept informado.
+        """
+        encoder, content_type = choose_encoder(accept_header)
+        entry = self._entries.get(content_type)
+        if entry is None or entry[0] <= time.monotonic():
+            with self._lock:  # Apenas um scrape regenera; os concorrentes esperam e reaproveitam
+                entry = self._entries.get(content_type)
+                if entry is None or entry[0] <= time.monotonic():
+                    entry = self._generate(encoder, content_type)
+                    self._entries[content_type] = entry
+
+        if not use_gzip:
+            return entry[1], content_type
+        if entry[2] is None:
+            entry[2] = gzip.compress(entry[1], compresslevel=Config.METRICS_GZIP_LEVEL)
+            METRICS_EXPOSITION_BYTES.labels(format=_format_label(content_type), encoding='gzip').set(len(entry[2]))
+        return entry[2], content_type
+
+    def _generate(self, encoder, content_type: str) -> list:
+        fmt = _format_label(content_type)
+        start = time.perf_counter()
+        payload = encoder(self._registry)
+        METRICS_EXPOSITION_LATENCY.labels(format=fmt).observe(time.perf_counter() - start)
+        METRICS_EXPOSITION_BYTES.labels(format=fmt, encoding='identity').set(len(payload))
+        return [time.monotonic() + self._ttl, payload, None]
+
+
+def _format_label(content_type: str) -> str:
+    return 'openmetrics' if content_type.startswith('application/openmetrics-text') else 'prometheus'
+
+
+def _build_exposition_registry():
+    """
+    Retorna o registry exposto em /metrics. Em modo multiprocesso, um registry
+    próprio agrega os arquivos de todos os workers no momento do scrape; os
+    coletores de SCRAPE_TIME_COLLECTORS ficam de fora (ver _ScrapeTimeCollectors).
+    """
+    if not Config.METRICS_MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=Config.METRICS_MULTIPROC_DIR)
+    return registry
+
+
+def mark_worker_dead(pid: int):
+    """
+    Remove os arquivos de gauges 'live*' de um worker que terminou.
+    Chamado pelo hook child_exit do gunicorn (ver gunicorn.conf.py).
+    """
+    if Config.METRICS_MULTIPROCESS:
+        multiprocess.mark_process_dead(pid, Config.METRICS_MULTIPROC_DIR)
+
+
+class RequestMetrics:
+    """
+    Registro das métricas de requisição (contagem, latência com exemplar, sessões
+    ativas e erros 500), compartilhado pelo middleware Flask e pela aplicação ASGI.
+    O label 'endpoint' é o template da rota (ex: /orders/<string:order_id>), não o path bruto.
+    """
+
+    def __init__(self, max_series: int):
+        self._max_series = max_series
+        self._count_children = BoundedLabelCache(REQUEST_COUNT, max_series)
+        self._latency_children = BoundedLabelCache(REQUEST_LATENCY, max_series)
+        self._error_children = BoundedLabelCache(APP_ERRORS_TOTAL, max_series)
+        self._children = {}  # (method, endpoint, status) -> (filho do contador, filho do histograma)
+
+    def started(self, trace_id: str):
+        TRACE_ID.set(trace_id)
+        ACTIVE_SESSIONS_GAUGE.inc()  # Incrementa sessões ativas
+
+    def finished(self, method: str, endpoint: str, status_code: int, latency: float, trace_id: str):
+        key = (method, endpoint, status_code)
+        children = self._children.get(key)
+        if children is None:
+            children = (self._count_children.get(*key), self._latency_children.get(method, endpoint))
+            if len(self._children) < self._max_series:
+                self._children[key] = children
+
+        count_child, latency_child = children
+        count_child.inc()
+        latency_child.observe(latency, {'trace_id': trace_id})
+        ACTIVE_SESSIONS_GAUGE.dec()  # Decrementa sessões ativas
+
+    def internal_error(self, endpoint: str):
+        self._error_children.get(endpoint, 'internal_server_error').inc()
+
+
+_request_metrics = None
+_exposition_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_request_metrics() -> RequestMetrics:
+    global _request_metrics
+    with _shared_lock:
+        if _request_metrics is None:
+            _request_metrics = RequestMetrics(Config.METRICS_MAX_SERIES_PER_METRIC)
+        return _request_metrics
+
+
+def get_exposition_cache() -> ExpositionCache:
+    global _exposition_cache
+    with _shared_lock:
+        if _exposition_cache is None:
+            _exposition_cache = ExpositionCache(_build_exposition_registry(), Config.METRICS_CACHE_TTL_SECONDS)
+        return _exposition_cache
+
+
+def metrics_headers(content_type: str, use_gzip: bool) -> dict:
+    headers = {'Content-Type': content_type, 'Vary': 'Accept, Accept-Encoding'}
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    return headers
+
 
 # --- Funções de Inicialização e Middleware ---
 
@@ -56,28 +521,24 @@ def init_metrics_and_middleware(app):
     Inicializa todas as métricas Prometheus e registra os middlewares
     na aplicação Flask.
     """
+    exposition_cache = get_exposition_cache()
+    request_metrics = get_request_metrics()
+
+    def _endpoint_label():
+        url_rule = request.url_rule
+        return url_rule.rule if url_rule is not None else UNMATCHED_ENDPOINT
 
     @app.before_request
     def before_request_hook():
-        request.start_time = time.time()
-        ACTIVE_SESSIONS_GAUGE.inc()  # Incrementa sessões ativas
+        request.start_time = time.perf_counter()
+        request.trace_id = incoming_trace_id(request.headers)
+        request_metrics.started(request.trace_id)
 
     @app.after_request
     def after_request_hook(response):
-        latency = time.time() - request.start_time
-
-        REQUEST_COUNT.labels(
-            method=request.method,
-            endpoint=request.path,
-            status=response.status_code
-        ).inc()
-
-        REQUEST_LATENCY.labels(
-            method=request.method,
-            endpoint=request.path
-        ).observe(latency)
-
-        ACTIVE_SESSIONS_GAUGE.dec()  # Decrementa sessões ativas
+        latency = time.perf_counter() - request.start_time
+        request_metrics.finished(request.method, _endpoint_label(), response.status_code, latency, request.trace_id)
+        response.headers['X-Trace-Id'] = request.trace_id
         return response
 
     @app.errorhandler(500)
@@ -85,7 +546,7 @@ def init_metrics_and_middleware(app):
         """
         Registra erros 500 (Internal Server Error) globais.
         """
-        APP_ERRORS_TOTAL.labels(endpoint=request.path, error_type='internal_server_error').inc()
+        request_metrics.internal_error(_endpoint_label())
         response = jsonify({"error": "Ocorreu um erro interno no servidor."})
         response.status_code = 500
         return response
@@ -94,5 +555,9 @@ def init_metrics_and_middleware(app):
     def prometheus_metrics():
         """
         Endpoint para o Prometheus coletar as métricas.
+        Negocia o formato (OpenMetrics ou texto) pelo cabeçalho Accept e
+        comprime com gzip quando o cliente envia Accept-Encoding: gzip.
         """
-        return generate_latest(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+        use_gzip = request.accept_encodings['gzip'] > 0
+        payload, content_type = exposition_cache.get(request.headers.get('Accept'), use_gzip)
+        return payload, 200, metrics_headers(content_type, use_gzip)
@@ -0,0 +1,390 @@
+import glob
+import marshal
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from app.ids import lock_file
+from app.metrics import WAL_FSYNC_LATENCY, WAL_COMMIT_BATCH_SIZE, RECOVERY_DURATION_SECONDS
+from app.store import OrderRecord, order_from_tuple, order_to_tuple
+
+# Cabeçalho de cada registro do WAL: tamanho do payload, CRC32 do payload e LSN
+_RECORD_HEADER = struct.Struct('<IIQ')
+# Cabeçalho do snapshot: identificador de formato e LSN coberto pelo snapshot
+_SNAPSHOT_MAGIC = b'APSNAP02'  # Listas internas do store (OrderStore.export_state)
+_LEGACY_SNAPSHOT_MAGIC = b'APSNAP01'  # Lista de pedidos (order_to_tuple)
+_SNAPSHOT_HEADER = struct.Struct('<8sQ')
+
+# Operações registradas no WAL (payload = marshal de uma tupla)
+OP_ORDER_ADDED = 1
+OP_ORDER_UPDATED = 2
+OP_STOCK = 3
+OP_ORDERS_REMOVED = 4  # Pedidos movidos para o arquivo (retenção)
+
+
+class PersistenceError(Exception):
+    """O WAL não pode mais ser gravado; alterações feitas a partir daí não são duráveis."""
+
+
+class _Rotate:
+    """Marcador no buffer do WAL: troca de segmento a partir de 'first_lsn'."""
+    __slots__ = ("first_lsn",)
+
+    def __init__(self, first_lsn: int):
+        self.first_lsn = first_lsn
+
+
+class WriteAheadLog:
+    """
+    Log append-only com group commit.
+
+    append() apenas enfileira o registro (barato, pode ser chamado sob locks);
+    uma thread dedicada grava tudo o que acumulou com um único write + fsync.
+    wait_durable() bloqueia até que os registros enfileirados estejam no disco,
+    de forma que vários escritores concorrentes compartilham o mesmo fsync.
+
+    Se uma escrita falhar (disco cheio, erro de I/O), o log fica marcado como
+    falho: a thread termina, quem espera é acordado e wait_durable()/rotate()
+    passam a lançar PersistenceError. Registros seguintes são descartados.
+    """
+
+    def __init__(self, directory: str, next_lsn: int, commit_delay_seconds: float):
+        self._directory = directory
+        self._commit_delay = commit_delay_seconds
+        self._cond = threading.Condition()
+        self._buffer = []
+        self._next_lsn = next_lsn
+        self._durable_lsn = next_lsn - 1
+        self._closed = False
+        self._failure = None  # OSError que interrompeu a thread de escrita
+        self._segment_first_lsn = next_lsn
+        self._file = self._open_segment(next_lsn)
+        self.records_since_rotation = 0
+        self._thread = threading.Thread(target=self._run, name='wal-writer', daemon=True)
+        self._thread.start()
+
+    def _open_segment(self, first_lsn: int):
+        path = os.path.join(self._directory, f'wal-{first_lsn:020d}.log')
+        return open(path, 'ab', buffering=0)
+
+    def append(self, payload: bytes) -> int:
+        with self._cond:
+            lsn = self._next_lsn
+            self._next_lsn += 1
+            if self._failure is not None:
+                return lsn  # Ninguém mais grava o buffer; wait_durable() reporta a falha
+            self._buffer.append(_RECORD_HEADER.pack(len(payload), zlib.crc32(payload), lsn) + payload)
+            self.records_since_rotation += 1
+            self._cond.notify_all()
+        return lsn
+
+    def rotate(self) -> int:
+        """
+        Inicia um novo segmento a partir do próximo registro e retorna o último
+        LSN do segmento anterior. Retorna depois que o segmento anterior foi
+        gravado e fechado.
+        """
+        with self._cond:
+            boundary = self._next_lsn - 1
+            self._buffer.append(_Rotate(boundary + 1))
+            self.records_since_rotation = 0
+            self._cond.notify_all()
+            while self._segment_first_lsn != boundary + 1 and not self._closed and self._failure is None:
+                self._cond.wait()
+            self._raise_if_failed()
+        return boundary
+
+    @property
+    def last_lsn(self) -> int:
+        """LSN do último registro enfileirado."""
+        with self._cond:
+            return self._next_lsn - 1
+
+    def wait_durable(self, lsn: int = None):
+        with self._cond:
+            target = self._next_lsn - 1 if lsn is None else lsn
+            while self._durable_lsn < target and not self._closed and self._failure is None:
+                self._cond.wait()
+            if self._durable_lsn < target:
+                self._raise_if_failed()
+
+    def _raise_if_failed(self):
+        if self._failure is not None:
+            raise PersistenceError(f"Falha ao gravar o WAL: {self._failure}")
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
+
+    def _run(self):
+        try:
+            self._write_batches()
+        except OSError as e:
+            with self._cond:
+                self._failure = e
+                self._buffer = []
+                self._cond.notify_all()
+
+    def _write_batches(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer and self._closed:
+                    return
+            if self._commit_delay:
+                time.sleep(self._commit_delay)  # Deixa o lote crescer antes do fsync
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+                last_lsn = self._next_lsn - 1
+
+            chunk = []
+            records = 0
+            for entry in batch:
+                if isinstance(entry, _Rotate):
+                    self._write(chunk)
+                    chunk = []
+                    self._file.close()
+                    self._file = self._open_segment(entry.first_lsn)
+                    with self._cond:
+                        self._segment_first_lsn = entry.first_lsn
+                        self._cond.notify_all()
+                else:
+                    chunk.append(entry)
+                    records += 1
+            self._write(chunk)
+            WAL_COMMIT_BATCH_SIZE.observe(records)
+
+            with self._cond:
+                self._durable_lsn = last_lsn
+                self._cond.notify_all()
+
+    def _write(self, chunk: list):
+        if not chunk:
+            return
+        self._file.write(b''.join(chunk))
+        start = time.perf_counter()
+        os.fsync(self._file.fileno())
+        WAL_FSYNC_LATENCY.observe(time.perf_counter() - start)
+
+
+class OrderPersistence:
+    """
+    Persistência opcional de pedidos e estoque: WAL com group commit mais
+    snapshots binários periódicos.
+
+    Os snapshots são "fuzzy": o LSN gravado é o do momento em que a captura
+    começou e as alterações concorrentes podem ou não estar no snapshot.
+    Isso é seguro porque todas as operações do WAL são idempotentes (pedido
+    já existente, atualização de versão já aplicada e remoção de pedido
+    ausente são ignorados, estoque grava valores absolutos),
+    então a recuperação reaplica o log a partir desse LSN.
+
+    Pedidos e agregados de vendas (ver app/analytics.py), porém, são capturados
+    juntos sob o lock do store, com o LSN exato da última alteração de pedido
+    que contêm: as operações de pedido até esse LSN não são reaplicadas, de
+    forma que os deltas dos agregados não são contados duas vezes.
+
+    O snapshot guarda as listas internas do store em forma colunar (ver
+    OrderStore.export_state): a recuperação restaura os índices sem reinserir
+    os pedidos, que só são desserializados quando acessados.
+    """
+
+    def __init__(self, directory: str, snapshot_every_records: int, commit_delay_seconds: float, sync_commit: bool):
+        self._directory = directory
+        self._snapshot_every = snapshot_every_records
+        self._commit_delay = commit_delay_seconds
+        self._sync_commit = sync_commit
+        self._store = None
+        self._products = None
+        self._wal = None
+        self._snapshot_requested = threading.Event()
+        self._snapshot_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Um único processo por diretório: dois escritores intercalariam LSNs e apagariam os arquivos um do outro
+        self._lock_fd = lock_file(os.path.join(directory, 'LOCK'))
+        if self._lock_fd is None:
+            raise RuntimeError(f"O diretório de persistência {directory} já está em uso por outro processo.")
+
+    # --- Journal (chamado pelo OrderStore e pelo Inventory sob seus locks) ---
+
+    def log_order_added(self, record: OrderRecord):
+        self._append((OP_ORDER_ADDED, order_to_tuple(record)))
+
+    def log_order_updated(self, record: OrderRecord, fields: dict):
+        self._append((OP_ORDER_UPDATED, record.order_id, record.last_updated_at, fields, record.version))
+
+    def log_stock(self, product_id: str, stock: int):
+        self._append((OP_STOCK, product_id, stock))
+
+    def log_orders_removed(self, order_ids: list):
+        self._append((OP_ORDERS_REMOVED, order_ids))
+
+    def _append(self, entry: tuple):
+        self._wal.append(marshal.dumps(entry))
+        if self._wal.records_since_rotation >= self._snapshot_every:
+            self._snapshot_requested.set()
+
+    def sync(self):
+        """
+        Aguarda até que todas as alterações registradas até agora estejam no disco
+        (no-op quando a confirmação síncrona está desativada). Lança
+        PersistenceError se o WAL não puder mais ser gravado.
+        """
+        if self._sync_commit:
+            self._wal.wait_durable()
+
+    # --- Recuperação ---
+
+    def recover(self, store, products, rollups=None) -> bool:
+        """
+        Carrega o snapshot mais recente (via mmap) e reaplica apenas o final do
+        WAL. Em seguida passa a registrar as alterações do store e do estoque.
+
+        Se o snapshot contém os agregados (ou não há pedidos nele), 'rollups' é
+        restaurado, definido como store.rollups e atualizado pelo WAL; retorna
+        True. Retorna False para snapshots sem agregados (formato anterior):
+        cabe ao chamador recalculá-los a partir dos pedidos.
+        """
+        start = time.perf_counter()
+        self._store = store
+        self._products = products
+        for stale in glob.glob(os.path.join(self._directory, '*.tmp')):
+            os.remove(stale)  # Snapshot interrompido antes do rename
+
+        snapshot_lsn, store_lsn, rollups_state = self._load_latest_snapshot()
+        restored = rollups is not None and (rollups_state is not None or not len(store))
+        if restored:
+            if rollups_state is not None:
+                rollups.load_state(rollups_state)
+            store.rollups = rollups
+        last_lsn = self._replay_wal(snapshot_lsn, store_lsn)
+
+        self._wal = WriteAheadLog(self._directory, last_lsn + 1, self._commit_delay)
+        threading.Thread(target=self._snapshot_loop, name='snapshot-writer', daemon=True).start()
+        RECOVERY_DURATION_SECONDS.set(time.perf_counter() - start)
+        return restored
+
+    def _load_latest_snapshot(self) -> tuple:
+        """
+        Retorna (LSN do snapshot, LSN das operações de pedido já contidas nele,
+        estado dos agregados ou None).
+        """
+        for path in sorted(glob.glob(os.path.join(self._directory, 'snapshot-*.bin')), reverse=True):
+            try:
+                with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    magic, lsn = _SNAPSHOT_HEADER.unpack_from(mm)
+                    if magic not in (_SNAPSHOT_MAGIC, _LEGACY_SNAPSHOT_MAGIC):
+                        continue
+                    with memoryview(mm) as view:
+                        payload = marshal.loads(view[_SNAPSHOT_HEADER.size:])
+                contents, stock = payload[:2]  # Listas do store ou, no formato anterior, os pedidos
+                # Formatos anteriores: (pedidos, estoque), ambos fuzzy a partir de 'lsn'
+                rollups_state, store_lsn = payload[2:] if len(payload) == 4 else (None, lsn)
+            except (OSError, ValueError, EOFError, TypeError, struct.error):
+                continue  # Snapshot corrompido: tenta o anterior
+            if magic == _SNAPSHOT_MAGIC:
+                self._store.load_state(contents)
+            else:
+                self._store.bulk_load(order_from_tuple(order) for order in contents)
+            for product_id, value in stock.items():
+                if product_id in self._products:
+                    self._products.set_stock(product_id, value)
+            return lsn, store_lsn, rollups_state
+        return 0, 0, None
+
+    def _replay_wal(self, snapshot_lsn: int, store_lsn: int) -> int:
+        last_lsn = snapshot_lsn
+        for path in sorted(glob.glob(os.path.join(self._directory, 'wal-*.log'))):
+            with open(path, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset + _RECORD_HEADER.size <= len(data):
+                length, crc, lsn = _RECORD_HEADER.unpack_from(data, offset)
+                payload = data[offset + _RECORD_HEADER.size:offset + _RECORD_HEADER.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break  # Final truncado por uma queda durante a escrita
+                offset += _RECORD_HEADER.size + length
+                if lsn > snapshot_lsn:
+                    entry = marshal.loads(payload)
+                    if entry[0] == OP_STOCK or lsn > store_lsn:
+                        self._apply(entry)
+                last_lsn = max(last_lsn, lsn)
+            if offset < len(data):
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+        return last_lsn
+
+    def _apply(self, entry: tuple):
+        op = entry[0]
+        if op == OP_ORDER_ADDED:
+            if entry[1][0] not in self._store:
+                self._store.add(order_from_tuple(entry[1]))
+        elif op == OP_ORDER_UPDATED:
+            _, order_id, last_updated_at, fields, version = entry
+            current = self._store.get(order_id)
+            if current is not None and current.version < version:  # Já aplicada se o snapshot a contém
+                self._store.update(order_id, last_updated_at=last_updated_at, **fields)
+        elif op == OP_STOCK:
+            _, product_id, stock = entry
+            if product_id in self._products:
+                self._products.set_stock(product_id, stock)
+        elif op == OP_ORDERS_REMOVED:
+            records = (self._store.get(order_id) for order_id in entry[1])
+            self._store.remove([record for record in records if record is not None])
+
+    # --- Snapshots ---
+
+    def _snapshot_loop(self):
+        while True:
+            self._snapshot_requested.wait()
+            self._snapshot_requested.clear()
+            try:
+                self.take_snapshot()
+            except PersistenceError:
+                return  # WAL falho: não há mais o que compactar
+            except OSError:
+                continue  # Snapshot não gravado (ex: disco cheio); o WAL continua válido até o próximo
+
+    def take_snapshot(self):
+        """
+        Grava um snapshot compacto do estado atual e remove os segmentos do WAL
+        e os snapshots que ele torna desnecessários.
+        """
+        with self._snapshot_lock:
+            boundary = self._wal.rotate()
+            store_state, (store_lsn, rollups_state) = self._store.capture(self._capture_state)
+            stock = dict(self._products.stock_items())
+
+            path = os.path.join(self._directory, f'snapshot-{boundary:020d}.bin')
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, boundary))
+                marshal.dump((store_state, stock, rollups_state, store_lsn), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+            for old in glob.glob(os.path.join(self._directory, 'snapshot-*.bin')):
+                if old != path:
+                    os.remove(old)
+            for segment in glob.glob(os.path.join(self._directory, 'wal-*.log')):
+                first_lsn = int(os.path.basename(segment)[4:-4])
+                if first_lsn <= boundary:
+                    os.remove(segment)
+
+    def _capture_state(self) -> tuple:
+        # Sob o lock do store: as alterações de pedido são registradas no WAL sob o mesmo lock
+        rollups = self._store.rollups
+        return self._wal.last_lsn, rollups.export_state() if rollups is not None else None
+
+    def close(self):
+        if self._wal is not None:
+            self._wal.close()
+        os.close(self._lock_fd)
@@ -0,0 +1,53 @@
+import sys
+import threading
+import time
+
+
+class ProfilerBusyError(Exception):
+    """Já existe uma coleta de perfil em andamento."""
+
+
+class SamplingProfiler:
+    """
+    Profiler por amostragem de baixo overhead.
+
+    Uma thread auxiliar lê periodicamente a pilha de todas as outras threads
+    (sys._current_frames) durante o tempo pedido e conta cada pilha vista. O
+    resultado sai no formato "collapsed stacks" (uma pilha por linha, frames
+    separados por ';' seguidos da contagem), aceito por flamegraph.pl e speedscope.
+    Apenas uma coleta roda por vez.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval_seconds: float) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError()
+        try:
+            counts = self._sample(seconds, interval_seconds)
+        finally:
+            self._lock.release()
+        lines = [f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda item: -item[1])]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    @staticmethod
+    def _sample(seconds: float, interval_seconds: float) -> dict:
+        counts = {}
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            time.sleep(interval_seconds)
+        return counts
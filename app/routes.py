@@ -1,15 +1,51 @@
-from flask import Flask, request, jsonify, g
-import random
-import time
+from flask import Flask, Response, request, jsonify, g
+import hashlib
+import json
 from config.config import Config  # Para acesso à chave de API
 from app.services import (
     process_order_creation,
-    get_order_details,
+    process_batch_order_creation,
+    get_order_record,
+    get_orders_etag,
+    order_not_found,
     update_order_status,
-    get_all_orders,
-    update_order_generic
+    get_orders_page,
+    iter_orders,
+    update_order_generic,
+    get_sales_summary,
+    get_product_sales,
+    get_customer_sales,
+    get_sales_timeseries
 )
+from app.api import (
+    create_order_error,
+    etag_matches,
+    json_body,
+    list_orders_args,
+    order_change_stream,
+    page_args,
+    service_response,
+    unauthorized,
+    valid_api_key,
+    wants_ndjson
+)
+from app.changes import NDJSON_MIMETYPE
+from app.idempotency import IdempotencyStore, CONFLICT, TIMEOUT, HIT, COALESCED
 from app.metrics import APP_ERRORS_TOTAL  # Para erros específicos de rotas
+from app.profiler import SamplingProfiler, ProfilerBusyError
+from app.simulation import get_simulation_model
+
+
+def _json(response: tuple):
+    """Resposta Flask de um par (corpo, status) de app/api.py."""
+    body, status_code = response
+    return jsonify(body), status_code
+
+
+def _not_modified(etag: str) -> Response:
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
 
 
 def init_routes(app: Flask):
@@ -17,11 +53,18 @@ def init_routes(app: Flask):
     Inicializa todas as rotas da aplicação Flask.
     As rotas agora usam os serviços definidos em app/services.py.
     """
+    # Respostas de POST /orders já concluídas, por (API key, Idempotency-Key)
+    idempotency_store = IdempotencyStore(
+        max_entries=Config.IDEMPOTENCY_MAX_ENTRIES,
+        ttl_seconds=Config.IDEMPOTENCY_TTL_SECONDS,
+        wait_timeout_seconds=Config.IDEMPOTENCY_WAIT_TIMEOUT_SECONDS
+    )
+    profiler = SamplingProfiler()
 
     @app.route('/')
     def home():
         """Endpoint principal da API."""
-        time.sleep(random.uniform(0.05, 0.15))
+        get_simulation_model().sleep(0.05, 0.15)
         return "Bem-vindo à API de Gerenciamento de Pedidos! (Protótipo Empresarial)"
 
     @app.route('/health')
@@ -32,35 +75,113 @@ def init_routes(app: Flask):
         """
         return jsonify({"status": "healthy", "message": "API de Pedidos está operacional."}), 200
 
+    @app.route('/admin/profile', methods=['GET', 'POST'])
+    def admin_profile():
+        """
+        Liga o profiler por amostragem por N segundos (parâmetro seconds) e devolve
+        as pilhas no formato collapsed (flamegraph). interval_ms controla o
+        intervalo de amostragem. Apenas uma coleta por vez.
+        """
+        if not valid_api_key(request.headers.get('X-API-Key')):
+            return _json(unauthorized('/admin/profile'))
+
+        seconds = request.args.get('seconds', default=10.0, type=float)
+        interval_ms = request.args.get('interval_ms', default=Config.PROFILER_DEFAULT_INTERVAL_SECONDS * 1000, type=float)
+        if not 0 < seconds <= Config.PROFILER_MAX_SECONDS or not 0.1 <= interval_ms <= 1000:
+            APP_ERRORS_TOTAL.labels(endpoint='/admin/profile', error_type='invalid_profile_parameters').inc()
+            return jsonify({"error": f"Use 0 < seconds <= {Config.PROFILER_MAX_SECONDS:g} e 0.1 <= interval_ms <= 1000."}), 400
+
+        try:
+            stacks = profiler.profile(seconds, interval_ms / 1000)
+        except ProfilerBusyError:
+            APP_ERRORS_TOTAL.labels(endpoint='/admin/profile', error_type='profiler_busy').inc()
+            return jsonify({"error": "Já existe uma coleta de perfil em andamento."}), 409
+        return Response(stacks, mimetype='text/plain')
+
     @app.route('/orders', methods=['POST'])
     def create_order():
         """
         Cria um novo pedido no sistema.
         Simula validações de dados, verificação de estoque e processamento de pagamento.
+        Com o cabeçalho Idempotency-Key, repetições da mesma requisição devolvem a
+        resposta original em vez de criar outro pedido.
         """
-        # --- Autenticação Simulada com API Key ---
+        # --- Autenticação Simulada com API Key (mesmas regras da rota ASGI, ver app/api.py) ---
         # Em um cenário real, você teria um middleware de autenticação mais robusto.
         api_key = request.headers.get('X-API-Key')
-        if not api_key or api_key != Config.API_KEY_REQUIRED:
-            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='unauthorized_access').inc()
-            return jsonify({"error": "Acesso não autorizado. Chave de API inválida ou ausente."}), 401
+        order_data = json_body(request.content_type, request.get_data())
+        error = create_order_error(api_key, order_data)
+        if error is not None:
+            return _json(error)
 
-        order_data = request.json
-        if not order_data:
-            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='empty_payload').inc()
-            return jsonify({"error": "Requisição inválida. O corpo deve ser um JSON."}), 400
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not idempotency_key:
+            # Chama a lógica de negócio do serviço
+            return _json(service_response(process_order_creation(order_data)))
 
-        # Chama a lógica de negócio do serviço
-        result = process_order_creation(order_data)
+        if len(idempotency_key) > Config.IDEMPOTENCY_KEY_MAX_LENGTH:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='invalid_idempotency_key').inc()
+            return jsonify({"error": f"Idempotency-Key deve ter no máximo {Config.IDEMPOTENCY_KEY_MAX_LENGTH} caracteres."}), 400
+
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        result, outcome = idempotency_store.execute(
+            (api_key, idempotency_key), fingerprint, lambda: process_order_creation(order_data)
+        )
+        if outcome == CONFLICT:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='idempotency_key_reused').inc()
+            return jsonify({"error": "Idempotency-Key já usada com outro corpo de requisição."}), 422
+        if outcome == TIMEOUT:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='idempotency_in_progress').inc()
+            return jsonify({"error": "Uma requisição com esta Idempotency-Key ainda está em processamento."}), 409
+
+        response = jsonify(result)
+        response.status_code = result.get("status_code", 500)
+        if outcome in (HIT, COALESCED):
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    @app.route('/orders/batch', methods=['POST'])
+    def create_orders_batch():
+        """
+        Cria vários pedidos numa única requisição.
+        O corpo é uma lista de pedidos (ou {"orders": [...]}) e a resposta traz
+        um resultado por pedido, na mesma ordem.
+        """
+        if not valid_api_key(request.headers.get('X-API-Key')):
+            return _json(unauthorized('/orders/batch'))
+
+        payload = request.get_json(silent=True)
+        orders = payload.get("orders") if isinstance(payload, dict) else payload
+        if not orders or not isinstance(orders, list):
+            APP_ERRORS_TOTAL.labels(endpoint='/orders/batch', error_type='empty_payload').inc()
+            return jsonify({"error": "Requisição inválida. O corpo deve ser uma lista JSON de pedidos."}), 400
+
+        if len(orders) > Config.ORDER_BATCH_MAX_SIZE:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders/batch', error_type='batch_too_large').inc()
+            return jsonify({"error": f"Lote muito grande. Máximo de {Config.ORDER_BATCH_MAX_SIZE} pedidos por requisição."}), 413
+
+        result = process_batch_order_creation(orders)
         return jsonify(result), result.get("status_code", 500)
 
     @app.route('/orders/<string:order_id>', methods=['GET'])
     def get_order(order_id: str):
         """
         Busca detalhes de um pedido específico.
+        Responde com ETag (ID + versão do pedido); com If-None-Match igual à versão
+        atual devolve 304 sem serializar o pedido. O corpo JSON de cada versão é
+        gerado uma única vez e reaproveitado.
         """
-        result = get_order_details(order_id)
-        return jsonify(result), result.get("status_code", 500)
+        record = get_order_record(order_id)
+        if record is None:
+            result = order_not_found()
+            return jsonify(result), result["status_code"]
+
+        etag = record.etag
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return _not_modified(etag)
+        response = Response(record.response_payload(), mimetype='application/json')
+        response.set_etag(etag)
+        return response
 
     @app.route('/orders/<string:order_id>/status', methods=['PUT'])
     def update_order(order_id: str):
@@ -81,9 +202,65 @@ def init_routes(app: Flask):
     @app.route('/orders', methods=['GET'])
     def list_orders():
         """
-        Coleta e retorna uma lista de todos os pedidos no sistema.
+        Lista os pedidos do sistema em páginas limitadas.
+        Parâmetros: limit, cursor, status, customer_id, since, until.
+        Com format=ndjson (ou Accept: application/x-ndjson) os pedidos são enviados
+        em streaming, um JSON por linha, sem montar a lista completa em memória.
+        A página tem ETag; If-None-Match igual devolve 304 sem consultar o store.
+        """
+        if wants_ndjson(request.args, request.headers.get('Accept')):
+            status = request.args.get('status')
+            customer_id = request.args.get('customer_id')
+
+            def generate():
+                for order in iter_orders(status=status, customer_id=customer_id):
+                    yield json.dumps(order) + "\n"
+            return Response(generate(), mimetype=NDJSON_MIMETYPE)
+
+        etag = get_orders_etag(request.query_string)
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return _not_modified(etag)
+        result = get_orders_page(**list_orders_args(request.args))
+        response = jsonify(result)
+        response.status_code = result.get("status_code", 500)
+        if response.status_code == 200:
+            response.set_etag(etag)
+        return response
+
+    @app.route('/orders/changes', methods=['GET'])
+    def order_changes():
+        """
+        Feed de alterações de pedidos (criações e atualizações) em Server-Sent
+        Events, ou NDJSON com format=ndjson / Accept: application/x-ndjson.
+        Para retomar, envie o ID do último evento recebido em Last-Event-ID (ou
+        no parâmetro after); um evento 'reset' indica que eventos foram perdidos.
         """
-        result = get_all_orders()
+        # Aqui cada conexão ocupa uma thread do worker até o cliente desconectar
+        stream, error = order_change_stream(request.args, request.headers.get('Accept'),
+                                            request.headers.get('Last-Event-ID'), blocking=True)
+        if stream is None:
+            return _json(error)
+        response = Response(stream, mimetype=stream.mimetype)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # Sem buffer em proxies (nginx)
+        return response
+
+    @app.route('/customers/<string:customer_id>/orders', methods=['GET'])
+    def list_customer_orders(customer_id: str):
+        """
+        Lista os pedidos de um cliente (consulta pelo índice de customer_id).
+        Aceita os mesmos parâmetros de paginação de GET /orders e o filtro status.
+        """
+        result = get_orders_page(customer_id=customer_id, status=request.args.get('status'), **page_args(request.args))
+        return jsonify(result), result.get("status_code", 500)
+
+    @app.route('/orders/by-status/<string:status>', methods=['GET'])
+    def list_orders_by_status(status: str):
+        """
+        Lista os pedidos com um status, opcionalmente num intervalo de criação
+        [since, until) em timestamps Unix (consulta pelos índices de status e created_at).
+        """
+        result = get_orders_page(status=status, **page_args(request.args))
         return jsonify(result), result.get("status_code", 500)
 
     @app.route('/orders/<string:order_id>', methods=['PATCH'])
@@ -93,10 +270,8 @@ def init_routes(app: Flask):
         Permite mudar customer_id, status, notes, etc.
         """
         # Autenticação simulada com API Key
-        api_key = request.headers.get('X-API-Key')
-        if not api_key or api_key != Config.API_KEY_REQUIRED:
-            APP_ERRORS_TOTAL.labels(endpoint='/orders/<id>', error_type='unauthorized_access_patch').inc()
-            return jsonify({"error": "Acesso não autorizado. Chave de API inválida ou ausente."}), 401
+        if not valid_api_key(request.headers.get('X-API-Key')):
+            return _json(unauthorized('/orders/<id>', 'unauthorized_access_patch'))
 
         update_data = request.json
         if not update_data:
@@ -104,4 +279,39 @@ def init_routes(app: Flask):
             return jsonify({"error": "Requisição PATCH inválida. O corpo deve ser um JSON com dados a serem atualizados."}), 400
 
         result = update_order_generic(order_id, update_data)
-        return jsonify(result), result.get("status_code", 500)
\ No newline at end of file
+        return jsonify(result), result.get("status_code", 500)
+
+    @app.route('/analytics/summary', methods=['GET'])
+    def analytics_summary():
+        """
+        Totais de pedidos e receita, pedidos por status e transições de status.
+        """
+        result = get_sales_summary()
+        return jsonify(result), result.get("status_code", 500)
+
+    @app.route('/analytics/products', methods=['GET'])
+    def analytics_products():
+        """
+        Receita e unidades vendidas por produto.
+        """
+        result = get_product_sales()
+        return jsonify(result), result.get("status_code", 500)
+
+    @app.route('/analytics/customers/<string:customer_id>', methods=['GET'])
+    def analytics_customer(customer_id: str):
+        """
+        Receita e quantidade de pedidos de um cliente.
+        """
+        result = get_customer_sales(customer_id)
+        return jsonify(result), result.get("status_code", 500)
+
+    @app.route('/analytics/timeseries', methods=['GET'])
+    def analytics_timeseries():
+        """
+        Pedidos e receita por intervalo na janela recente (parâmetro buckets).
+        """
+        buckets = request.args.get('buckets', type=int)
+        if 'buckets' in request.args and buckets is None:
+            buckets = -1
+        result = get_sales_timeseries(buckets)
+        return jsonify(result), result.get("status_code", 500)
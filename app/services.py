@@ -1,17 +1,37 @@
+import asyncio
+import atexit
+import csv
+import json
+import math
+import os
+import threading
 import time
-import random
-import copy  # Importar para fazer cópias de dados
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 from app.metrics import (
     ORDERS_CREATED_TOTAL,
     ORDER_PROCESSING_LATENCY,
     APP_ERRORS_TOTAL,
-    INVENTORY_LEVEL_GAUGE
+    SCRAPE_TIME_COLLECTORS,
+    ArchiveCollector,
+    InventoryCollector,
+    OrderStoreCollector,
+    INVENTORY_LOCK_WAIT_SECONDS,
+    current_exemplar,
+    observe_stage
 )
+from app.analytics import SalesRollups
+from app.archive import OrderArchive, RetentionManager
+from app.changes import ChangeFeed, ChangeStream
+from app.ids import OrderIdGenerator
+from app.persistence import OrderPersistence, PersistenceError
+from app.simulation import get_simulation_model
+from app.store import OrderItem, OrderRecord, OrderStore, ProductCatalog
 from config.config import Config
 
-# Banco de dados simulado de produtos e estoque
-_products_db = {
+# Catálogo padrão, usado quando Config.PRODUCT_CATALOG_PATH não está definido
+_DEFAULT_PRODUCTS = {
     "Mouse": {"name": "Mouse", "stock": 100, "price": 59.99},  # Atualizado name
     "Teclado": {"name": "Teclado", "stock": 250, "price": 249.99},  # Atualizado name
     "Monitor": {"name": "Monitor", "stock": 200, "price": 259.99},  # Atualizado name
@@ -19,12 +39,351 @@ _products_db = {
     "Notebook": {"name": "Notebook", "stock": 300, "price": 1500.00},
 }
 
-# Novo: Banco de dados simulado para armazenar pedidos
-_orders_db = {}
+_CATALOG_COLUMNS = ("product_id", "name", "price", "stock")
+
+
+def load_product_catalog(path: str) -> ProductCatalog:
+    """
+    Carrega o catálogo de produtos de um arquivo CSV (com cabeçalho contendo
+    product_id, name, price e stock) ou JSON (lista de objetos com os mesmos
+    campos) direto para as colunas compactas do ProductCatalog.
+    """
+    catalog = ProductCatalog()
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            products = json.load(f)
+        catalog.extend((p["product_id"], p.get("name", p["product_id"]), float(p["price"]), int(p["stock"]))
+                       for p in products)
+        return catalog
+
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        missing = [column for column in _CATALOG_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"{path}: colunas ausentes no cabeçalho do catálogo: {', '.join(missing)}.")
+        id_col, name_col, price_col, stock_col = (header.index(column) for column in _CATALOG_COLUMNS)
+        catalog.extend((row[id_col], row[name_col], float(row[price_col]), int(row[stock_col]))
+                       for row in reader if row)
+    return catalog
+
+
+# Banco de dados simulado de produtos e estoque
+_products_db = (load_product_catalog(Config.PRODUCT_CATALOG_PATH) if Config.PRODUCT_CATALOG_PATH
+                else ProductCatalog.from_dict(_DEFAULT_PRODUCTS))
+
+# Banco de dados simulado de pedidos, com índices por cliente, status e data de criação.
+# Os IDs são gerados pelo próprio store, em ordem crescente de criação.
+# O gerador continua a partir do maior ID recuperado do disco ou já arquivado
+# (ver initialize_persistence e initialize_archive).
+_orders_db = OrderStore()
+_order_ids = OrderIdGenerator(
+    Config.ORDER_ID_NODE_ID, Config.ORDER_ID_WORKER_DIR,
+    history=lambda: [_orders_db.highest_order_id(), _archive.highest_order_id() if _archive is not None else None]
+)
+_orders_db.id_generator = _order_ids.next_id
+
+# Agregados de vendas atualizados a cada escrita em _orders_db (consultados por /analytics)
+_rollups = SalesRollups(Config.ANALYTICS_BUCKET_SECONDS, Config.ANALYTICS_WINDOW_BUCKETS)
+
+# Feed de alterações de pedidos (GET /orders/changes), alimentado pelo _orders_db
+_change_feed = ChangeFeed(Config.CHANGE_FEED_BUFFER_SIZE, Config.CHANGE_FEED_MAX_SUBSCRIBERS,
+                          Config.CHANGE_FEED_MAX_BLOCKING_SUBSCRIBERS)
+
+# Início desta inicialização, usado (com o pid) nas ETags de listagem
+_STARTED_MS = int(time.time() * 1000)
+
+
+class Inventory:
+    """
+    Controle de estoque com reservas atômicas de vários itens.
+
+    Cada produto é protegido por um de N locks ("lock striping"); uma reserva
+    adquire os locks de todos os seus produtos sempre em ordem crescente de
+    índice, o que evita deadlock entre reservas concorrentes sem recorrer a um
+    lock global.
+
+    Se um 'journal' for definido, o novo estoque de cada produto alterado é
+    registrado nele ainda sob o lock do produto.
+    """
+
+    def __init__(self, catalog: ProductCatalog, stripes: int):
+        self.journal = None
+        self._catalog = catalog
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def _stripe(self, product_id: str) -> int:
+        return hash(product_id) % len(self._locks)
+
+    def _acquire(self, product_ids, operation: str) -> list:
+        locks = [self._locks[i] for i in sorted({self._stripe(p) for p in product_ids})]
+        start = time.perf_counter()
+        for lock in locks:
+            lock.acquire()
+        INVENTORY_LOCK_WAIT_SECONDS.labels(operation=operation).observe(time.perf_counter() - start)
+        return locks
+
+    @staticmethod
+    def _release_locks(locks: list):
+        for lock in reversed(locks):
+            lock.release()
+
+    def get_stock(self, product_id: str) -> int:
+        return self._catalog.get_stock(product_id)
+
+    def reserve(self, quantities: dict):
+        """
+        Reserva {product_id: quantidade} de forma atômica: ou todos os itens são
+        decrementados, ou nenhum. Retorna None em caso de sucesso ou o product_id
+        sem estoque suficiente.
+        """
+        return self.reserve_many([quantities])[0]
+
+    def reserve_many(self, reservations: list) -> list:
+        """
+        Reserva vários pedidos de uma vez, adquirindo os locks de todos os produtos
+        envolvidos uma única vez. Cada reserva continua sendo tudo ou nada; o
+        resultado de cada uma segue a convenção de reserve().
+        """
+        product_ids = set()
+        for quantities in reservations:
+            product_ids.update(quantities)
+        results = []
+        locks = self._acquire(product_ids, 'reserve')
+        try:
+            for quantities in reservations:
+                results.append(self._reserve_locked(quantities))
+        finally:
+            self._release_locks(locks)
+        return results
+
+    def _reserve_locked(self, quantities: dict):
+        catalog = self._catalog
+        for product_id, quantity in quantities.items():
+            if catalog.get_stock(product_id) < quantity:
+                return product_id
+        for product_id, quantity in quantities.items():
+            stock = catalog.get_stock(product_id) - quantity
+            catalog.set_stock(product_id, stock)
+            if self.journal is not None:
+                self.journal.log_stock(product_id, stock)
+        return None
+
+    def release(self, quantities: dict):
+        """
+        Devolve ao estoque uma reserva feita por reserve().
+        """
+        self.release_many([quantities])
+
+    def release_many(self, reservations: list):
+        product_ids = set()
+        for quantities in reservations:
+            product_ids.update(quantities)
+        locks = self._acquire(product_ids, 'release')
+        try:
+            for quantities in reservations:
+                for product_id, quantity in quantities.items():
+                    stock = self._catalog.get_stock(product_id) + quantity
+                    self._catalog.set_stock(product_id, stock)
+                    if self.journal is not None:
+                        self.journal.log_stock(product_id, stock)
+        finally:
+            self._release_locks(locks)
+
+    def stock_stats(self) -> dict:
+        """
+        Resumo limitado do estoque (menores estoques e distribuição); usado pelo
+        coletor de métricas no scrape.
+        """
+        return self._catalog.stock_stats(Config.INVENTORY_LOW_STOCK_TOP_N, Config.INVENTORY_STOCK_BUCKETS)
+
+
+_inventory = Inventory(_products_db, Config.INVENTORY_LOCK_STRIPES)
+
+# Chamadas simuladas ao gateway de pagamento dos lotes de pedidos são feitas em paralelo
+_payment_executor = ThreadPoolExecutor(max_workers=Config.PAYMENT_GATEWAY_CONCURRENCY,
+                                       thread_name_prefix='payment-gateway')
+
+
+def initialize_persistence():
+    """
+    Ativa a persistência (WAL + snapshots) se Config.PERSISTENCE_DIR estiver
+    definido: recupera o estado salvo e passa a registrar as alterações.
+
+    Cada processo usa o subdiretório do seu slot de IDs (worker-NN, ver
+    OrderIdGenerator.slot), exclusivo entre os workers vivos: um worker
+    reiniciado no mesmo slot recupera os pedidos e o histórico de IDs dele.
+    """
+    if not Config.PERSISTENCE_DIR:
+        return None
+    persistence = OrderPersistence(
+        os.path.join(Config.PERSISTENCE_DIR, f"worker-{_order_ids.slot:02d}"),
+        snapshot_every_records=Config.SNAPSHOT_EVERY_RECORDS,
+        commit_delay_seconds=Config.WAL_GROUP_COMMIT_DELAY_SECONDS,
+        sync_commit=Config.WAL_SYNC_COMMIT
+    )
+    persistence.recover(_orders_db, _products_db, _rollups)
+    _orders_db.journal = persistence
+    _inventory.journal = persistence
+    atexit.register(persistence.close)
+    return persistence
+
+
+def initialize_archive():
+    """
+    Ativa o arquivamento se Config.ARCHIVE_DIR estiver definido: pedidos em status
+    finais sem alterações há mais de ARCHIVE_AFTER_SECONDS saem da memória para
+    segmentos comprimidos em disco e continuam disponíveis em GET /orders/<id>.
+    """
+    if not Config.ARCHIVE_DIR:
+        return None, None
+    archive = OrderArchive(
+        os.path.join(Config.ARCHIVE_DIR, f"worker-{_order_ids.slot:02d}"),  # Um por processo, como a persistência
+        segment_max_bytes=Config.ARCHIVE_SEGMENT_MAX_BYTES,
+        block_records=Config.ARCHIVE_BLOCK_RECORDS,
+        cache_size=Config.ARCHIVE_CACHE_SIZE
+    )
+    archive.open()
+    retention = RetentionManager(
+        _orders_db, archive,
+        statuses=Config.ARCHIVE_TERMINAL_STATUSES,
+        max_age_seconds=Config.ARCHIVE_AFTER_SECONDS,
+        interval_seconds=Config.ARCHIVE_INTERVAL_SECONDS,
+        batch_size=Config.ARCHIVE_BATCH_SIZE
+    )
+    # Registrado depois do fechamento da persistência, então executa antes dele (atexit é LIFO)
+    atexit.register(archive.close)
+    atexit.register(retention.stop)
+    return archive, retention
+
+
+def _sync_persistence():
+    """
+    Aguarda a gravação em disco das alterações já feitas (group commit).
+    """
+    if _persistence is not None:
+        _persistence.sync()
+
+
+def _persist_created(order_ids: list):
+    """
+    Aguarda a gravação em disco de pedidos recém-criados. Se o WAL falhar, os
+    pedidos são retirados do store (o cliente recebe erro e eles não voltariam
+    num reinício) e a PersistenceError é relançada.
+    """
+    try:
+        _sync_persistence()
+    except PersistenceError:
+        _discard_created(order_ids)
+        raise
+
+
+def _discard_created(order_ids: list):
+    for order_id in order_ids:
+        _orders_db.discard(order_id)
+
+
+def register_metric_collectors():
+    """
+    Registra os coletores que leem estoque e estatísticas de pedidos no momento do scrape.
+    """
+    SCRAPE_TIME_COLLECTORS.register(InventoryCollector(_inventory.stock_stats))
+    SCRAPE_TIME_COLLECTORS.register(OrderStoreCollector(_orders_db.stats))
+    if _archive is not None:
+        SCRAPE_TIME_COLLECTORS.register(ArchiveCollector(_archive.stats))
+
+
+def _reject(error_type: str, message: str, status_code: int):
+    return None, error_type, {"success": False, "message": message, "status_code": status_code}
+
+
+def _prepare_order(order_data: dict):
+    """
+    Valida os dados de um pedido sem tocar no estoque.
+    Retorna (pedido_preparado, None, None) ou (None, error_type, resultado_de_erro);
+    o pedido preparado é a tupla (customer_id, itens, total, quantidades_por_produto).
+    """
+    if not isinstance(order_data, dict) or not order_data.get("items") or not isinstance(order_data["items"], list):
+        return _reject('validation_error', "Dados do pedido inválidos: 'items' é obrigatório e deve ser uma lista.", 400)
+
+    customer_id = order_data.get("customer_id", "UNKNOWN_CUSTOMER")
+    if not isinstance(customer_id, str):
+        return _reject('validation_error', "Dados do pedido inválidos: 'customer_id' deve ser uma string.", 400)
+    total_amount = 0.0
+    processed_items = []
+    quantities = {}  # Quantidade total a reservar por produto
+
+    for item_data in order_data["items"]:
+        if not isinstance(item_data, dict):
+            return _reject('validation_error', "Dados do pedido inválidos: cada item deve ser um objeto.", 400)
+
+        product_id = item_data.get("product_id")
+        quantity = item_data.get("quantity", 0)
+        if not isinstance(product_id, str):
+            return _reject('validation_error', "Dados do pedido inválidos: 'product_id' deve ser uma string.", 400)
+
+        row = _products_db.row(product_id)
+        if row is None:
+            return _reject('product_not_found', f"Produto '{product_id}' não encontrado.", 404)
+
+        # bool é subclasse de int, mas true/false não são quantidades
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            return _reject('invalid_quantity', f"Quantidade inválida ({quantity!r}) para o produto '{product_id}'.", 400)
+
+        if get_simulation_model().fails(Config.STOCK_VALIDATION_FAILURE_CHANCE):
+            return _reject('insufficient_stock_simulated',
+                           f"Estoque insuficiente para o produto '{product_id}' (simulado).", 400)
+
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        price = _products_db.prices[row]
+        total_amount += price * quantity
+        processed_items.append(OrderItem(
+            product_id=product_id,
+            name=_products_db.names[row],  # Adiciona o nome do produto
+            quantity=quantity,
+            price_unit=price
+        ))
+
+    return (customer_id, tuple(processed_items), total_amount, quantities), None, None
+
+
+def _insufficient_stock(product_id: str) -> dict:
+    return {"success": False, "message": f"Estoque real insuficiente para o produto '{product_id}'.", "status_code": 400}
+
 
-def initialize_inventory_gauges():
-    for product_id, data in _products_db.items():
-        INVENTORY_LEVEL_GAUGE.labels(product_id=product_id).set(data["stock"])
+def _payment_denied() -> dict:
+    return {"success": False, "message": "Pagamento negado pelo gateway (simulado).", "status_code": 402}
+
+
+def _authorize_payment(*_args) -> bool:
+    """
+    Simula a chamada ao gateway de pagamento. Retorna True se aprovado.
+    """
+    simulation = get_simulation_model()
+    simulation.sleep(0.1, 0.4)
+    return not simulation.fails(Config.PAYMENT_GATEWAY_FAILURE_CHANCE)
+
+
+def _store_order(prepared: tuple) -> str:
+    """
+    Grava um pedido preparado (com estoque já reservado) e retorna seu ID.
+    """
+    customer_id, items, total_amount, _quantities = prepared
+    now = time.time()
+    record = _orders_db.add(OrderRecord(
+        order_id=None,  # Gerado pelo store (ver OrderIdGenerator)
+        customer_id=customer_id,
+        items=items,
+        total_amount=total_amount,
+        status="pending",  # Status inicial
+        created_at=now,
+        last_updated_at=now
+    ))
+    return record.order_id
+
+
+def _order_created(order_id: str) -> dict:
+    return {"success": True, "message": f"Pedido {order_id} criado com sucesso!", "order_id": order_id, "status_code": 201}
 
 
 def process_order_creation(order_data: dict) -> dict:
@@ -33,104 +392,200 @@ def process_order_creation(order_data: dict) -> dict:
     payment_status = "denied"
     error_message = None
     order_id = None  # Inicializa order_id
+    reserved = None  # Estoque reservado e ainda não vinculado a um pedido
 
     try:
-        if not order_data.get("items") or not isinstance(order_data["items"], list):
-            error_message = "Dados do pedido inválidos: 'items' é obrigatório e deve ser uma lista."
-            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='validation_error').inc()
-            return {"success": False, "message": error_message, "status_code": 400}
+        # Cada etapa é medida em ORDER_STAGE_LATENCY (observe_stage devolve o início da próxima)
+        stage_start = time.perf_counter()
+
+        # Valida todos os itens antes de tocar no estoque
+        prepared, error_type, error_result = _prepare_order(order_data)
+        stage_start = observe_stage('validation', stage_start)
+        if prepared is None:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type=error_type).inc()
+            return error_result
+
+        # Reserva atômica de todos os itens (tudo ou nada)
+        quantities = prepared[3]
+        missing_product_id = _inventory.reserve(quantities)
+        stage_start = observe_stage('stock_reservation', stage_start)
+        if missing_product_id is not None:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='real_insufficient_stock').inc()
+            return _insufficient_stock(missing_product_id)
+        reserved = quantities
+
+        approved = _authorize_payment()
+        stage_start = observe_stage('payment', stage_start)
+        if not approved:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='payment_denied_simulated').inc()
+            return _payment_denied()
 
-        customer_id = order_data.get("customer_id", "UNKNOWN_CUSTOMER")
-        total_amount = 0.0
-        processed_items = []
+        payment_status = "approved"
 
-        for item_data in order_data["items"]:
-            product_id = item_data.get("product_id")
-            quantity = item_data.get("quantity", 0)
+        # Salva o pedido no banco de dados simulado
+        order_id = _store_order(prepared)
+        _persist_created([order_id])
+        reserved = None  # Pedido gravado: o estoque reservado passa a pertencer a ele
+        order_status = "success"
+        stage_start = observe_stage('persistence', stage_start)
 
-            if product_id not in _products_db:
-                error_message = f"Produto '{product_id}' não encontrado."
-                APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='product_not_found').inc()
-                return {"success": False, "message": error_message, "status_code": 404}
+        get_simulation_model().sleep(Config.ORDER_PROCESSING_MIN_LATENCY_SECONDS, Config.ORDER_PROCESSING_MAX_LATENCY_SECONDS)
+        observe_stage('post_processing', stage_start)
 
-            if quantity <= 0:
-                error_message = f"Quantidade inválida ({quantity}) para o produto '{product_id}'."
-                APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='invalid_quantity').inc()
-                return {"success": False, "message": error_message, "status_code": 400}
+        return _order_created(order_id)
 
-            if random.random() < Config.STOCK_VALIDATION_FAILURE_CHANCE:
-                error_message = f"Estoque insuficiente para o produto '{product_id}' (simulado)."
-                APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='insufficient_stock_simulated').inc()
-                return {"success": False, "message": error_message, "status_code": 400}
+    except Exception as e:
+        error_message = f"Erro inesperado na criação do pedido: {str(e)}"
+        APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='unexpected_error_creation').inc()
+        return {"success": False, "message": error_message, "status_code": 500}
+    finally:
+        _order_creation_finished(start_time, order_status, payment_status, reserved)
 
-            # Simula decremento de estoque APENAS SE FOR PRODUTO VÁLIDO E QUANTIDADE OK
-            if _products_db[product_id]["stock"] < quantity:  # Verificação adicional de estoque
-                error_message = f"Estoque real insuficiente para o produto '{product_id}'."
-                APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='real_insufficient_stock').inc()
-                return {"success": False, "message": error_message, "status_code": 400}
 
-            _products_db[product_id]["stock"] -= quantity
-            INVENTORY_LEVEL_GAUGE.labels(product_id=product_id).set(_products_db[product_id]["stock"])
-
-            total_amount += _products_db[product_id]["price"] * quantity
-            processed_items.append({
-                "product_id": product_id,
-                "name": _products_db[product_id]["name"],  # Adiciona o nome do produto
-                "quantity": quantity,
-                "price_unit": _products_db[product_id]["price"]
-            })
-
-        time.sleep(random.uniform(0.1, 0.4))
-        if random.random() < Config.PAYMENT_GATEWAY_FAILURE_CHANCE:
-            payment_status = "denied"
-            order_status = "failure"
-            error_message = "Pagamento negado pelo gateway (simulado)."
-            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='payment_denied_simulated').inc()
-            return {"success": False, "message": error_message, "status_code": 402}
+def _order_creation_finished(start_time: float, order_status: str, payment_status: str, reserved):
+    if reserved:
+        _inventory.release(reserved)  # Pagamento negado ou falha: devolve o estoque
+    latency = time.time() - start_time
+    ORDER_PROCESSING_LATENCY.labels(order_type='create').observe(latency, current_exemplar())
+    ORDERS_CREATED_TOTAL.labels(status=order_status, payment_status=payment_status).inc()
 
-        payment_status = "approved"
-        order_status = "success"
-        order_id = f"ORDER-{int(time.time() * 1000)}-{random.randint(100, 999)}"
 
-        # Novo: Salva o pedido no banco de dados simulado
-        _orders_db[order_id] = {
-            "customer_id": customer_id,
-            "items": processed_items,
-            "total_amount": total_amount,
-            "status": "pending",  # Status inicial
-            "created_at": time.time(),
-            "last_updated_at": time.time()
-        }
+def process_batch_order_creation(orders: list) -> dict:
+    """
+    Cria vários pedidos numa única chamada.
+    Valida todos os pedidos numa passada, reserva o estoque de todos com uma única
+    aquisição de locks, processa os pagamentos em paralelo e atualiza as métricas
+    uma vez por lote. Retorna um resultado por pedido, na ordem recebida.
+    """
+    start_time = time.time()
+    results = [None] * len(orders)
+    error_counts = {}  # error_type -> quantidade no lote
+    unbound = {}  # índice -> estoque reservado ainda não vinculado a um pedido
+    stored = []  # IDs dos pedidos gravados no store
+    created = 0
+
+    def fail(index: int, error_type: str, result: dict):
+        results[index] = result
+        error_counts[error_type] = error_counts.get(error_type, 0) + 1
 
-        time.sleep(random.uniform(Config.ORDER_PROCESSING_MIN_LATENCY_SECONDS, Config.ORDER_PROCESSING_MAX_LATENCY_SECONDS))
+    try:
+        prepared_orders = []  # (índice, pedido preparado)
+        for index, order_data in enumerate(orders):
+            prepared, error_type, error_result = _prepare_order(order_data)
+            if prepared is None:
+                fail(index, error_type, error_result)
+            else:
+                prepared_orders.append((index, prepared))
 
-        return {"success": True, "message": f"Pedido {order_id} criado com sucesso!", "order_id": order_id, "status_code": 201}
+        reservations = _inventory.reserve_many([prepared[3] for _, prepared in prepared_orders])
+        reserved_orders = []
+        for (index, prepared), missing_product_id in zip(prepared_orders, reservations):
+            if missing_product_id is not None:
+                fail(index, 'real_insufficient_stock', _insufficient_stock(missing_product_id))
+            else:
+                unbound[index] = prepared[3]
+                reserved_orders.append((index, prepared))
+
+        approvals = list(_payment_executor.map(_authorize_payment, reserved_orders))
+
+        denied = []
+        try:
+            for (index, prepared), approved in zip(reserved_orders, approvals):
+                if approved:
+                    order_id = _store_order(prepared)
+                    stored.append(order_id)
+                    results[index] = _order_created(order_id)
+                else:
+                    denied.append(index)
+                    fail(index, 'payment_denied_simulated', _payment_denied())
+        except Exception:
+            # Lote interrompido: os pedidos já inseridos são desfeitos e o estoque volta no finally
+            _discard_created(stored)
+            raise
+        if denied:
+            _inventory.release_many([unbound.pop(index) for index in denied])
+
+        if stored:
+            _persist_created(stored)  # Um único group commit para o lote inteiro
+            unbound.clear()  # Pedidos gravados: o estoque reservado passa a pertencer a eles
+            created = len(stored)
+            get_simulation_model().sleep(Config.ORDER_PROCESSING_MIN_LATENCY_SECONDS, Config.ORDER_PROCESSING_MAX_LATENCY_SECONDS)
+
+        return {"success": True, "results": results, "created": created, "failed": len(orders) - created,
+                "status_code": 200}
 
     except Exception as e:
-        error_message = f"Erro inesperado na criação do pedido: {str(e)}"
-        APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='unexpected_error_creation').inc()
-        return {"success": False, "message": error_message, "status_code": 500}
+        error_message = f"Erro inesperado na criação do lote de pedidos: {str(e)}"
+        APP_ERRORS_TOTAL.labels(endpoint='/orders/batch', error_type='unexpected_error_batch_creation').inc()
+        return {"success": False, "message": error_message, "created": created, "status_code": 500}
     finally:
+        if unbound:
+            _inventory.release_many(list(unbound.values()))
         latency = time.time() - start_time
-        ORDER_PROCESSING_LATENCY.labels(order_type='create').observe(latency)
-        ORDERS_CREATED_TOTAL.labels(status=order_status, payment_status=payment_status).inc()
+        ORDER_PROCESSING_LATENCY.labels(order_type='create_batch').observe(latency)
+        if created:
+            ORDERS_CREATED_TOTAL.labels(status="success", payment_status="approved").inc(created)
+        if len(orders) > created:
+            ORDERS_CREATED_TOTAL.labels(status="failure", payment_status="denied").inc(len(orders) - created)
+        for error_type, count in error_counts.items():
+            APP_ERRORS_TOTAL.labels(endpoint='/orders/batch', error_type=error_type).inc(count)
+
+
+def get_order_record(order_id: str):
+    """
+    Busca a versão atual de um pedido no DB simulado.
+    Retorna o OrderRecord (imutável, pode ser lido sem cópia) ou None.
+    """
+    get_simulation_model().sleep(0.05, 0.2)
+    return _find_order(order_id)
+
+
+def _find_order(order_id: str):
+    order_record = _orders_db.get(order_id)  # Busca o pedido no DB simulado
+    if order_record is None and _archive is not None:
+        order_record = _archive.get(order_id)  # Pedidos antigos finalizados ficam no arquivo
+    if order_record is None:
+        APP_ERRORS_TOTAL.labels(endpoint='/orders/<id>', error_type='order_not_found').inc()
+    return order_record
+
+
+def order_not_found() -> dict:
+    return {"success": False, "message": "Pedido não encontrado.", "status_code": 404}
+
+
+def _archived_order(order_id: str, endpoint: str):
+    """
+    Resposta 409 para alterações em pedidos arquivados (somente leitura), ou None.
+    """
+    if _archive is None or order_id not in _archive:
+        return None
+    APP_ERRORS_TOTAL.labels(endpoint=endpoint, error_type='order_archived').inc()
+    return {"success": False, "message": "Pedido arquivado não pode ser alterado.", "status_code": 409}
 
 
 def get_order_details(order_id: str) -> dict:
     """
     Simula a recuperação de detalhes de um pedido, buscando no DB simulado.
     """
-    time.sleep(random.uniform(0.05, 0.2))
-    order_data = _orders_db.get(order_id)  # Busca o pedido no DB simulado
+    return _order_details(get_order_record(order_id))
+
 
-    if order_data:
-        # Retorna uma CÓPIA dos dados para evitar modificações externas diretas
-        details = copy.deepcopy(order_data)
+def _order_details(order_record) -> dict:
+    if order_record:
+        details = order_record.to_dict()
         details["success"] = True
         details["status_code"] = 200
         return details
-    APP_ERRORS_TOTAL.labels(endpoint='/orders/<id>', error_type='order_not_found').inc()
-    return {"success": False, "message": "Pedido não encontrado.", "status_code": 404}
+    return order_not_found()
+
+
+def get_orders_etag(query_string: bytes) -> str:
+    """
+    ETag de uma listagem de pedidos: muda a cada alteração do store.
+    O identificador de inicialização evita colisões com ETags de outro processo; o
+    pid é lido no uso para diferir entre workers criados por fork depois do import.
+    """
+    return f"orders-{os.getpid():x}{_STARTED_MS:x}-{_orders_db.version}-{zlib.crc32(query_string):08x}"
 
 
 def update_order_status(order_id: str, new_status: str) -> dict:
@@ -149,6 +604,9 @@ def update_order_status(order_id: str, new_status: str) -> dict:
 
         order_to_update = _orders_db.get(order_id)
         if not order_to_update:
+            archived = _archived_order(order_id, '/orders/<id>/status')
+            if archived is not None:
+                return archived
             error_message = "Pedido não encontrado para atualização."
             APP_ERRORS_TOTAL.labels(endpoint='/orders/<id>/status', error_type='order_not_found_for_update').inc()
             return {"success": False, "message": error_message, "status_code": 404}
@@ -158,12 +616,12 @@ def update_order_status(order_id: str, new_status: str) -> dict:
             APP_ERRORS_TOTAL.labels(endpoint='/orders/<id>/status', error_type='invalid_status_update').inc()
             return {"success": False, "message": error_message, "status_code": 400}
 
-        if random.random() < 0.05:
+        if get_simulation_model().fails(Config.ORDER_UPDATE_FAILURE_CHANCE):
             raise Exception("Falha interna simulada na atualização do pedido.")
 
-        # Novo: Atualiza o status e a data de última atualização no DB simulado
-        order_to_update["status"] = new_status
-        order_to_update["last_updated_at"] = time.time()
+        # Atualiza o status e a data de última atualização (e os índices) no DB simulado
+        _orders_db.update(order_id, last_updated_at=time.time(), status=new_status)
+        _sync_persistence()
 
         order_status_result = "success"
         return {"success": True, "message": f"Status do pedido {order_id} atualizado para {new_status}.", "status_code": 200}
@@ -177,27 +635,105 @@ def update_order_status(order_id: str, new_status: str) -> dict:
         ORDER_PROCESSING_LATENCY.labels(order_type='update').observe(latency)
 
 
-def get_all_orders() -> dict:
+def _parse_cursor(cursor) -> int:
     """
-    Simula a recuperação de todos os pedidos no sistema.
-    Retorna uma lista de todos os pedidos armazenados no DB simulado,
-    incluindo o order_id dentro de cada objeto de pedido.
+    Converte o cursor recebido do cliente (ID do último pedido da página
+    anterior) na posição de início da varredura. Como os IDs são ordenados pelo
+    tempo de criação, o cursor continua válido após reinícios e mesmo que esse
+    pedido tenha sido arquivado. Retorna None se o cursor for inválido.
     """
-    time.sleep(random.uniform(0.05, 0.2)) # Simula latência de busca
+    if cursor in (None, ""):
+        return 0
+    return _orders_db.seq_after(cursor)
 
-    # Criar uma lista onde cada pedido inclui seu próprio order_id
-    all_orders_with_ids = []
-    for order_id, order_data in _orders_db.items():
-        # Criar uma cópia profunda para evitar modificações acidentais
-        order_copy = copy.deepcopy(order_data)
-        order_copy["order_id"] = order_id # Adiciona o order_id ao dicionário do pedido
-        all_orders_with_ids.append(order_copy)
 
-    if all_orders_with_ids:
-        return {"success": True, "orders": all_orders_with_ids, "status_code": 200}
+def get_orders_page(limit: int = None, cursor: str = None, status: str = None, customer_id: str = None,
+                    since: float = None, until: float = None) -> dict:
+    """
+    Retorna uma página limitada de pedidos, na ordem de criação.
+    Os filtros (status, customer_id, intervalo [since, until) de created_at)
+    são resolvidos pelos índices do OrderStore, sem varrer todos os pedidos.
+    O cursor devolvido em 'next_cursor' deve ser enviado na próxima chamada
+    para continuar a partir do último pedido retornado (None quando não há mais páginas).
+    """
+    limit, position, error_result = _validate_page(limit, cursor, since, until)
+    if error_result is not None:
+        return error_result
+
+    get_simulation_model().sleep(0.05, 0.2)  # Simula latência de busca
 
-    # Se não houver pedidos, retorna uma lista vazia
-    return {"success": True, "orders": [], "message": "Nenhum pedido encontrado.", "status_code": 200}
+    return _orders_page(limit, position, status, customer_id, since, until)
+
+
+def _validate_page(limit, cursor, since=None, until=None):
+    """
+    Valida limit, cursor e o intervalo [since, until). Retorna (limit, posição, None)
+    ou (None, None, resultado_de_erro).
+    """
+    if limit is None:
+        limit = Config.ORDERS_PAGE_DEFAULT_LIMIT
+    if not isinstance(limit, int) or limit <= 0 or limit > Config.ORDERS_PAGE_MAX_LIMIT:
+        APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='invalid_page_limit').inc()
+        return None, None, {"success": False,
+                            "message": f"Parâmetro 'limit' inválido. Use um inteiro entre 1 e {Config.ORDERS_PAGE_MAX_LIMIT}.",
+                            "status_code": 400}
+
+    if any(value is not None and not math.isfinite(value) for value in (since, until)):
+        APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='invalid_time_range').inc()
+        return None, None, {"success": False,
+                            "message": "Parâmetros 'since' e 'until' devem ser timestamps Unix numéricos.",
+                            "status_code": 400}
+
+    position = _parse_cursor(cursor)
+    if position is None:
+        APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='invalid_cursor').inc()
+        return None, None, {"success": False, "message": "Cursor de paginação inválido.", "status_code": 400}
+    return limit, position, None
+
+
+def _orders_page(limit: int, position: int, status, customer_id, since, until) -> dict:
+    records, next_position = _orders_db.query(
+        status=status, customer_id=customer_id, since=since, until=until, start=position, limit=limit
+    )
+    page = [record.to_dict() for record in records]
+    next_cursor = records[-1].order_id if next_position is not None else None
+    result = {"success": True, "orders": page, "next_cursor": next_cursor, "status_code": 200}
+    if not page:
+        result["message"] = "Nenhum pedido encontrado."
+    return result
+
+
+def iter_orders(status: str = None, customer_id: str = None):
+    """
+    Gera os pedidos um a um (na ordem de criação), sem materializar a lista completa.
+    Usado pelo modo de streaming NDJSON de GET /orders.
+    """
+    for record in _orders_db.iter_records(status=status, customer_id=customer_id):
+        yield record.to_dict()
+
+
+def open_change_stream(last_event_id: str = None, ndjson: bool = False, blocking: bool = False):
+    """
+    Abre uma conexão no feed de alterações de pedidos.
+    Sem 'last_event_id' o stream começa nas alterações seguintes; com ele, retoma
+    depois desse evento (ou começa com um evento reset se não for possível).
+    'blocking' indica que a conexão ocupa uma thread do servidor (rotas Flask).
+    Retorna (ChangeStream, None) ou (None, resultado de erro).
+    """
+    if not _change_feed.subscribe(blocking):
+        APP_ERRORS_TOTAL.labels(endpoint='/orders/changes', error_type='too_many_subscribers').inc()
+        return None, {"success": False, "message": "Limite de conexões no feed de alterações atingido.",
+                      "status_code": 503}
+    after_seq = _change_feed.last_seq
+    resumable = True
+    if last_event_id:
+        position = _change_feed.position(last_event_id)
+        if position is None:
+            resumable = False
+        else:
+            after_seq = position
+    return ChangeStream(_change_feed, after_seq, resumable, ndjson, Config.CHANGE_FEED_HEARTBEAT_SECONDS,
+                        blocking), None
 
 
 def update_order_generic(order_id: str, update_data: dict) -> dict:
@@ -215,32 +751,37 @@ def update_order_generic(order_id: str, update_data: dict) -> dict:
             APP_ERRORS_TOTAL.labels(endpoint='/orders/<id>', error_type='invalid_order_id_generic_update').inc()
             return {"success": False, "message": error_message, "status_code": 400}
 
-        order_to_update = _orders_db.get(order_id)
-        if not order_to_update:
+        if order_id not in _orders_db:
+            archived = _archived_order(order_id, '/orders/<id>')
+            if archived is not None:
+                return archived
             error_message = "Pedido não encontrado para atualização genérica."
             APP_ERRORS_TOTAL.labels(endpoint='/orders/<id>', error_type='order_not_found_generic_update').inc()
             return {"success": False, "message": error_message, "status_code": 404}
 
         # Campos permitidos para atualização (simulação)
-        allowed_fields = ["customer_id", "status", "notes"]  # Exemplo: pode adicionar mais campos aqui
+        allowed_fields = OrderStore.UPDATABLE_FIELDS
 
+        changes = {}
         for key, value in update_data.items():
             if key in allowed_fields:
                 if key == "status" and value not in ["shipped", "delivered", "cancelled", "returned", "processed"]:
                     error_message = f"Status inválido para atualização: '{value}'."
                     APP_ERRORS_TOTAL.labels(endpoint='/orders/<id>', error_type='invalid_status_generic_update').inc()
                     return {"success": False, "message": error_message, "status_code": 400}
-                order_to_update[key] = value
+                changes[key] = value
             else:
                 error_message = f"Campo '{key}' não pode ser atualizado."
                 APP_ERRORS_TOTAL.labels(endpoint='/orders/<id>', error_type='invalid_field_for_update').inc()
                 return {"success": False, "message": error_message, "status_code": 400}
 
         # Simula um erro interno aleatório na atualização
-        if random.random() < 0.05:  # 5% de chance de erro interno
+        if get_simulation_model().fails(Config.ORDER_UPDATE_FAILURE_CHANCE):
             raise Exception("Falha interna simulada na atualização genérica do pedido.")
 
-        order_to_update["last_updated_at"] = time.time()  # Atualiza o timestamp
+        # Aplica as alterações validadas e atualiza o timestamp (e os índices)
+        _orders_db.update(order_id, last_updated_at=time.time(), **changes)
+        _sync_persistence()
 
         order_status_result = "success"
         return {"success": True, "message": f"Pedido {order_id} atualizado com sucesso.", "status_code": 200}
@@ -256,5 +797,153 @@ def update_order_generic(order_id: str, update_data: dict) -> dict:
         ORDER_PROCESSING_LATENCY.labels(order_type='generic_update').observe(latency)
 
 
-# Chama a função para inicializar os gauges de estoque assim que o módulo é carregado
-initialize_inventory_gauges()
+def get_sales_summary() -> dict:
+    """
+    Totais de pedidos e receita, pedidos por status e transições de status,
+    lidos dos agregados (sem varrer os pedidos).
+    """
+    result = _rollups.summary()
+    result.update({"success": True, "status_code": 200})
+    return result
+
+
+def get_product_sales() -> dict:
+    """
+    Receita e unidades vendidas por produto.
+    """
+    return {"success": True, "products": _rollups.products(), "status_code": 200}
+
+
+def get_customer_sales(customer_id: str) -> dict:
+    """
+    Receita e quantidade de pedidos de um cliente.
+    """
+    totals = _rollups.customer(customer_id)
+    if totals is None:
+        APP_ERRORS_TOTAL.labels(endpoint='/analytics/customers/<id>', error_type='customer_not_found').inc()
+        return {"success": False, "message": "Cliente sem pedidos registrados.", "status_code": 404}
+    totals.update({"success": True, "status_code": 200})
+    return totals
+
+
+def get_sales_timeseries(buckets: int = None) -> dict:
+    """
+    Pedidos e receita por intervalo de Config.ANALYTICS_BUCKET_SECONDS na janela recente.
+    """
+    if buckets is None:
+        buckets = Config.ANALYTICS_WINDOW_BUCKETS
+    if not isinstance(buckets, int) or not 0 < buckets <= Config.ANALYTICS_WINDOW_BUCKETS:
+        APP_ERRORS_TOTAL.labels(endpoint='/analytics/timeseries', error_type='invalid_buckets').inc()
+        return {"success": False,
+                "message": f"Parâmetro 'buckets' inválido. Use um inteiro entre 1 e {Config.ANALYTICS_WINDOW_BUCKETS}.",
+                "status_code": 400}
+    return {"success": True, "bucket_seconds": Config.ANALYTICS_BUCKET_SECONDS,
+            "series": _rollups.timeseries(buckets), "status_code": 200}
+
+
+# --- Variantes assíncronas (usadas pela aplicação ASGI, ver app/asgi.py) ---
+# Mesma lógica das funções acima, mas as esperas simuladas de I/O (gateway de
+# pagamento, latência de banco) usam asyncio e não prendem uma thread. O trabalho
+# de CPU (validação, reserva de estoque, store) é curto e roda no próprio event loop;
+# apenas a espera pelo fsync do WAL vai para o executor padrão.
+
+async def _authorize_payment_async() -> bool:
+    simulation = get_simulation_model()
+    await simulation.asleep(0.1, 0.4)
+    return not simulation.fails(Config.PAYMENT_GATEWAY_FAILURE_CHANCE)
+
+
+async def _sync_persistence_async():
+    if _persistence is not None:
+        await asyncio.get_running_loop().run_in_executor(None, _persistence.sync)
+
+
+async def _persist_created_async(order_ids: list):
+    try:
+        await _sync_persistence_async()
+    except PersistenceError:
+        _discard_created(order_ids)
+        raise
+
+
+async def process_order_creation_async(order_data: dict) -> dict:
+    start_time = time.time()
+    order_status = "failure"
+    payment_status = "denied"
+    reserved = None  # Estoque reservado e ainda não vinculado a um pedido
+
+    try:
+        stage_start = time.perf_counter()
+
+        prepared, error_type, error_result = _prepare_order(order_data)
+        stage_start = observe_stage('validation', stage_start)
+        if prepared is None:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type=error_type).inc()
+            return error_result
+
+        quantities = prepared[3]
+        missing_product_id = _inventory.reserve(quantities)
+        stage_start = observe_stage('stock_reservation', stage_start)
+        if missing_product_id is not None:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='real_insufficient_stock').inc()
+            return _insufficient_stock(missing_product_id)
+        reserved = quantities
+
+        approved = await _authorize_payment_async()
+        stage_start = observe_stage('payment', stage_start)
+        if not approved:
+            APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='payment_denied_simulated').inc()
+            return _payment_denied()
+
+        payment_status = "approved"
+
+        order_id = _store_order(prepared)
+        await _persist_created_async([order_id])
+        reserved = None
+        order_status = "success"
+        stage_start = observe_stage('persistence', stage_start)
+
+        await get_simulation_model().asleep(Config.ORDER_PROCESSING_MIN_LATENCY_SECONDS,
+                                            Config.ORDER_PROCESSING_MAX_LATENCY_SECONDS)
+        observe_stage('post_processing', stage_start)
+
+        return _order_created(order_id)
+
+    except Exception as e:
+        APP_ERRORS_TOTAL.labels(endpoint='/orders', error_type='unexpected_error_creation').inc()
+        return {"success": False, "message": f"Erro inesperado na criação do pedido: {str(e)}", "status_code": 500}
+    finally:
+        _order_creation_finished(start_time, order_status, payment_status, reserved)
+
+
+async def get_order_record_async(order_id: str):
+    await get_simulation_model().asleep(0.05, 0.2)
+    return _find_order(order_id)
+
+
+async def get_order_details_async(order_id: str) -> dict:
+    return _order_details(await get_order_record_async(order_id))
+
+
+async def get_orders_page_async(limit: int = None, cursor: str = None, status: str = None, customer_id: str = None,
+                                since: float = None, until: float = None) -> dict:
+    limit, position, error_result = _validate_page(limit, cursor, since, until)
+    if error_result is not None:
+        return error_result
+    await get_simulation_model().asleep(0.05, 0.2)
+    return _orders_page(limit, position, status, customer_id, since, until)
+
+
+_persistence = initialize_persistence()
+_archive, _retention = initialize_archive()
+if _orders_db.rollups is None:
+    # Agregados não restaurados do snapshot: recalculados a partir dos pedidos recuperados
+    # antes de atender requisições (o arquivo não é relido: seria descomprimi-lo inteiro)
+    _rollups.rebuild(_orders_db.records())
+    _orders_db.rollups = _rollups
+if _retention is not None:
+    _retention.start()  # Só depois da reconstrução, para nenhum pedido mudar de lugar durante ela
+# A recuperação não gera eventos: o feed só recebe as alterações feitas a partir daqui
+_orders_db.feed = _change_feed
+
+register_metric_collectors()
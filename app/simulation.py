@@ -0,0 +1,88 @@
+import asyncio
+import random
+import time
+
+from config.config import Config
+
+
+class SimulationModel:
+    """
+    Modelo de latência e falhas simuladas usado pelos serviços e rotas.
+
+    Todas as esperas (time.sleep) e injeções de falha passam por aqui, com um
+    gerador aleatório próprio que pode ser semeado para execuções reproduzíveis.
+    'latency_scale' e 'failure_scale' multiplicam as latências e as chances de
+    falha configuradas (0 desliga cada uma delas).
+    """
+
+    def __init__(self, seed=None, latency_scale: float = 1.0, failure_scale: float = 1.0):
+        self._random = random.Random(seed)
+        self.latency_scale = latency_scale
+        self.failure_scale = failure_scale
+
+    def sleep(self, min_seconds: float, max_seconds: float):
+        """Simula uma espera de I/O entre min_seconds e max_seconds."""
+        delay = self.delay(min_seconds, max_seconds)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def asleep(self, min_seconds: float, max_seconds: float):
+        """Versão assíncrona de sleep(): libera o event loop durante a espera."""
+        delay = self.delay(min_seconds, max_seconds)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def delay(self, min_seconds: float, max_seconds: float) -> float:
+        """Sorteia a duração de uma espera simulada, sem esperar."""
+        if self.latency_scale <= 0:
+            return 0.0
+        return self._random.uniform(min_seconds, max_seconds) * self.latency_scale
+
+    def fails(self, chance: float) -> bool:
+        """Retorna True se a falha simulada com a chance informada deve ocorrer."""
+        if self.failure_scale <= 0:
+            return False
+        return self._random.random() < chance * self.failure_scale
+
+
+class ZeroSimulationModel(SimulationModel):
+    """
+    Modelo sem latência nem falhas simuladas, para medir apenas o overhead
+    do framework e dos serviços.
+    """
+
+    def __init__(self, seed=None):
+        super().__init__(seed=seed, latency_scale=0.0, failure_scale=0.0)
+
+
+def build_simulation_model(mode: str = None, seed=None) -> SimulationModel:
+    """
+    Cria o modelo a partir do modo ('random' ou 'zero'); sem argumentos usa o Config.
+    """
+    mode = mode or Config.SIMULATION_MODE
+    seed = seed if seed is not None else Config.SIMULATION_SEED
+    if mode == 'zero':
+        return ZeroSimulationModel(seed=seed)
+    if mode == 'random':
+        return SimulationModel(seed=seed,
+                               latency_scale=Config.SIMULATION_LATENCY_SCALE,
+                               failure_scale=Config.SIMULATION_FAILURE_SCALE)
+    raise ValueError(f"Modo de simulação inválido: '{mode}'. Use 'random' ou 'zero'.")
+
+
+_model = None
+
+
+def get_simulation_model() -> SimulationModel:
+    global _model
+    if _model is None:
+        _model = build_simulation_model()
+    return _model
+
+
+def set_simulation_model(model: SimulationModel):
+    """
+    Substitui o modelo em uso (ex: pelo harness de benchmark).
+    """
+    global _model
+    _model = model
@@ -0,0 +1,664 @@
+import heapq
+import json
+import marshal
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from itertools import accumulate
+
+from app.ids import format_order_id, parse_order_id
+
+
+class OrderItem:
+    """
+    Item de um pedido em formato compacto (__slots__, sem dict por instância).
+    """
+    __slots__ = ("product_id", "name", "quantity", "price_unit")
+
+    def __init__(self, product_id: str, name: str, quantity: int, price_unit: float):
+        self.product_id = product_id
+        self.name = name
+        self.quantity = quantity
+        self.price_unit = price_unit
+
+    def to_dict(self) -> dict:
+        return {
+            "product_id": self.product_id,
+            "name": self.name,
+            "quantity": self.quantity,
+            "price_unit": self.price_unit
+        }
+
+
+class OrderRecord:
+    """
+    Registro compacto de um pedido armazenado no OrderStore.
+    'seq' é a posição de inserção no store e serve de cursor de paginação.
+
+    Depois de inserido no store o registro é imutável: cada atualização gera um
+    novo registro com 'version' incrementada (ver OrderStore.update). Por isso
+    leitores podem usá-lo sem cópia e a resposta JSON é serializada no máximo
+    uma vez por versão.
+    """
+    __slots__ = ("seq", "order_id", "customer_id", "items", "total_amount", "status",
+                 "created_at", "last_updated_at", "notes", "version", "_payload")
+
+    def __init__(self, order_id: str, customer_id: str, items: tuple, total_amount: float,
+                 status: str, created_at: float, last_updated_at: float, notes=None, version: int = 1):
+        self.seq = -1
+        self.order_id = order_id
+        self.customer_id = customer_id
+        self.items = items
+        self.total_amount = total_amount
+        self.status = status
+        self.created_at = created_at
+        self.last_updated_at = last_updated_at
+        self.notes = notes
+        self.version = version
+        self._payload = None
+
+    @property
+    def etag(self) -> str:
+        return f"{self.order_id}.{self.version}"
+
+    def evolve(self, last_updated_at: float, fields: dict) -> "OrderRecord":
+        """
+        Retorna a próxima versão do registro com os campos alterados.
+        """
+        record = OrderRecord(
+            order_id=self.order_id,
+            customer_id=fields.get("customer_id", self.customer_id),
+            items=self.items,
+            total_amount=self.total_amount,
+            status=fields.get("status", self.status),
+            created_at=self.created_at,
+            last_updated_at=last_updated_at,
+            notes=fields.get("notes", self.notes),
+            version=self.version + 1
+        )
+        record.seq = self.seq
+        return record
+
+    def response_payload(self) -> bytes:
+        """
+        Corpo JSON de GET /orders/<id> para esta versão, serializado uma única vez.
+        """
+        payload = self._payload
+        if payload is None:
+            data = self.to_dict()
+            data["success"] = True
+            data["status_code"] = 200
+            payload = self._payload = json.dumps(data).encode()
+        return payload
+
+    def to_dict(self) -> dict:
+        data = {
+            "order_id": self.order_id,
+            "customer_id": self.customer_id,
+            "items": [item.to_dict() for item in self.items],
+            "total_amount": self.total_amount,
+            "status": self.status,
+            "created_at": self.created_at,
+            "last_updated_at": self.last_updated_at,
+            "version": self.version
+        }
+        if self.notes is not None:
+            data["notes"] = self.notes
+        return data
+
+
+def order_to_tuple(record: OrderRecord) -> tuple:
+    """
+    Forma serializável (marshal) de um pedido, usada pelo WAL, snapshots e arquivo.
+    """
+    items = tuple((item.product_id, item.name, item.quantity, item.price_unit) for item in record.items)
+    return (record.order_id, record.customer_id, items, record.total_amount, record.status,
+            record.created_at, record.last_updated_at, record.notes, record.version)
+
+
+def order_from_tuple(data) -> OrderRecord:
+    order_id, customer_id, items, total_amount, status, created_at, last_updated_at, notes, version = data
+    return OrderRecord(
+        order_id=order_id,
+        customer_id=customer_id,
+        items=tuple(OrderItem(*item) for item in items),
+        total_amount=total_amount,
+        status=status,
+        created_at=created_at,
+        last_updated_at=last_updated_at,
+        notes=notes,
+        version=version
+    )
+
+
+class OrderStore:
+    """
+    Armazenamento em memória dos pedidos com índices secundários.
+
+    - por ID: dict order_id -> seq
+    - por customer_id e por status: arrays ordenados de 'seq'
+    - por created_at: array de floats paralelo a _records (não decrescente,
+      portanto ordenado e pesquisável com bisect)
+    - pela ordem dos IDs: array com o inteiro de cada ID (ver app/ids.py), paralelo
+      a _records e não decrescente; permite retomar a paginação a partir do ID
+      de um pedido que já saiu do store
+
+    'seq' é a posição de criação do pedido e nunca muda; _seqs (crescente) leva
+    de um seq à sua posição nas listas internas. Pedidos removidos deixam
+    posições vazias, descartadas quando passam a ser metade das listas.
+
+    export_state()/load_state() copiam as listas internas em forma colunar para
+    os snapshots da persistência: na recuperação os índices são restaurados
+    diretamente e cada pedido fica serializado (marshal) até o primeiro acesso.
+
+    Os índices são mantidos por add() e update(). 'version' é incrementado a
+    cada alteração do store e permite validar respostas de listagem (ETag).
+
+    Se um 'journal' for definido (ver app/persistence.py), cada alteração é
+    registrada nele ainda sob o lock do store, na mesma ordem em que é aplicada.
+    Da mesma forma, criações e atualizações são publicadas no 'feed' (ver
+    app/changes.py), se definido, e aplicadas aos agregados de 'rollups' (ver
+    app/analytics.py), se definidos. Com um 'id_generator', add() aceita registros
+    sem order_id e gera o ID sob o lock, de forma que a ordem dos IDs é a ordem
+    de inserção.
+    """
+
+    UPDATABLE_FIELDS = ("customer_id", "status", "notes")
+    COMPACT_MIN_SLOTS = 1024  # Posições vazias mínimas antes de compactar as listas internas
+
+    def __init__(self):
+        self.journal = None
+        self.feed = None
+        self.rollups = None
+        self.id_generator = None
+        self.version = 0
+        self._lock = threading.RLock()
+        self._by_id = {}
+        self._next_seq = 0
+        self._records = []  # None nas posições de pedidos removidos
+        self._seqs = array('q')  # seq de cada posição de _records
+        self._created_at = array('d')
+        self._ids = array('Q')  # 0 para IDs de outro formato (anteriores ao gerador)
+        self._empty = 0  # Posições vazias em _records
+        self._by_customer = {}
+        self._by_status = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self._by_id
+
+    def get(self, order_id: str):
+        with self._lock:
+            seq = self._by_id.get(order_id)
+            return self._record(self._position(seq)) if seq is not None else None
+
+    def add(self, record: OrderRecord) -> OrderRecord:
+        """
+        Insere um novo pedido. Um order_id já existente no store é rejeitado
+        com ValueError, em vez de substituir o pedido atual.
+        """
+        with self._lock:
+            if record.order_id is None:
+                record.order_id = self.id_generator()
+            if record.order_id in self._by_id:
+                raise ValueError(f"Pedido {record.order_id} já existe.")
+            self._insert(record)
+            self.version += 1
+            if self.journal is not None:
+                self.journal.log_order_added(record)
+            if self.rollups is not None:
+                self.rollups.record_created(record)
+            if self.feed is not None:
+                self.feed.publish('order_created', record)
+        return record
+
+    def bulk_load(self, records):
+        """
+        Carrega registros em ordem de criação (recuperação de snapshot no
+        formato anterior), montando os índices sem passar pelo journal.
+        """
+        with self._lock:
+            for record in records:
+                self._insert(record)
+            self.version += 1
+
+    def _insert(self, record: OrderRecord):
+        # Mantém created_at não decrescente em relação à ordem de inserção,
+        # mesmo que o relógio do sistema volte no tempo.
+        if self._created_at and record.created_at < self._created_at[-1]:
+            record.created_at = self._created_at[-1]
+        record.seq = self._next_seq
+        self._next_seq += 1
+        self._records.append(record)
+        self._seqs.append(record.seq)
+        self._created_at.append(record.created_at)
+        # Idem para os IDs (um ID fora de ordem só afeta a retomada de paginação a partir dele)
+        id_value = parse_order_id(record.order_id) or 0
+        self._ids.append(max(id_value, self._ids[-1]) if self._ids else id_value)
+        self._by_id[record.order_id] = record.seq
+        self._index(self._by_customer, record.customer_id).append(record.seq)
+        self._index(self._by_status, record.status).append(record.seq)
+
+    @staticmethod
+    def _index(index: dict, key) -> array:
+        seqs = index.get(key)
+        if seqs is None:
+            seqs = index[key] = array('q')
+        return seqs
+
+    def _record(self, position: int):
+        # Pedidos restaurados de um snapshot ficam serializados até o primeiro acesso (None: removido)
+        record = self._records[position]
+        if record.__class__ is bytes:
+            record = order_from_tuple(marshal.loads(record))
+            record.seq = self._seqs[position]
+            self._records[position] = record
+        return record
+
+    def records(self) -> list:
+        """
+        Retorna uma lista (cópia rasa) dos registros vivos, em ordem de criação.
+        """
+        with self._lock:
+            return [self._record(position) for position, record in enumerate(self._records) if record is not None]
+
+    def export_state(self) -> tuple:
+        """
+        Cópia das listas internas para snapshot, com os pedidos serializados
+        (marshal de order_to_tuple). Só a cópia é feita sob o lock; os pedidos
+        já carregados são serializados fora dele.
+        """
+        with self._lock:
+            state = self._copy_state()
+        return self._encode_state(state)
+
+    def capture(self, extra=None) -> tuple:
+        """
+        Retorna (export_state(), extra()) obtidos sob o lock do store, ou seja,
+        sem nenhuma alteração entre as duas leituras (usado pelos snapshots).
+        """
+        with self._lock:
+            state = self._copy_state()
+            extra_state = extra() if extra is not None else None
+        return self._encode_state(state), extra_state
+
+    def _copy_state(self) -> tuple:
+        return (
+            self._next_seq,
+            list(self._by_id),
+            array('q', self._by_id.values()),
+            list(self._records),
+            self._seqs[:],
+            self._created_at[:],
+            self._ids[:],
+            {customer_id: seqs[:] for customer_id, seqs in self._by_customer.items()},
+            {status: seqs[:] for status, seqs in self._by_status.items()}
+        )
+
+    @staticmethod
+    def _encode_state(state: tuple) -> tuple:
+        next_seq, order_ids, id_seqs, records, seqs, created_at, ids, by_customer, by_status = state
+        return (
+            next_seq,
+            order_ids,
+            id_seqs.tobytes(),
+            [record if record is None or record.__class__ is bytes else marshal.dumps(order_to_tuple(record))
+             for record in records],
+            seqs.tobytes(),
+            created_at.tobytes(),
+            ids.tobytes(),
+            {customer_id: customer_seqs.tobytes() for customer_id, customer_seqs in by_customer.items()},
+            {status: status_seqs.tobytes() for status, status_seqs in by_status.items()}
+        )
+
+    def load_state(self, state: tuple):
+        """
+        Restaura um store vazio a partir de export_state(), sem passar pelo journal.
+        """
+        next_seq, order_ids, id_seqs, records, seqs, created_at, ids, by_customer, by_status = state
+        with self._lock:
+            self._next_seq = next_seq
+            self._by_id = dict(zip(order_ids, array('q', id_seqs)))
+            self._records = records
+            self._seqs = array('q', seqs)
+            self._created_at = array('d', created_at)
+            self._ids = array('Q', ids)
+            self._empty = len(records) - len(order_ids)
+            self._by_customer = {customer_id: array('q', customer_seqs) for customer_id, customer_seqs in by_customer.items()}
+            self._by_status = {status: array('q', status_seqs) for status, status_seqs in by_status.items()}
+            self.version += 1
+
+    def update(self, order_id: str, last_updated_at: float, **fields) -> tuple:
+        """
+        Atualiza campos de um pedido (customer_id, status, notes) mantendo os índices.
+        O registro anterior não é alterado: a nova versão o substitui no store.
+        Retorna (registro_anterior, registro_novo).
+        """
+        with self._lock:
+            position = self._position(self._by_id[order_id])
+            current = self._record(position)
+            for key in fields:
+                if key not in self.UPDATABLE_FIELDS:
+                    raise KeyError(key)
+            record = current.evolve(last_updated_at, fields)
+            if record.customer_id != current.customer_id:
+                self._move(self._by_customer, current.customer_id, record.customer_id, record.seq)
+            if record.status != current.status:
+                self._move(self._by_status, current.status, record.status, record.seq)
+            self._records[position] = record
+            self.version += 1
+            if self.journal is not None:
+                self.journal.log_order_updated(record, fields)
+            if self.rollups is not None:
+                self.rollups.record_updated(current, record)
+            if self.feed is not None:
+                self.feed.publish('order_updated', record, fields)
+        return current, record
+
+    def remove(self, records) -> list:
+        """
+        Remove do store os registros informados (retenção), desde que ainda sejam
+        a versão atual do pedido; retorna os que foram removidos. As listas
+        internas são compactadas quando metade das posições está vazia.
+        """
+        with self._lock:
+            removed = []
+            for record in records:
+                position = self._position(record.seq)
+                if position < len(self._records) and self._records[position] is record:
+                    removed.append((position, record))
+            if not removed:
+                return []
+            by_customer = {}
+            by_status = {}
+            for position, record in removed:
+                del self._by_id[record.order_id]
+                self._records[position] = None
+                by_customer.setdefault(record.customer_id, []).append(record.seq)
+                by_status.setdefault(record.status, []).append(record.seq)
+            self._discard(self._by_customer, by_customer)
+            self._discard(self._by_status, by_status)
+            self._empty += len(removed)
+            if self._empty >= self.COMPACT_MIN_SLOTS and self._empty * 2 >= len(self._records):
+                self._compact()
+            self.version += 1
+            if self.journal is not None:
+                self.journal.log_orders_removed([record.order_id for _, record in removed])
+        return [record for _, record in removed]
+
+    def discard(self, order_id: str):
+        """
+        Desfaz a criação de um pedido que não pôde ser persistido: remove-o do
+        store e dos agregados de 'rollups'. Retorna o registro removido ou None.
+        """
+        with self._lock:
+            record = self.get(order_id)
+            if record is None:
+                return None
+            self.remove([record])
+            if self.rollups is not None:
+                self.rollups.record_deleted(record)
+        return record
+
+    @staticmethod
+    def _discard(index: dict, seqs_by_key: dict):
+        """
+        Retira os seqs de cada lista do índice localizando-os com bisect e
+        apagando trechos contíguos (a retenção remove os pedidos mais antigos de
+        cada status, em geral um único trecho no início da lista).
+        """
+        for key, seqs in seqs_by_key.items():
+            current = index[key]
+            if len(seqs) == len(current):
+                del index[key]
+                continue
+            positions = sorted(bisect_left(current, seq) for seq in seqs)
+            end = len(positions)
+            while end:
+                start = end - 1
+                while start and positions[start - 1] == positions[start] - 1:
+                    start -= 1
+                del current[positions[start]:positions[end - 1] + 1]
+                end = start
+
+    def _compact(self):
+        # Mantém a última posição, mesmo vazia: created_at e ID dela são o piso dos próximos inserts
+        last = len(self._records) - 1
+        keep = [position for position, record in enumerate(self._records) if record is not None or position == last]
+        self._records = [self._records[position] for position in keep]
+        self._seqs = array('q', [self._seqs[position] for position in keep])
+        self._created_at = array('d', [self._created_at[position] for position in keep])
+        self._ids = array('Q', [self._ids[position] for position in keep])
+        self._empty = len(self._records) - len(self._by_id)
+
+    def _position(self, seq: int) -> int:
+        """Posição nas listas internas do primeiro seq >= 'seq'."""
+        return bisect_left(self._seqs, seq)
+
+    def _seq_at(self, position: int) -> int:
+        return self._seqs[position] if position < len(self._seqs) else self._next_seq
+
+    def seq_after(self, order_id: str):
+        """
+        Posição (seq) seguinte à do pedido 'order_id' na ordem de criação, mesmo
+        que ele já tenha sido removido (pelo ID, que é ordenado pelo tempo).
+        Retorna None se o ID não está no store nem no formato do gerador.
+        """
+        with self._lock:
+            seq = self._by_id.get(order_id)
+            if seq is not None:
+                return seq + 1
+            id_value = parse_order_id(order_id)
+            if id_value is None:
+                return None
+            return self._seq_at(bisect_right(self._ids, id_value))
+
+    def highest_order_id(self):
+        """
+        Maior ID no formato do gerador já inserido, mesmo que o pedido tenha
+        sido removido depois (a última posição sobrevive à compactação), ou None.
+        """
+        with self._lock:
+            return format_order_id(self._ids[-1]) if self._ids and self._ids[-1] else None
+
+    def retention_candidates(self, statuses, updated_before: float, limit: int, chunk_size: int = 5000) -> list:
+        """
+        Até 'limit' registros com status em 'statuses' e last_updated_at anterior a
+        'updated_before', dos mais antigos para os mais novos. Percorre os índices
+        de status em blocos para não segurar o lock durante toda a varredura.
+        """
+        result = []
+        for status in statuses:
+            position = 0
+            while len(result) < limit:
+                with self._lock:
+                    seqs = self._by_status.get(status)
+                    if not seqs:
+                        break
+                    position = bisect_left(seqs, position)
+                    chunk = seqs[position:position + chunk_size]
+                    for seq in chunk:
+                        record = self._record(self._position(seq))
+                        if record is not None and record.last_updated_at < updated_before:
+                            result.append(record)
+                            if len(result) >= limit:
+                                break
+                if len(chunk) < chunk_size:
+                    break
+                position = chunk[-1] + 1
+        return result
+
+    @staticmethod
+    def _move(index: dict, old_key, new_key, seq: int):
+        seqs = index[old_key]
+        del seqs[bisect_left(seqs, seq)]
+        if not seqs:
+            del index[old_key]
+        insort(OrderStore._index(index, new_key), seq)
+
+    def stats(self, oldest_status: str = "pending") -> dict:
+        """
+        Estatísticas do store em O(quantidade de status), a partir dos índices:
+        total, contagem por status e created_at do pedido mais antigo em 'oldest_status'.
+        """
+        with self._lock:
+            seqs = self._by_status.get(oldest_status)
+            return {
+                "size": len(self._by_id),
+                "by_status": {status: len(seqs) for status, seqs in self._by_status.items()},
+                "oldest_pending_created_at": self._created_at[self._position(seqs[0])] if seqs else None
+            }
+
+    def query(self, status: str = None, customer_id: str = None, since: float = None,
+              until: float = None, start: int = 0, limit: int = 100):
+        """
+        Retorna (registros, próximo_seq) para os pedidos que atendem aos filtros,
+        em ordem de criação, começando em 'start' (seq). 'since' é inclusivo e
+        'until' é exclusivo. próximo_seq é None quando não há mais candidatos.
+        """
+        with self._lock:
+            lo_position = self._position(start)
+            hi_position = len(self._records)
+            if since is not None:
+                lo_position = max(lo_position, bisect_left(self._created_at, since))
+            if until is not None:
+                hi_position = min(hi_position, bisect_left(self._created_at, until))
+            lo = self._seq_at(lo_position)
+            hi = self._seq_at(hi_position)
+
+            # Escolhe o menor índice aplicável como fonte de candidatos
+            candidates = None
+            if customer_id is not None:
+                candidates = self._by_customer.get(customer_id, [])
+            if status is not None:
+                by_status = self._by_status.get(status, [])
+                if candidates is None or len(by_status) < len(candidates):
+                    candidates = by_status
+
+            if candidates is None:
+                positions = range(lo_position, hi_position)
+                idx = 0
+            else:
+                idx = bisect_left(candidates, lo)
+                positions = candidates
+
+            result = []
+            end = len(positions)
+            while idx < end:
+                if candidates is None:
+                    record = self._record(positions[idx])
+                else:
+                    seq = positions[idx]
+                    if seq >= hi:
+                        break
+                    record = self._record(self._position(seq))
+                idx += 1
+                if record is None:
+                    continue
+                if status is not None and record.status != status:
+                    continue
+                if customer_id is not None and record.customer_id != customer_id:
+                    continue
+                result.append(record)
+                if len(result) >= limit:
+                    break
+
+            has_more = idx < end and (candidates is None or positions[idx] < hi)
+            return result, (result[-1].seq + 1 if has_more else None)
+
+    def iter_records(self, status: str = None, customer_id: str = None, chunk_size: int = 500):
+        """
+        Gera os registros em ordem de criação, consultando o store em blocos
+        para não segurar o lock durante toda a iteração.
+        """
+        start = 0
+        while start is not None:
+            records, start = self.query(status=status, customer_id=customer_id,
+                                        start=start, limit=chunk_size)
+            yield from records
+
+
+class ProductCatalog:
+    """
+    Catálogo de produtos em colunas compactas: preços e estoques em arrays
+    ('d' e 'q', 8 bytes por produto), nomes e IDs em listas e um dict
+    product_id -> linha como índice. Evita um dict por produto em catálogos
+    com centenas de milhares de SKUs.
+
+    O estoque é alterado pelo Inventory sob seus locks; aqui não há lock.
+    """
+
+    def __init__(self):
+        self._rows = {}  # product_id -> linha
+        self.product_ids = []
+        self.names = []
+        self.prices = array('d')
+        self.stock = array('q')
+
+    @classmethod
+    def from_dict(cls, products: dict) -> "ProductCatalog":
+        catalog = cls()
+        catalog.extend((product_id, data["name"], data["price"], data["stock"])
+                       for product_id, data in products.items())
+        return catalog
+
+    def extend(self, rows):
+        """
+        Carrega linhas (product_id, name, price, stock). Um product_id repetido
+        substitui a linha anterior.
+        """
+        for product_id, name, price, stock in rows:
+            row = self._rows.get(product_id)
+            if row is not None:
+                self.names[row] = name
+                self.prices[row] = price
+                self.stock[row] = stock
+                continue
+            self._rows[product_id] = len(self.product_ids)
+            self.product_ids.append(product_id)
+            self.names.append(name)
+            self.prices.append(price)
+            self.stock.append(stock)
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def __contains__(self, product_id) -> bool:
+        return product_id in self._rows
+
+    def row(self, product_id):
+        """Linha do produto nas colunas, ou None se não existir."""
+        return self._rows.get(product_id)
+
+    def get_stock(self, product_id: str) -> int:
+        return self.stock[self._rows[product_id]]
+
+    def set_stock(self, product_id: str, value: int):
+        self.stock[self._rows[product_id]] = value
+
+    def stock_items(self):
+        """Pares (product_id, estoque) de todos os produtos."""
+        return zip(self.product_ids, self.stock.tolist())
+
+    def stock_stats(self, low_stock_top_n: int, bounds: tuple) -> dict:
+        """
+        Resumo do estoque com tamanho limitado, independente do número de SKUs:
+        os 'low_stock_top_n' produtos com menor estoque, contagens cumulativas
+        (estoque <= limite) para cada limite de 'bounds', soma e produtos zerados.
+        """
+        stock = self.stock.tolist()  # Cópia consistente o bastante para métricas
+        per_bucket = [0] * (len(bounds) + 1)
+        for value, count in Counter(stock).items():  # Poucos valores distintos em relação aos SKUs
+            per_bucket[bisect_left(bounds, value)] += count
+        cumulative = list(accumulate(per_bucket))
+        lowest = heapq.nsmallest(low_stock_top_n, range(len(stock)), key=stock.__getitem__)
+        return {
+            "products": len(stock),
+            "out_of_stock": stock.count(0),
+            "low_stock": [(self.product_ids[row], stock[row]) for row in lowest],
+            "buckets": list(zip(bounds, cumulative)),
+            "sum": sum(stock)
+        }
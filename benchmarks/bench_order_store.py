@@ -0,0 +1,108 @@
+"""
+Benchmark do OrderStore contra o layout original (dict de dicts).
+
+Mede a memória por pedido (tracemalloc) e a latência das consultas por cliente
+e por status num intervalo de tempo (varredura completa vs. índices).
+
+Uso:
+    python benchmarks/bench_order_store.py [--orders 200000] [--customers 5000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.store import OrderItem, OrderRecord, OrderStore  # noqa: E402
+
+PRODUCTS = [("Mouse", 59.99), ("Teclado", 249.99), ("Monitor", 259.99), ("Cadeira", 279.99), ("Notebook", 1500.00)]
+STATUSES = ["pending", "processed", "shipped", "delivered", "cancelled"]
+
+
+def _order_fields(i: int, customers: int, base_time: float):
+    product_id, price = PRODUCTS[i % len(PRODUCTS)]
+    quantity = 1 + i % 3
+    return (f"ORDER-{i:012d}", f"CUST-{i % customers}", product_id, price, quantity,
+            STATUSES[i % len(STATUSES)], base_time + i * 0.001)
+
+
+def build_dict_layout(n: int, customers: int, base_time: float) -> dict:
+    db = {}
+    for i in range(n):
+        order_id, customer_id, product_id, price, quantity, status, created_at = _order_fields(i, customers, base_time)
+        db[order_id] = {
+            "customer_id": customer_id,
+            "items": [{"product_id": product_id, "name": product_id, "quantity": quantity, "price_unit": price}],
+            "total_amount": price * quantity,
+            "status": status,
+            "created_at": created_at,
+            "last_updated_at": created_at
+        }
+    return db
+
+
+def build_order_store(n: int, customers: int, base_time: float) -> OrderStore:
+    store = OrderStore()
+    for i in range(n):
+        order_id, customer_id, product_id, price, quantity, status, created_at = _order_fields(i, customers, base_time)
+        store.add(OrderRecord(
+            order_id=order_id,
+            customer_id=customer_id,
+            items=(OrderItem(product_id, product_id, quantity, price),),
+            total_amount=price * quantity,
+            status=status,
+            created_at=created_at,
+            last_updated_at=created_at
+        ))
+    return store
+
+
+def measure_memory(builder, n: int, customers: int, base_time: float):
+    tracemalloc.start()
+    structure = builder(n, customers, base_time)
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return structure, current / n
+
+
+def timeit(fn, repeat: int = 20) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--customers", type=int, default=5_000)
+    args = parser.parse_args()
+
+    base_time = time.time()
+    db, dict_bytes = measure_memory(build_dict_layout, args.orders, args.customers, base_time)
+    store, store_bytes = measure_memory(build_order_store, args.orders, args.customers, base_time)
+
+    print(f"Pedidos: {args.orders}  Clientes: {args.customers}")
+    print(f"Memória por pedido: dict={dict_bytes:.0f} B  OrderStore={store_bytes:.0f} B "
+          f"({dict_bytes / store_bytes:.2f}x)")
+
+    customer_id = "CUST-42"
+    since = base_time + args.orders * 0.001 * 0.50
+    until = base_time + args.orders * 0.001 * 0.51
+
+    scan_customer = timeit(lambda: [o for o in db.values() if o["customer_id"] == customer_id], repeat=5)
+    index_customer = timeit(lambda: store.query(customer_id=customer_id, limit=args.orders))
+    scan_range = timeit(lambda: [o for o in db.values()
+                                 if o["status"] == "pending" and since <= o["created_at"] < until], repeat=5)
+    index_range = timeit(lambda: store.query(status="pending", since=since, until=until, limit=args.orders))
+
+    print(f"Pedidos por cliente:           varredura={scan_customer * 1e3:.3f} ms  índice={index_customer * 1e3:.3f} ms")
+    print(f"Status num intervalo de tempo: varredura={scan_range * 1e3:.3f} ms  índice={index_range * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Harness de replay de tráfego contra create_app().
+
+Lê requisições de um arquivo JSONL (uma por linha) e as reproduz em processo,
+com o test client do Flask, na concorrência e taxa configuradas. Reporta
+throughput e p50/p95/p99 por endpoint (template da rota), alocações por
+requisição e compara o resultado com um baseline salvo.
+
+Formato de cada linha do JSONL:
+    {"method": "POST", "path": "/orders", "headers": {...}, "json": {...}}
+Em 'path', o marcador {order_id} é substituído pelo último pedido criado
+pela mesma thread.
+
+Os números dependem da máquina, então o baseline é gerado localmente (e não
+versionado) antes das alterações a comparar.
+
+Uso:
+    python benchmarks/replay.py --traffic benchmarks/traffic/sample.jsonl \\
+        --concurrency 1 --iterations 200 --simulation zero \\
+        --save-baseline benchmarks/baselines/local.json
+    python benchmarks/replay.py --concurrency 1 --iterations 200 --simulation zero \\
+        --baseline benchmarks/baselines/local.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.simulation import build_simulation_model, set_simulation_model  # noqa: E402
+from config.config import Config  # noqa: E402
+
+DEFAULT_TRAFFIC = os.path.join(os.path.dirname(__file__), 'traffic', 'sample.jsonl')
+
+
+def load_traffic(path: str) -> list:
+    traffic = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "method" not in entry or "path" not in entry:
+                raise ValueError(f"{path}:{line_number}: cada linha precisa de 'method' e 'path'.")
+            headers = dict(entry.get("headers") or {})
+            # A chave de API do ambiente substitui o marcador {api_key}
+            for name, value in headers.items():
+                if value == "{api_key}":
+                    headers[name] = Config.API_KEY_REQUIRED
+            traffic.append((entry["method"].upper(), entry["path"], headers, entry.get("json")))
+    return traffic
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Replayer:
+    """
+    Reproduz o tráfego com um test client por thread e coleta as latências
+    por endpoint.
+    """
+
+    def __init__(self, app, traffic: list, concurrency: int, rate: float):
+        self._app = app
+        self._traffic = traffic
+        self._concurrency = concurrency
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._adapter = app.url_map.bind('localhost')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self.latencies = {}  # endpoint -> [segundos]
+        self.statuses = {}  # endpoint -> {status: quantidade}
+
+    def endpoint_label(self, method: str, path: str) -> str:
+        try:
+            rule, _ = self._adapter.match(path.split('?', 1)[0], method=method, return_rule=True)
+            return f"{method} {rule.rule}"
+        except Exception:
+            return f"{method} __unmatched__"
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+            self._local.last_order_id = "ORDER-0"
+        return client
+
+    def _pace(self):
+        # Limita a taxa global distribuindo horários de início entre as threads
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.perf_counter()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self._interval
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def send(self, request: tuple, record: bool = True):
+        method, path, headers, body = request
+        client = self._client()
+        path = path.replace("{order_id}", self._local.last_order_id)
+        self._pace()
+        start = time.perf_counter()
+        response = client.open(path, method=method, headers=headers, json=body)
+        elapsed = time.perf_counter() - start
+
+        if method == "POST" and response.status_code == 201 and response.is_json:
+            order_id = (response.get_json() or {}).get("order_id")
+            if order_id:
+                self._local.last_order_id = order_id
+
+        if record:
+            label = self.endpoint_label(method, path)
+            with self._lock:
+                self.latencies.setdefault(label, []).append(elapsed)
+                counts = self.statuses.setdefault(label, {})
+                counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        return response
+
+    def run(self, iterations: int) -> float:
+        requests = self._traffic * iterations
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            list(executor.map(self.send, requests))
+        return time.perf_counter() - start
+
+
+def measure_allocations(replayer: Replayer, traffic: list, samples: int) -> dict:
+    """
+    Passada sequencial com tracemalloc: blocos alocados (líquidos) e pico de
+    memória por requisição, por endpoint.
+    """
+    results = {}
+    tracemalloc.start()
+    try:
+        for request in (traffic * samples):
+            label = replayer.endpoint_label(request[0], request[1])
+            tracemalloc.reset_peak()
+            before_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+            before_size, _ = tracemalloc.get_traced_memory()
+            replayer.send(request, record=False)
+            _, peak = tracemalloc.get_traced_memory()
+            after_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+            entry = results.setdefault(label, {"peak_bytes": [], "net_blocks": []})
+            entry["peak_bytes"].append(peak - before_size)
+            entry["net_blocks"].append(after_blocks - before_blocks)
+    finally:
+        tracemalloc.stop()
+    return {label: {"peak_kib_per_request": sum(v["peak_bytes"]) / len(v["peak_bytes"]) / 1024,
+                    "net_blocks_per_request": sum(v["net_blocks"]) / len(v["net_blocks"])}
+            for label, v in results.items()}
+
+
+def summarize(replayer: Replayer, wall_seconds: float) -> dict:
+    summary = {}
+    for label, values in sorted(replayer.latencies.items()):
+        ordered = sorted(values)
+        summary[label] = {
+            "requests": len(ordered),
+            "throughput_rps": len(ordered) / wall_seconds if wall_seconds else 0.0,
+            "p50_ms": percentile(ordered, 0.50) * 1e3,
+            "p95_ms": percentile(ordered, 0.95) * 1e3,
+            "p99_ms": percentile(ordered, 0.99) * 1e3,
+            "statuses": {str(k): v for k, v in sorted(replayer.statuses[label].items())}
+        }
+    return summary
+
+
+def compare_with_baseline(summary: dict, baseline: dict, tolerance: float, p99_tolerance: float) -> list:
+    """
+    Retorna a lista de regressões: p50/p95 acima de (1 + tolerância) x baseline,
+    p99 acima de (1 + p99_tolerance) x baseline (a cauda é mais ruidosa) ou
+    throughput abaixo de (1 - tolerância) x baseline.
+    """
+    regressions = []
+    for label, reference in baseline.items():
+        current = summary.get(label)
+        if current is None:
+            continue
+        for key, limit in (("p50_ms", tolerance), ("p95_ms", tolerance), ("p99_ms", p99_tolerance)):
+            if current[key] > reference[key] * (1 + limit):
+                regressions.append(f"{label}: {key} {current[key]:.2f} > baseline {reference[key]:.2f}")
+        if current["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {current['throughput_rps']:.1f} rps < "
+                               f"baseline {reference['throughput_rps']:.1f} rps")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traffic", default=DEFAULT_TRAFFIC, help="Arquivo JSONL com as requisições.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0.0, help="Requisições por segundo (0 = sem limite).")
+    parser.add_argument("--iterations", type=int, default=200, help="Quantas vezes o arquivo é reproduzido.")
+    parser.add_argument("--warmup", type=int, default=1, help="Iterações de aquecimento (não medidas).")
+    parser.add_argument("--simulation", choices=("zero", "random"), default="zero")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--alloc-samples", type=int, default=3,
+                        help="Iterações sequenciais com tracemalloc (0 desativa).")
+    parser.add_argument("--baseline", help="Baseline JSON para comparar.")
+    parser.add_argument("--save-baseline", help="Grava o resultado como baseline neste arquivo.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Tolerância para p50, p95 e throughput.")
+    parser.add_argument("--p99-tolerance", type=float, default=1.0, help="Tolerância para p99.")
+    args = parser.parse_args()
+
+    set_simulation_model(build_simulation_model(args.simulation, seed=args.seed))
+
+    from run import create_app
+    app = create_app()
+    traffic = load_traffic(args.traffic)
+
+    warmup = Replayer(app, traffic, args.concurrency, 0.0)
+    warmup.run(args.warmup)
+
+    replayer = Replayer(app, traffic, args.concurrency, args.rate)
+    wall_seconds = replayer.run(args.iterations)
+    summary = summarize(replayer, wall_seconds)
+
+    allocations = measure_allocations(replayer, traffic, args.alloc_samples) if args.alloc_samples else {}
+
+    total = sum(entry["requests"] for entry in summary.values())
+    print(f"Requisições: {total} em {wall_seconds:.2f}s ({total / wall_seconds:.1f} req/s), "
+          f"concorrência={args.concurrency}, simulação={args.simulation}")
+    print(f"{'endpoint':<45} {'req':>6} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'KiB/req':>8} {'blocos':>7}")
+    for label, entry in summary.items():
+        alloc = allocations.get(label, {})
+        print(f"{label:<45} {entry['requests']:>6} {entry['throughput_rps']:>9.1f} {entry['p50_ms']:>8.2f} "
+              f"{entry['p95_ms']:>8.2f} {entry['p99_ms']:>8.2f} {alloc.get('peak_kib_per_request', 0):>8.1f} "
+              f"{alloc.get('net_blocks_per_request', 0):>7.0f}")
+        entry.update(alloc)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        print(f"Baseline gravado em {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(summary, baseline, args.tolerance, args.p99_tolerance)
+        if regressions:
+            print("REGRESSÕES:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"Sem regressões em relação a {args.baseline} (tolerância {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
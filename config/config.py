@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv() # Carrega as variáveis de ambiente do arquivo .env
@@ -12,9 +13,102 @@ class Config:
     PROMETHEUS_PORT = int(os.getenv('PROMETHEUS_PORT', 9090))
     GRAFANA_PORT = int(os.getenv('GRAFANA_PORT', 3001))
 
+    # Métricas em modo multiprocesso (gunicorn com vários workers): cada worker grava
+    # suas métricas em arquivos mmap neste diretório e o /metrics agrega todos no scrape.
+    METRICS_MULTIPROCESS = os.getenv('METRICS_MULTIPROCESS', 'false').lower() == 'true'
+    METRICS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR',
+                                      os.path.join(tempfile.gettempdir(), 'api_pedidos_prometheus'))
+    # Limite de séries (combinações de labels) por métrica no middleware de requisições
+    METRICS_MAX_SERIES_PER_METRIC = int(os.getenv('METRICS_MAX_SERIES_PER_METRIC', 1000))
+    # Cache da saída serializada do /metrics (0 desativa) e nível de compressão gzip
+    METRICS_CACHE_TTL_SECONDS = float(os.getenv('METRICS_CACHE_TTL_SECONDS', 1.0))
+    METRICS_GZIP_LEVEL = int(os.getenv('METRICS_GZIP_LEVEL', 6))
+    # Buckets (em segundos, separados por vírgula) do histograma de etapas da criação de pedidos
+    ORDER_STAGE_BUCKETS = tuple(float(b) for b in os.getenv(
+        'ORDER_STAGE_BUCKETS', '0.0001,0.0005,0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1'
+    ).split(','))
+    # Profiler por amostragem do endpoint /admin/profile
+    PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', 60))
+    PROFILER_DEFAULT_INTERVAL_SECONDS = float(os.getenv('PROFILER_DEFAULT_INTERVAL_SECONDS', 0.005))
+
     # Configurações para simulação de e-commerce
     ORDER_PROCESSING_MIN_LATENCY_SECONDS = 0.1
     ORDER_PROCESSING_MAX_LATENCY_SECONDS = 0.5
     PAYMENT_GATEWAY_FAILURE_CHANCE = 0.15 # 15% de chance de falha no pagamento
     STOCK_VALIDATION_FAILURE_CHANCE = 0.05 # 5% de chance de falha na validação de estoque
-    API_KEY_REQUIRED = os.getenv('API_KEY_REQUIRED', 'minha_chave_secreta_empresa') # Chave de API para autenticação simulada
\ No newline at end of file
+    ORDER_UPDATE_FAILURE_CHANCE = 0.05 # 5% de chance de falha interna na atualização de pedidos
+    # Modelo de latência/falhas simuladas: 'random' (padrão) ou 'zero' (sem esperas nem falhas)
+    SIMULATION_MODE = os.getenv('SIMULATION_MODE', 'random')
+    SIMULATION_SEED = int(os.getenv('SIMULATION_SEED')) if os.getenv('SIMULATION_SEED') else None
+    SIMULATION_LATENCY_SCALE = float(os.getenv('SIMULATION_LATENCY_SCALE', 1.0)) # Multiplicador das latências simuladas
+    SIMULATION_FAILURE_SCALE = float(os.getenv('SIMULATION_FAILURE_SCALE', 1.0)) # Multiplicador das chances de falha
+    ORDER_BATCH_MAX_SIZE = int(os.getenv('ORDER_BATCH_MAX_SIZE', 500)) # Pedidos por chamada de POST /orders/batch
+    PAYMENT_GATEWAY_CONCURRENCY = int(os.getenv('PAYMENT_GATEWAY_CONCURRENCY', 32)) # Pagamentos simultâneos por lote
+    # Cache de respostas de POST /orders com Idempotency-Key
+    IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000))
+    IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+    IDEMPOTENCY_WAIT_TIMEOUT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT_SECONDS', 30))
+    IDEMPOTENCY_KEY_MAX_LENGTH = 255
+    # Catálogo de produtos (CSV ou JSON com product_id, name, price, stock). Vazio usa o catálogo padrão.
+    PRODUCT_CATALOG_PATH = os.getenv('PRODUCT_CATALOG_PATH', '')
+    # Métricas de estoque: quantos produtos de menor estoque exportar e limites do histograma de níveis
+    INVENTORY_LOW_STOCK_TOP_N = int(os.getenv('INVENTORY_LOW_STOCK_TOP_N', 20))
+    INVENTORY_STOCK_BUCKETS = tuple(int(b) for b in os.getenv(
+        'INVENTORY_STOCK_BUCKETS', '0,10,50,100,250,500,1000,5000'
+    ).split(','))
+    INVENTORY_LOCK_STRIPES = int(os.getenv('INVENTORY_LOCK_STRIPES', 64)) # Locks de estoque (striping por produto)
+    API_KEY_REQUIRED = os.getenv('API_KEY_REQUIRED', 'minha_chave_secreta_empresa') # Chave de API para autenticação simulada
+
+    # IDs de pedido (app/ids.py): node ID da máquina (0-15, distinto entre máquinas) combinado com o
+    # slot reservado por processo com flock num arquivo de ORDER_ID_WORKER_DIR (um diretório por máquina)
+    ORDER_ID_NODE_ID = int(os.getenv('ORDER_ID_NODE_ID', 0))
+    ORDER_ID_WORKER_DIR = os.getenv('ORDER_ID_WORKER_DIR', os.path.join(tempfile.gettempdir(), 'api_pedidos_order_ids'))
+
+    # Paginação de GET /orders
+    ORDERS_PAGE_DEFAULT_LIMIT = int(os.getenv('ORDERS_PAGE_DEFAULT_LIMIT', 100))
+    ORDERS_PAGE_MAX_LIMIT = int(os.getenv('ORDERS_PAGE_MAX_LIMIT', 1000))
+
+    # Feed de alterações (GET /orders/changes): eventos mantidos para retomada, conexões por processo e keepalive
+    CHANGE_FEED_BUFFER_SIZE = int(os.getenv('CHANGE_FEED_BUFFER_SIZE', 10000))
+    CHANGE_FEED_MAX_SUBSCRIBERS = int(os.getenv('CHANGE_FEED_MAX_SUBSCRIBERS', 1000))
+    CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv('CHANGE_FEED_HEARTBEAT_SECONDS', 15))
+    # Conexões do feed servidas pelas rotas Flask (uma thread presa por conexão): por padrão as threads
+    # do worker gunicorn menos uma, reservada para as demais requisições. Não se aplica ao servidor ASGI.
+    CHANGE_FEED_MAX_BLOCKING_SUBSCRIBERS = int(os.getenv('CHANGE_FEED_MAX_BLOCKING_SUBSCRIBERS',
+                                                         max(0, int(os.getenv('GUNICORN_THREADS', 8)) - 1)))
+
+    # Threads da aplicação ASGI para as rotas repassadas ao Flask (ver run.create_asgi_app)
+    ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 16))
+
+    # Controle de admissão: rate limit por API key (token bucket; taxa 0 desativa) e limite
+    # adaptativo de requisições simultâneas por processo. /health e /metrics nunca são rejeitados.
+    ADMISSION_CONTROL_ENABLED = os.getenv('ADMISSION_CONTROL_ENABLED', 'true').lower() == 'true'
+    ADMISSION_RATE_PER_KEY = float(os.getenv('ADMISSION_RATE_PER_KEY', 1000)) # Requisições por segundo por chave
+    ADMISSION_BURST_PER_KEY = float(os.getenv('ADMISSION_BURST_PER_KEY', 2000))
+    ADMISSION_MAX_TRACKED_KEYS = int(os.getenv('ADMISSION_MAX_TRACKED_KEYS', 10000))
+    ADMISSION_INITIAL_CONCURRENCY = int(os.getenv('ADMISSION_INITIAL_CONCURRENCY', 100))
+    ADMISSION_MIN_CONCURRENCY = int(os.getenv('ADMISSION_MIN_CONCURRENCY', 10))
+    ADMISSION_MAX_CONCURRENCY = int(os.getenv('ADMISSION_MAX_CONCURRENCY', 5000))
+    ADMISSION_LATENCY_TOLERANCE = float(os.getenv('ADMISSION_LATENCY_TOLERANCE', 1.5)) # Aumento de latência tolerado
+    ADMISSION_LOW_PRIORITY_SHARE = float(os.getenv('ADMISSION_LOW_PRIORITY_SHARE', 0.8)) # Fração do limite para leituras
+    ADMISSION_RETRY_AFTER_SECONDS = float(os.getenv('ADMISSION_RETRY_AFTER_SECONDS', 1))
+
+    # Agregados de vendas (/analytics): tamanho do intervalo e quantidade de intervalos na janela recente
+    ANALYTICS_BUCKET_SECONDS = int(os.getenv('ANALYTICS_BUCKET_SECONDS', 60))
+    ANALYTICS_WINDOW_BUCKETS = int(os.getenv('ANALYTICS_WINDOW_BUCKETS', 60))
+
+    # Persistência opcional de pedidos e estoque (WAL + snapshots). Desativada se vazio.
+    PERSISTENCE_DIR = os.getenv('PERSISTENCE_DIR', '')
+    WAL_GROUP_COMMIT_DELAY_SECONDS = float(os.getenv('WAL_GROUP_COMMIT_DELAY_SECONDS', 0.0)) # Espera extra para agrupar fsyncs
+    WAL_SYNC_COMMIT = os.getenv('WAL_SYNC_COMMIT', 'true').lower() == 'true' # Responde só após o fsync do pedido
+    SNAPSHOT_EVERY_RECORDS = int(os.getenv('SNAPSHOT_EVERY_RECORDS', 100000)) # Registros do WAL entre snapshots
+
+    # Arquivamento de pedidos finalizados (retenção em memória limitada). Desativado se vazio.
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '')
+    ARCHIVE_AFTER_SECONDS = float(os.getenv('ARCHIVE_AFTER_SECONDS', 7 * 24 * 3600)) # Idade (última atualização) para arquivar
+    ARCHIVE_TERMINAL_STATUSES = tuple(os.getenv('ARCHIVE_TERMINAL_STATUSES', 'delivered,cancelled,returned').split(','))
+    ARCHIVE_INTERVAL_SECONDS = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', 60))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 5000)) # Pedidos por lote gravado
+    ARCHIVE_BLOCK_RECORDS = int(os.getenv('ARCHIVE_BLOCK_RECORDS', 256)) # Pedidos por bloco comprimido
+    ARCHIVE_SEGMENT_MAX_BYTES = int(os.getenv('ARCHIVE_SEGMENT_MAX_BYTES', 64 * 1024 * 1024))
+    ARCHIVE_CACHE_SIZE = int(os.getenv('ARCHIVE_CACHE_SIZE', 10000)) # Pedidos arquivados mantidos em cache (LRU)
@@ -0,0 +1,37 @@
+"""
+Configuração do gunicorn para execução com vários workers (pre-fork).
+
+Uso:
+    METRICS_MULTIPROCESS=true gunicorn -c gunicorn.conf.py
+
+Com METRICS_MULTIPROCESS=true, o diretório de métricas é limpo na inicialização
+do master e os arquivos de gauges de workers que morrem são removidos.
+"""
+import os
+import shutil
+
+from config.config import Config
+
+# Exporta o diretório antes de qualquer import do prometheus_client (no master e nos workers)
+if Config.METRICS_MULTIPROCESS:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = Config.METRICS_MULTIPROC_DIR
+
+wsgi_app = 'run:create_app()'
+bind = f"0.0.0.0:{Config.FLASK_APP_PORT}"
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+# Workers com threads: uma conexão de GET /orders/changes prende uma thread, não o worker inteiro
+# (CHANGE_FEED_MAX_BLOCKING_SUBSCRIBERS deixa ao menos uma livre para as demais requisições)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+
+def on_starting(server):
+    if Config.METRICS_MULTIPROCESS:
+        # Arquivos de uma execução anterior distorceriam os contadores agregados
+        shutil.rmtree(Config.METRICS_MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(Config.METRICS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from app.metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
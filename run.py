@@ -10,6 +10,7 @@ from flask import Flask
 from config.config import Config
 from app.routes import init_routes  # Será criado em app/routes.py
 from app.metrics import init_metrics_and_middleware # Será criado em app/metrics.py
+from app.admission import init_admission_control
 
 def create_app():
     app = Flask(__name__)
@@ -18,11 +19,23 @@ def create_app():
     # Inicializa as métricas e o middleware do Prometheus
     init_metrics_and_middleware(app)
 
+    # Controle de admissão (rate limit, limite de concorrência e prioridades)
+    init_admission_control(app)
+
     # Inicializa as rotas da aplicação
     init_routes(app)
 
     return app
 
+def create_asgi_app():
+    """
+    Aplicação ASGI (ex: uvicorn --factory run:create_asgi_app). Os endpoints de
+    pedidos mais usados rodam nas variantes assíncronas dos serviços; as demais
+    rotas são atendidas pela aplicação Flask de create_app() num pool de threads.
+    """
+    from app.asgi import AsgiApp
+    return AsgiApp(create_app(), Config.ASGI_WSGI_THREADS)
+
 if __name__ == '__main__':
     app = create_app()
     print(f"[*] Starting Flask API on http://localhost:{app.config['FLASK_APP_PORT']}")
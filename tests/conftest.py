@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Permite importar 'app' e 'config' a partir da raiz do projeto (como em run.py)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
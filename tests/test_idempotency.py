@@ -0,0 +1,94 @@
+import threading
+
+from app.idempotency import COALESCED, CONFLICT, HIT, MISS, TIMEOUT, IdempotencyStore
+
+
+def _store(**kwargs):
+    options = {"max_entries": 100, "ttl_seconds": 60, "wait_timeout_seconds": 5}
+    options.update(kwargs)
+    return IdempotencyStore(**options)
+
+
+def test_repeated_key_returns_cached_result():
+    store = _store()
+    calls = []
+
+    def operation():
+        calls.append(1)
+        return {"success": True, "status_code": 201}
+
+    assert store.execute("k1", "fp", operation) == ({"success": True, "status_code": 201}, MISS)
+    assert store.execute("k1", "fp", operation) == ({"success": True, "status_code": 201}, HIT)
+    assert len(calls) == 1
+
+
+def test_same_key_with_other_body_conflicts():
+    store = _store()
+    store.execute("k1", "fp-a", lambda: {"status_code": 201})
+    assert store.execute("k1", "fp-b", lambda: {"status_code": 201}) == (None, CONFLICT)
+
+
+def test_concurrent_requests_are_coalesced():
+    store = _store()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def operation():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"success": True, "status_code": 201}
+
+    outcomes = []
+    leader = threading.Thread(target=lambda: outcomes.append(store.execute("k1", "fp", operation)[1]))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: outcomes.append(store.execute("k1", "fp", operation)[1]))
+                 for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(outcomes) == sorted([MISS] + [COALESCED] * 4)
+
+
+def test_waiter_times_out_while_leader_runs():
+    store = _store(wait_timeout_seconds=0.05)
+    started = threading.Event()
+    release = threading.Event()
+
+    def operation():
+        started.set()
+        release.wait(5)
+        return {"status_code": 201}
+
+    leader = threading.Thread(target=store.execute, args=("k1", "fp", operation))
+    leader.start()
+    started.wait(5)
+    try:
+        assert store.execute("k1", "fp", operation) == (None, TIMEOUT)
+    finally:
+        release.set()
+        leader.join()
+
+
+def test_server_errors_are_not_cached():
+    store = _store()
+    results = iter([{"status_code": 503}, {"status_code": 201}])
+    assert store.execute("k1", "fp", lambda: next(results)) == ({"status_code": 503}, MISS)
+    assert store.execute("k1", "fp", lambda: next(results)) == ({"status_code": 201}, MISS)
+    assert len(store) == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    store = _store(max_entries=2)
+    for key in ("a", "b"):
+        store.execute(key, "fp", lambda: {"status_code": 201})
+    store.execute("a", "fp", lambda: {"status_code": 201})
+    store.execute("c", "fp", lambda: {"status_code": 201})
+    assert len(store) == 2
+    assert store.execute("b", "fp", lambda: {"status_code": 200})[1] == MISS
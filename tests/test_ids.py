@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+from app.archive import OrderArchive
+from app.ids import (
+    MAX_NODE_ID,
+    MAX_SLOT,
+    SLOT_BITS,
+    OrderIdGenerator,
+    claim_slot,
+    order_id_worker,
+    parse_order_id,
+)
+from app.store import OrderItem, OrderRecord, OrderStore
+
+
+class _Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ids_are_unique_and_increasing(tmp_path):
+    generator = OrderIdGenerator(0, str(tmp_path))
+    ids = [generator.next_id() for _ in range(20000)]
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+    assert all(parse_order_id(order_id) is not None for order_id in ids)
+
+
+def test_clock_going_back_does_not_repeat_ids(tmp_path):
+    clock = _Clock(1800000000.0)
+    generator = OrderIdGenerator(0, str(tmp_path), clock=clock)
+    before = [generator.next_id() for _ in range(3)]
+    clock.now -= 5
+    after = [generator.next_id() for _ in range(3)]
+    assert before + after == sorted(before + after)
+    assert len(set(before + after)) == 6
+
+
+def test_sequence_overflow_moves_to_next_millisecond(tmp_path):
+    generator = OrderIdGenerator(0, str(tmp_path), clock=_Clock(1800000000.0))
+    ids = [generator.next_id() for _ in range(5000)]
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+
+
+def test_worker_id_combines_node_and_slot(tmp_path):
+    first = OrderIdGenerator(3, str(tmp_path))
+    second = OrderIdGenerator(3, str(tmp_path))
+    workers = [order_id_worker(parse_order_id(generator.next_id())) for generator in (first, second)]
+    assert [worker >> SLOT_BITS for worker in workers] == [3, 3]
+    assert sorted(worker & MAX_SLOT for worker in workers) == [0, 1]
+
+
+def test_generators_sharing_a_directory_get_distinct_slots(tmp_path):
+    first = OrderIdGenerator(0, str(tmp_path))
+    second = OrderIdGenerator(0, str(tmp_path))
+    assert order_id_worker(parse_order_id(first.next_id())) != order_id_worker(parse_order_id(second.next_id()))
+
+
+def test_slot_is_released_when_its_lock_is_closed(tmp_path):
+    slot, fd = claim_slot(str(tmp_path))
+    os.close(fd)
+    assert claim_slot(str(tmp_path))[0] == slot
+
+
+def test_generator_continues_after_recovered_ids(tmp_path):
+    clock = _Clock(1800000000.0)
+    previous = OrderIdGenerator(0, str(tmp_path / "before"), clock=clock)
+    recovered = [previous.next_id() for _ in range(3)]
+
+    # Reinício com o relógio atrasado: continua depois do maior ID recuperado
+    clock.now -= 60
+    generator = OrderIdGenerator(0, str(tmp_path / "after"), history=lambda: recovered + ["ORDER-legacy"],
+                                 clock=clock)
+    next_id = generator.next_id()
+    assert order_id_worker(parse_order_id(next_id)) == order_id_worker(parse_order_id(recovered[0]))
+    assert next_id > max(recovered)
+
+
+def test_invalid_node_id_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        OrderIdGenerator(MAX_NODE_ID + 1, str(tmp_path))
+
+
+def test_generator_continues_after_archived_ids(tmp_path):
+    clock = _Clock(1800000000.0)
+    previous = OrderIdGenerator(0, str(tmp_path / "before"), clock=clock)
+    archived = [OrderRecord(previous.next_id(), "C1", (OrderItem("Mouse", "Mouse", 1, 50.0),), 50.0,
+                            "delivered", 1000.0, 1000.0) for _ in range(3)]
+    archive = OrderArchive(str(tmp_path / "archive"), segment_max_bytes=1 << 20, block_records=2, cache_size=10)
+    archive.open()
+    archive.append(archived)
+    archive.close()
+
+    # Reinício com o relógio atrasado, o store vazio e os pedidos só no arquivo
+    clock.now -= 60
+    archive = OrderArchive(str(tmp_path / "archive"), segment_max_bytes=1 << 20, block_records=2, cache_size=10)
+    archive.open()
+    assert archive.highest_order_id() == max(record.order_id for record in archived)
+    generator = OrderIdGenerator(1, str(tmp_path / "after"), clock=clock,
+                                 history=lambda: [OrderStore().highest_order_id(), archive.highest_order_id()])
+    assert generator.next_id() > archive.highest_order_id()
+    archive.close()
@@ -0,0 +1,80 @@
+import threading
+
+from app.services import Inventory
+from app.store import ProductCatalog
+
+PRODUCTS = {
+    "Mouse": {"name": "Mouse", "stock": 10, "price": 50.0},
+    "Teclado": {"name": "Teclado", "stock": 5, "price": 120.0},
+    "Monitor": {"name": "Monitor", "stock": 2, "price": 900.0},
+}
+
+
+class _Journal:
+    def __init__(self):
+        self.entries = []
+
+    def log_stock(self, product_id: str, stock: int):
+        self.entries.append((product_id, stock))
+
+
+def _inventory(stripes: int = 4):
+    catalog = ProductCatalog.from_dict(PRODUCTS)
+    return Inventory(catalog, stripes), catalog
+
+
+def test_reserve_and_release_update_stock():
+    inventory, catalog = _inventory()
+    assert inventory.reserve({"Mouse": 3, "Teclado": 2}) is None
+    assert catalog.get_stock("Mouse") == 7
+    assert catalog.get_stock("Teclado") == 3
+
+    inventory.release({"Mouse": 3, "Teclado": 2})
+    assert catalog.get_stock("Mouse") == 10
+    assert catalog.get_stock("Teclado") == 5
+
+
+def test_reserve_is_all_or_nothing():
+    inventory, catalog = _inventory()
+    assert inventory.reserve({"Mouse": 1, "Monitor": 3}) == "Monitor"
+    assert catalog.get_stock("Mouse") == 10
+    assert catalog.get_stock("Monitor") == 2
+
+
+def test_reserve_many_keeps_each_reservation_atomic():
+    inventory, catalog = _inventory()
+    results = inventory.reserve_many([{"Monitor": 2}, {"Mouse": 1, "Monitor": 1}, {"Mouse": 4}])
+    assert results == [None, "Monitor", None]
+    assert catalog.get_stock("Monitor") == 0
+    assert catalog.get_stock("Mouse") == 6
+
+
+def test_journal_receives_new_stock_of_each_change():
+    inventory, _ = _inventory()
+    inventory.journal = _Journal()
+    inventory.reserve({"Mouse": 2})
+    inventory.release({"Mouse": 1})
+    assert inventory.journal.entries == [("Mouse", 8), ("Mouse", 9)]
+
+
+def test_concurrent_reservations_never_oversell():
+    # Um único stripe para os três produtos e vários para cada um: o resultado não muda
+    for stripes in (1, 2, 64):
+        inventory, catalog = _inventory(stripes)
+        results = []
+        barrier = threading.Barrier(8)
+
+        def worker():
+            barrier.wait()
+            for _ in range(10):
+                results.append(inventory.reserve({"Teclado": 1, "Mouse": 1}))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results.count(None) == 5
+        assert catalog.get_stock("Teclado") == 0
+        assert catalog.get_stock("Mouse") == 5
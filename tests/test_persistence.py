@@ -0,0 +1,194 @@
+import glob
+import marshal
+import os
+import threading
+
+import pytest
+
+from app.analytics import SalesRollups
+from app.persistence import OrderPersistence, PersistenceError, _RECORD_HEADER, _SNAPSHOT_HEADER
+from app.store import OrderItem, OrderRecord, OrderStore, ProductCatalog, order_to_tuple
+
+PRODUCTS = {"Mouse": {"name": "Mouse", "stock": 100, "price": 50.0}}
+
+
+def _open(directory):
+    persistence = OrderPersistence(str(directory), snapshot_every_records=10 ** 9,
+                                   commit_delay_seconds=0, sync_commit=True)
+    store = OrderStore()
+    products = ProductCatalog.from_dict(PRODUCTS)
+    rollups = SalesRollups(60, 10)
+    persistence.recover(store, products, rollups)
+    store.journal = persistence
+    return persistence, store, products, rollups
+
+
+def _order(order_id: str, quantity: int = 1) -> OrderRecord:
+    return OrderRecord(order_id, "C1", (OrderItem("Mouse", "Mouse", quantity, 50.0),), 50.0 * quantity,
+                       "pending", 1000.0, 1000.0)
+
+
+def _last_wal_segment(directory) -> str:
+    return sorted(glob.glob(os.path.join(str(directory), 'wal-*.log')))[-1]
+
+
+def test_recovery_discards_torn_wal_tail(tmp_path):
+    persistence, store, products, _ = _open(tmp_path)
+    store.add(_order("A"))
+    store.add(_order("B"))
+    store.update("A", last_updated_at=1001.0, status="shipped")
+    persistence.sync()
+    persistence.close()
+
+    segment = _last_wal_segment(tmp_path)
+    valid_size = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        # Registro anunciando 100 bytes, interrompido depois de 10 (queda durante o write)
+        f.write(_RECORD_HEADER.pack(100, 0, 99) + b'x' * 10)
+
+    persistence, store, _, rollups = _open(tmp_path)
+    assert sorted(record.order_id for record in store.records()) == ["A", "B"]
+    assert store.get("A").status == "shipped"
+    assert os.path.getsize(segment) == valid_size
+    assert rollups.summary()["orders"] == 2
+
+    # O log continua depois do ponto truncado e é recuperado de novo
+    store.add(_order("C"))
+    persistence.sync()
+    persistence.close()
+    persistence, store, _, _ = _open(tmp_path)
+    assert "C" in store
+    persistence.close()
+
+
+def test_recovery_discards_tail_record_with_bad_checksum(tmp_path):
+    persistence, store, _, _ = _open(tmp_path)
+    store.add(_order("A"))
+    store.add(_order("B"))
+    persistence.sync()
+    persistence.close()
+
+    segment = _last_wal_segment(tmp_path)
+    with open(segment, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    persistence, store, _, _ = _open(tmp_path)
+    assert [record.order_id for record in store.records()] == ["A"]
+    persistence.close()
+
+
+def test_replay_after_fuzzy_snapshot_applies_each_change_once(tmp_path):
+    persistence, store, products, rollups = _open(tmp_path)
+    store.add(_order("A"))
+    store.add(_order("B"))
+
+    # Alterações entre a rotação do WAL e a captura: ficam no snapshot e também depois do LSN dele
+    rotate = persistence._wal.rotate
+
+    def rotate_with_concurrent_writes():
+        boundary = rotate()
+        store.add(_order("C"))
+        store.update("A", last_updated_at=1001.0, status="shipped")
+        products.set_stock("Mouse", 42)
+        persistence.log_stock("Mouse", 42)
+        return boundary
+
+    persistence._wal.rotate = rotate_with_concurrent_writes
+    persistence.take_snapshot()
+    persistence._wal.rotate = rotate
+    store.update("B", last_updated_at=1002.0, status="cancelled")
+    persistence.sync()
+    expected = rollups.summary()
+    persistence.close()
+
+    persistence, store, products, rollups = _open(tmp_path)
+    assert [record.order_id for record in store.records()] == ["A", "B", "C"]
+    assert (store.get("A").status, store.get("A").version) == ("shipped", 2)
+    assert store.get("B").status == "cancelled"
+    assert products.get_stock("Mouse") == 42
+    assert rollups.summary() == expected
+    assert rollups.summary()["orders"] == 3
+    persistence.close()
+
+
+def test_wal_write_failure_wakes_waiters(tmp_path):
+    persistence, store, _, _ = _open(tmp_path)
+
+    def failing_write(chunk):
+        raise OSError(28, "No space left on device")
+
+    persistence._wal._write = failing_write
+    store.add(_order("A"))
+
+    errors = []
+
+    def sync():
+        try:
+            persistence.sync()
+        except PersistenceError as e:
+            errors.append(e)
+
+    waiter = threading.Thread(target=sync)
+    waiter.start()
+    waiter.join(timeout=5)
+    assert not waiter.is_alive()
+    assert len(errors) == 1
+    with pytest.raises(PersistenceError):
+        persistence.sync()
+    persistence.close()
+
+
+def test_snapshot_restores_indexes_and_loads_orders_on_access(tmp_path):
+    persistence, store, _, _ = _open(tmp_path)
+    for number in range(5):
+        store.add(OrderRecord(f"O{number}", f"C{number % 2}", (OrderItem("Mouse", "Mouse", 1, 50.0),), 50.0,
+                              "pending", 1000.0 + number, 1000.0 + number))
+    store.update("O1", last_updated_at=2000.0, status="shipped")
+    store.remove([store.get("O3")])
+    persistence.take_snapshot()
+    persistence.close()
+
+    persistence, store, _, rollups = _open(tmp_path)
+    assert sum(record.__class__ is bytes for record in store._records) == 4
+    assert [record.order_id for record in store.query(customer_id="C1")[0]] == ["O1"]
+    assert [record.order_id for record in store.query(status="pending")[0]] == ["O0", "O2", "O4"]
+    assert (store.get("O1").status, store.get("O1").version, store.get("O1").seq) == ("shipped", 2, 1)
+    assert store.seq_after("O3") is None and "O3" not in store
+    assert store.add(_order("O5")).seq == 5
+    assert rollups.summary()["orders"] == 6
+    persistence.close()
+
+
+def test_recovery_reads_snapshot_in_previous_format(tmp_path):
+    with open(os.path.join(str(tmp_path), f'snapshot-{0:020d}.bin'), 'wb') as f:
+        f.write(_SNAPSHOT_HEADER.pack(b'APSNAP01', 0))
+        marshal.dump(([order_to_tuple(_order("A")), order_to_tuple(_order("B"))], {"Mouse": 7}), f)
+
+    persistence, store, products, rollups = _open(tmp_path)
+    assert [record.order_id for record in store.records()] == ["A", "B"]
+    assert products.get_stock("Mouse") == 7
+    persistence.close()
+
+
+def test_discard_undoes_an_order_that_was_not_persisted():
+    store = OrderStore()
+    store.rollups = SalesRollups(60, 10)
+    store.add(_order("A"))
+    before = store.rollups.summary()
+    store.add(_order("B", quantity=3))
+    assert store.discard("B").order_id == "B"
+    assert "B" not in store
+    assert store.rollups.summary() == before
+    assert store.rollups.customer("C1") == {"customer_id": "C1", "revenue": 50.0, "orders": 1}
+    assert store.discard("B") is None
+
+
+def test_directory_is_locked_by_one_process(tmp_path):
+    persistence, _, _, _ = _open(tmp_path)
+    with pytest.raises(RuntimeError):
+        OrderPersistence(str(tmp_path), snapshot_every_records=10, commit_delay_seconds=0, sync_commit=True)
+    persistence.close()
+    OrderPersistence(str(tmp_path), snapshot_every_records=10, commit_delay_seconds=0, sync_commit=True).close()
@@ -0,0 +1,71 @@
+from app.store import OrderItem, OrderRecord, OrderStore
+
+
+def _order(number: int, status: str = "delivered", customer_id: str = "C1") -> OrderRecord:
+    return OrderRecord(f"LEGACY-{number:06d}", customer_id, (OrderItem("Mouse", "Mouse", 1, 50.0),), 50.0,
+                       status, 1000.0 + number, 1000.0 + number)
+
+
+def _store(count: int, stuck: int = 0) -> OrderStore:
+    # Os 'stuck' primeiros pedidos ficam pendentes e nunca saem pela retenção
+    store = OrderStore()
+    for number in range(count):
+        store.add(_order(number, "pending" if number < stuck else "delivered", f"C{number % 3}"))
+    return store
+
+
+def test_interior_removals_are_compacted():
+    store = _store(5000, stuck=1)
+    removed = store.remove(store.retention_candidates(("delivered",), 10 ** 9, 4000))
+    assert len(removed) == 4000
+    assert len(store._records) < 2000
+    assert len(store._records) == len(store._seqs) == len(store._created_at) == len(store._ids)
+    assert store.get("LEGACY-000000").status == "pending"
+
+
+def test_queries_keep_working_after_compaction():
+    store = _store(3000)
+    store.remove([store.get(f"LEGACY-{number:06d}") for number in range(0, 3000, 2)][:1400])
+    store.remove([store.get(f"LEGACY-{number:06d}") for number in range(1, 1000, 2)])
+
+    expected = [f"LEGACY-{number:06d}" for number in range(2800, 3000, 2)] + \
+        [f"LEGACY-{number:06d}" for number in range(1001, 3000, 2)]
+    records, next_seq = store.query(limit=10 ** 6)
+    assert sorted(record.order_id for record in records) == sorted(expected)
+    assert next_seq is None
+
+    page, next_seq = store.query(customer_id="C1", limit=50)
+    rest, _ = store.query(customer_id="C1", start=next_seq, limit=10 ** 6)
+    assert [record.order_id for record in page + rest] == \
+        [record.order_id for record in records if record.customer_id == "C1"]
+
+    since, _ = store.query(since=3900.0, limit=10 ** 6)
+    assert [record.created_at for record in since] == sorted(record.created_at for record in since)
+    assert all(record.created_at >= 3900.0 for record in since)
+    assert len(since) == 100
+
+    store.update("LEGACY-002999", last_updated_at=5000.0, status="returned")
+    assert store.stats()["by_status"] == {"delivered": len(expected) - 1, "returned": 1}
+    assert store.seq_after("LEGACY-002999") == store.get("LEGACY-002999").seq + 1
+
+
+def test_new_orders_after_compaction_keep_increasing_seq():
+    store = _store(2100)
+    last_seq = store.get("LEGACY-002099").seq
+    store.remove(store.records())
+    assert len(store) == 0
+    assert len(store._records) == 1
+    record = store.add(_order(5000))
+    assert record.seq == last_seq + 1
+    assert store.query()[0] == [record]
+
+
+def test_remove_updates_indexes_in_runs():
+    store = _store(30)
+    store.remove([store.get(f"LEGACY-{number:06d}") for number in (0, 1, 2, 7, 8, 20, 29)])
+    for customer_id in ("C0", "C1", "C2"):
+        seqs = list(store._by_customer[customer_id])
+        assert seqs == sorted(seqs)
+        assert [store.get(record.order_id) for record in store.query(customer_id=customer_id, limit=100)[0]]
+        assert len(seqs) == len([r for r in store.records() if r.customer_id == customer_id])
+    assert len(store._by_status["delivered"]) == 23